@@ -114,6 +114,10 @@ swagger_template = {
 
 swagger = Swagger(app, config=swagger_config, template=swagger_template)
 
+# LLM gateway quá tải (lỗi không được controller bắt) -> 429 + Retry-After
+from src.llm_gateway import GatewaySaturated, saturated_response
+app.register_error_handler(GatewaySaturated, saturated_response)
+
 # Register all blueprints with /api prefix
 for blueprint in all_blueprints:
     app.register_blueprint(blueprint, url_prefix='/api')
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Chế độ chạy ASGI (uvicorn) cho production:
+
+    uvicorn asgi:asgi_app --host 0.0.0.0 --port 5000
+    # hoặc: python asgi.py
+
+Flask app được bọc bằng FlaskAsgiApp (src/asgi_server.py): mỗi request chạy trong
+thread pool riêng (SERVER__ASGI_THREADS worker), nên các request chờ
+Ollama (đã bị giới hạn bởi OLLAMA__MAX_CONCURRENCY, xem src/llm_gateway.py)
+không chặn các endpoint nhẹ như /api/system/status. Response stream (SSE) được
+gửi đi theo từng chunk.
+"""
+import os
+
+from app import app
+from src.asgi_server import FlaskAsgiApp
+from src.config import ServerConfig
+
+
+asgi_app = FlaskAsgiApp(app, ServerConfig.AsgiThreads)
+
+if __name__ == '__main__':
+    import uvicorn
+    port = int(os.environ.get('PORT', 5000))
+    print(f"Starting Local LLM Chat App (ASGI) on port {port} with {ServerConfig.AsgiThreads} worker threads")
+    uvicorn.run(asgi_app, host='0.0.0.0', port=port)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Migration script để thêm trường content_hash (sha256 nội dung) vào bảng files
+"""
+
+import sys
+import os
+import hashlib
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src.database import get_db, File
+from sqlalchemy import text
+
+def file_sha256(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def migrate_content_hash():
+    """Thêm cột content_hash và tính hash cho các file đã có"""
+    db = next(get_db())
+    try:
+        try:
+            db.execute(text("ALTER TABLE files ADD COLUMN content_hash VARCHAR(64)"))
+            print("✓ Đã thêm cột content_hash vào bảng files")
+        except Exception as e:
+            print(f"ℹ Cột content_hash đã tồn tại hoặc lỗi: {e}")
+
+        try:
+            db.execute(text("CREATE INDEX ix_files_content_hash ON files (content_hash)"))
+            print("✓ Đã tạo index ix_files_content_hash")
+        except Exception as e:
+            print(f"ℹ Index ix_files_content_hash đã tồn tại hoặc lỗi: {e}")
+
+        # File cũ giữ nguyên đường dẫn, chỉ tính hash để upload trùng nội dung dùng lại được
+        updated = 0
+        for file in db.query(File).filter(File.content_hash == None).all():
+            if not os.path.exists(file.file_path):
+                print(f"ℹ Bỏ qua {file.original_name}: không tìm thấy {file.file_path}")
+                continue
+            file.content_hash = file_sha256(file.file_path)
+            updated += 1
+
+        db.commit()
+        print(f"✓ Đã tính content_hash cho {updated} file")
+        print("✓ Migration hoàn thành thành công!")
+
+    except Exception as e:
+        db.rollback()
+        print(f"✗ Lỗi migration: {e}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    print("Bắt đầu migration content_hash...")
+    migrate_content_hash()
@@ -1,61 +1,280 @@
 #!/usr/bin/env python3
 """
 Script để reindex tất cả files hiện có vào FAISS database
+
+Mặc định chạy incremental: chỉ embed lại file mới hoặc đã thay đổi (so theo
+fingerprint size/mtime/sha256/model/phiên bản metadata chunk) và xóa vector của file đã bị xóa hoặc vô hiệu hóa.
+Dùng --full để embed lại toàn bộ, --workers N để parse/embed song song.
+Tiến độ được checkpoint định kỳ; chạy lại sau khi bị ngắt sẽ tiếp tục từ chỗ dừng.
+Script giữ khóa ghi index (FAISS__INDEX_PATH + ".lock") và không chạy khi app đang ghi index.
 """
 import os
 import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 sys.path.append('src')
 
+from src.config import FaissConfig
 from src.database import get_db, File as DBFile
 from src.file_utils.file_loader import load_document_from_file
+from src.file_utils.text_chunker import chunk_documents
+from src.index_fingerprints import compute_fingerprint, is_unchanged, load_fingerprints, save_fingerprints
 import src.vectordb as vectordb
 
-def reindex_all_files():
-    """Reindex tất cả files trong database vào FAISS"""
-    print("=== REINDEXING FILES TO FAISS ===")
-    
+# Số file xử lý xong giữa hai lần flush index + lưu checkpoint
+CHECKPOINT_EVERY = 20
+
+def parse_file(file_path: str):
+    """Load và chia chunk một file (chạy được trong process con)"""
+    return chunk_documents(load_document_from_file(file_path))
+
+def attach_metadata(documents, file):
+    for doc in documents:
+        doc.metadata.update({
+            "source": "uploaded_file",
+            "file_id": file.id,
+            "file_name": file.original_name,
+            "file_type": file.file_type,
+            "uploaded_by": file.uploaded_by,
+            "department": file.department
+        })
+    return documents
+
+def write_file_vectors(vectorstore, file, documents, embeddings) -> int:
+    """Writer duy nhất: xóa vector cũ của file rồi thêm vector mới"""
+    vectordb.remove_by_file_id(vectorstore, file.id)
+    return vectordb.add_embedded_documents(vectorstore, documents, embeddings)
+
+def lock_index():
+    """Lấy khóa ghi index trước khi đọc index: app giữ vectorstore riêng trong bộ nhớ,
+    hai process cùng flush sẽ ghi đè mất vector của nhau"""
+    try:
+        vectordb.acquire_writer_lock()
+    except vectordb.IndexLockedError as e:
+        print(f"✗ {e}")
+        print("Dừng app (hoặc đợi lần reindex khác chạy xong) rồi chạy lại")
+        sys.exit(1)
+
+def load_checkpoint(full: bool) -> set:
+    if not os.path.exists(FaissConfig.ReindexCheckpointPath):
+        return set()
+    try:
+        with open(FaissConfig.ReindexCheckpointPath, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('full') != full:
+            return set()
+        return set(checkpoint.get('done', []))
+    except Exception as e:
+        print(f"⚠ Could not read checkpoint, starting over: {e}")
+        return set()
+
+def save_checkpoint(full: bool, done: set):
+    tmp_path = f"{FaissConfig.ReindexCheckpointPath}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'full': full, 'done': sorted(done)}, f)
+    os.replace(tmp_path, FaissConfig.ReindexCheckpointPath)
+
+class ReindexProgress:
+    """Theo dõi tiến độ, in files/sec + ETA và checkpoint định kỳ"""
+
+    def __init__(self, vectorstore, total: int, full: bool, fingerprints: dict, done: set, summary: dict):
+        self.vectorstore = vectorstore
+        self.total = total
+        self.full = full
+        self.fingerprints = fingerprints
+        self.done = done
+        self.summary = summary
+        self.completed = 0
+        self.started_at = time.time()
+
+    def checkpoint(self):
+        # Flush trước rồi mới ghi checkpoint để checkpoint không bao giờ đi trước index trên đĩa
+        vectordb.flush(self.vectorstore)
+        save_fingerprints(self.fingerprints)
+        save_checkpoint(self.full, self.done)
+
+    def file_finished(self, file, chunk_count: int = None, error: Exception = None, previous: dict = None):
+        self.completed += 1
+        if error is not None:
+            print(f"✗ Error indexing {file.original_name}: {error}")
+            self.summary['failed'].append(file.original_name)
+        else:
+            self.fingerprints[file.id] = compute_fingerprint(file.file_path)
+            self.done.add(file.id)
+            self.summary['changed' if previous else 'added'].append(file.original_name)
+            if chunk_count:
+                print(f"✓ Successfully indexed: {file.original_name} ({chunk_count} chunks)")
+            else:
+                print(f"⚠ No content extracted from: {file.original_name}")
+
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        rate = self.completed / elapsed
+        eta = (self.total - self.completed) / rate if rate else 0
+        print(f"Progress: {self.completed}/{self.total} files ({rate:.2f} files/s, ETA {int(eta // 60)}m{int(eta % 60):02d}s)")
+
+        if self.completed % CHECKPOINT_EVERY == 0:
+            self.checkpoint()
+
+def index_sequential(vectorstore, jobs, progress: ReindexProgress):
+    for file, previous in jobs:
+        try:
+            print(f"Processing file: {file.original_name}")
+            documents = attach_metadata(parse_file(file.file_path), file)
+            embeddings = vectorstore.embedding_function.embed_documents([doc.page_content for doc in documents])
+            progress.file_finished(file, write_file_vectors(vectorstore, file, documents, embeddings), previous=previous)
+        except Exception as e:
+            progress.file_finished(file, error=e)
+
+def index_parallel(vectorstore, jobs, progress: ReindexProgress, workers: int):
+    """Parse trong process pool, embed song song theo batch, một writer duy nhất ghi vào index"""
+    embed = vectorstore.embedding_function.embed_documents
+    with ProcessPoolExecutor(max_workers=workers) as parse_pool, ThreadPoolExecutor(max_workers=workers) as embed_pool:
+        parse_jobs = {parse_pool.submit(parse_file, file.file_path): (file, previous) for file, previous in jobs}
+        embed_jobs = {}
+        pending = set(parse_jobs)
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in parse_jobs:
+                    file, previous = parse_jobs.pop(future)
+                    try:
+                        documents = attach_metadata(future.result(), file)
+                    except Exception as e:
+                        progress.file_finished(file, error=e)
+                        continue
+                    embed_future = embed_pool.submit(embed, [doc.page_content for doc in documents])
+                    embed_jobs[embed_future] = (file, previous, documents)
+                    pending.add(embed_future)
+                else:
+                    file, previous, documents = embed_jobs.pop(future)
+                    try:
+                        chunk_count = write_file_vectors(vectorstore, file, documents, future.result())
+                        progress.file_finished(file, chunk_count, previous=previous)
+                    except Exception as e:
+                        progress.file_finished(file, error=e)
+
+def reindex_all_files(full: bool = False, workers: int = 1, restart: bool = False):
+    """Reindex files trong database vào FAISS"""
+    print(f"=== REINDEXING FILES TO FAISS ({'full' if full else 'incremental'}, {workers} worker(s)) ===")
+    lock_index()
+
     db = next(get_db())
+    progress = None
     try:
         files = db.query(DBFile).filter(DBFile.is_active == True).all()
-        print(f"Found {len(files)} active files to reindex")
-        
-        vectorstore = vectordb.init_vector_store()
-        indexed_count = 0
-        
+        print(f"Found {len(files)} active files")
+
+        vectorstore = vectordb.get_vector_store()
+        fingerprints = load_fingerprints()
+        done = set() if restart else load_checkpoint(full)
+        if done:
+            print(f"Resuming from checkpoint: {len(done)} files already indexed")
+        summary = {'added': [], 'changed': [], 'unchanged': [], 'removed': [], 'missing': [], 'failed': []}
+
+        jobs = []
         for file in files:
-            if os.path.exists(file.file_path):
-                try:
-                    print(f"Processing file: {file.original_name}")
-                    documents = load_document_from_file(file.file_path)
-                    
-                    if documents:
-                        for doc in documents:
-                            metadata = {
-                                "source": "uploaded_file",
-                                "file_id": file.id,
-                                "file_name": file.original_name,
-                                "file_type": file.file_type,
-                                "uploaded_by": file.uploaded_by
-                            }
-                            vectordb.add_document(vectorstore, doc.page_content, metadata)
-                        
-                        indexed_count += 1
-                        print(f"✓ Successfully indexed: {file.original_name}")
-                    else:
-                        print(f"⚠ No content extracted from: {file.original_name}")
-                        
-                except Exception as e:
-                    print(f"✗ Error indexing {file.original_name}: {e}")
-            else:
+            if not os.path.exists(file.file_path):
                 print(f"⚠ File not found: {file.file_path}")
-        
+                summary['missing'].append(file.original_name)
+                continue
+
+            previous = fingerprints.get(file.id)
+            if file.id in done or (not full and is_unchanged(file.file_path, previous)):
+                summary['unchanged'].append(file.original_name)
+                continue
+            jobs.append((file, previous))
+
+        print(f"{len(jobs)} files to index")
+        progress = ReindexProgress(vectorstore, len(jobs), full, fingerprints, done, summary)
+        if workers > 1 and len(jobs) > 1:
+            index_parallel(vectorstore, jobs, progress, workers)
+        else:
+            index_sequential(vectorstore, jobs, progress)
+
+        # Xóa vector của file đã bị xóa / vô hiệu hóa / không còn trên đĩa
+        live_ids = {file.id for file in files if os.path.exists(file.file_path)}
+        stale_ids = (vectordb.get_indexed_file_ids(vectorstore) | set(fingerprints.keys())) - live_ids
+        for file_id in stale_ids:
+            removed = vectordb.remove_by_file_id(vectorstore, file_id)
+            fingerprints.pop(file_id, None)
+            summary['removed'].append(f"{file_id} ({removed} vectors)")
+
+        # Index đã đủ lớn (hoặc đổi cấu hình) thì chuyển sang loại index cấu hình (IVF-PQ/HNSW)
+        if vectordb.needs_rebuild(vectorstore):
+            vectordb.rebuild_index(vectorstore)
+
+        # Ghi index xuống đĩa một lần ở cuối thay vì sau mỗi document
+        vectordb.flush(vectorstore)
+        save_fingerprints(fingerprints)
+        if os.path.exists(FaissConfig.ReindexCheckpointPath):
+            os.remove(FaissConfig.ReindexCheckpointPath)
+
         print(f"\n=== REINDEX COMPLETE ===")
-        print(f"Successfully indexed: {indexed_count}/{len(files)} files")
-        
+        for key in ('added', 'changed', 'removed', 'missing', 'failed'):
+            print(f"{key.capitalize()}: {len(summary[key])}")
+            for name in summary[key]:
+                print(f"  - {name}")
+        print(f"Unchanged: {len(summary['unchanged'])}")
+        return summary
+
+    except KeyboardInterrupt:
+        if progress is not None:
+            print("\nInterrupted, saving checkpoint...")
+            progress.checkpoint()
+        raise
     except Exception as e:
         print(f"Error during reindexing: {e}")
     finally:
         db.close()
 
+def compact_index():
+    """Dựng lại index FAISS không còn các vector đã bị xóa"""
+    lock_index()
+    vectorstore = vectordb.get_vector_store()
+    print(f"Dead vector ratio: {vectordb.dead_ratio(vectorstore):.1%}")
+    dropped = vectordb.compact(vectorstore)
+    vectordb.flush(vectorstore)
+    print(f"=== COMPACTION COMPLETE: dropped {dropped} vectors, {vectorstore.index.ntotal} remaining ===")
+
+def rebuild_index(index_type: str = None):
+    """Train/migrate index FAISS sang loại được cấu hình (hoặc --index-type)"""
+    lock_index()
+    vectorstore = vectordb.get_vector_store()
+    built_type = vectordb.rebuild_index(vectorstore, index_type=index_type)
+    vectordb.flush(vectorstore)
+    print(f"=== INDEX REBUILT: {built_type}, {vectorstore.index.ntotal} vectors ===")
+
+def benchmark_index(k: int = 10):
+    """In bảng recall@k / latency của flat, ivfpq, hnsw trên các vector hiện có"""
+    from src.faiss_index import benchmark
+    vectorstore = vectordb.get_vector_store()
+    _, vectors = vectordb.get_live_vectors(vectorstore)
+    if vectors is None:
+        print("Index is empty, nothing to benchmark")
+        return
+    print(f"=== BENCHMARK ({len(vectors)} vectors, k={k}) ===")
+    print(f"{'type':<8} {'built as':<9} {'recall':>8} {'latency ms':>11} {'build s':>8}")
+    for row in benchmark(vectors, k=k):
+        print(f"{row['requested_type']:<8} {row['actual_type']:<9} {row[f'recall@{k}']:>8.3f} "
+              f"{row['latency_ms']:>11.3f} {row['build_seconds']:>8.2f}")
+
 if __name__ == "__main__":
-    reindex_all_files() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Reindex files vào FAISS")
+    parser.add_argument('--full', action='store_true', help="Embed lại toàn bộ file, bỏ qua fingerprint")
+    parser.add_argument('--workers', type=int, default=1, help="Số worker parse/embed song song")
+    parser.add_argument('--restart', action='store_true', help="Bỏ qua checkpoint của lần chạy trước")
+    parser.add_argument('--compact', action='store_true', help="Chỉ compact index (loại bỏ vector đã xóa) rồi thoát")
+    parser.add_argument('--rebuild-index', action='store_true', help="Train/migrate index sang loại cấu hình rồi thoát")
+    parser.add_argument('--index-type', choices=['flat', 'ivfpq', 'hnsw'], help="Loại index cho --rebuild-index")
+    parser.add_argument('--benchmark', action='store_true', help="So sánh recall/latency các loại index rồi thoát")
+    args = parser.parse_args()
+    if args.compact:
+        compact_index()
+    elif args.rebuild_index:
+        rebuild_index(args.index_type)
+    elif args.benchmark:
+        benchmark_index()
+    else:
+        reindex_all_files(full=args.full, workers=max(args.workers, 1), restart=args.restart)
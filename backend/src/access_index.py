@@ -0,0 +1,93 @@
+import threading
+from typing import Dict, Iterable, Optional, Set
+
+
+class AccessIndex:
+    """Index quyền xem file: owner -> file ids, department -> file ids, user được cấp quyền -> file ids.
+
+    Cùng quy tắc với ChatManager.build_access_filter: user thường thấy file mình upload, file của
+    department mình và file được cấp quyền đọc (FilePermission). Search chỉ duyệt tập file này
+    thay vì quét toàn bộ index rồi lọc từng file."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_owner: Dict[str, Set[str]] = {}
+        self._by_department: Dict[str, Set[str]] = {}
+        self._by_grantee: Dict[str, Set[str]] = {}
+        self._files: Dict[str, tuple] = {}  # file_id -> (owner, department)
+        self._grants: Dict[str, Set[str]] = {}  # file_id -> user ids
+
+    @staticmethod
+    def _discard(mapping: Dict[str, Set[str]], key: Optional[str], file_id: str):
+        ids = mapping.get(key)
+        if ids is not None:
+            ids.discard(file_id)
+            if not ids:
+                del mapping[key]
+
+    def _drop_grants(self, file_id: str):
+        for user_id in self._grants.pop(file_id, ()):
+            self._discard(self._by_grantee, user_id, file_id)
+
+    def _add_grants(self, file_id: str, user_ids: Set[str]):
+        if user_ids:
+            self._grants[file_id] = user_ids
+            for user_id in user_ids:
+                self._by_grantee.setdefault(user_id, set()).add(file_id)
+
+    def set_file(self, file_id: str, owner: str, department: str = None):
+        with self._lock:
+            old = self._files.get(file_id)
+            if old == (owner, department):
+                return
+            if old is not None:
+                self._discard(self._by_owner, old[0], file_id)
+                self._discard(self._by_department, old[1], file_id)
+            self._files[file_id] = (owner, department)
+            self._by_owner.setdefault(owner, set()).add(file_id)
+            if department:
+                self._by_department.setdefault(department, set()).add(file_id)
+
+    def remove_file(self, file_id: str):
+        """Bỏ file cùng các quyền đã cấp trên file đó"""
+        with self._lock:
+            old = self._files.pop(file_id, None)
+            if old is not None:
+                self._discard(self._by_owner, old[0], file_id)
+                self._discard(self._by_department, old[1], file_id)
+            self._drop_grants(file_id)
+
+    def set_grants(self, file_id: str, user_ids: Iterable[str]):
+        """Thay toàn bộ danh sách user được cấp quyền đọc file"""
+        with self._lock:
+            self._drop_grants(file_id)
+            self._add_grants(file_id, set(user_ids or ()))
+
+    def replace_all_grants(self, grants: Dict[str, Iterable[str]]):
+        """Nạp lại toàn bộ quyền đã cấp (đồng bộ với bảng file_permissions)"""
+        with self._lock:
+            self._by_grantee = {}
+            self._grants = {}
+            for file_id, user_ids in grants.items():
+                self._add_grants(file_id, set(user_ids))
+
+    def grantees(self, file_id: str) -> Set[str]:
+        with self._lock:
+            return set(self._grants.get(file_id, ()))
+
+    def owned_by(self, owners: Iterable[str]) -> Set[str]:
+        with self._lock:
+            return set().union(*(self._by_owner.get(owner, ()) for owner in owners))
+
+    def in_departments(self, departments: Iterable[str]) -> Set[str]:
+        with self._lock:
+            return set().union(*(self._by_department.get(department, ()) for department in departments))
+
+    def visible(self, user_id: str, department: str = None) -> Set[str]:
+        """Các file id user được xem (file có thể chưa có trong index tìm kiếm)"""
+        with self._lock:
+            ids = set(self._by_owner.get(user_id, ()))
+            ids.update(self._by_grantee.get(user_id, ()))
+            if department:
+                ids.update(self._by_department.get(department, ()))
+            return ids
@@ -5,6 +5,7 @@ from typing import Dict, List, Optional, Any
 from datetime import datetime
 from langchain_ollama import ChatOllama
 from src.config import OllamaConfig
+from src.llm_gateway import call_llm, Priority, GatewaySaturated
 from src.file_search import file_search_engine
 from src.file_classifier import file_classifier
 from src.cloud_integration import cloud_integration
@@ -104,7 +105,7 @@ class AgenticAI:
             """
             
             # Gọi AI để lên kế hoạch
-            response = self.llm.invoke(prompt)
+            response = call_llm(self.llm.invoke, prompt, priority=Priority.AGENTIC)
             plan_text = response.content.strip()
             
             # Parse JSON từ response
@@ -129,6 +130,8 @@ class AgenticAI:
                 'created_at': datetime.utcnow().isoformat()
             }
             
+        except GatewaySaturated:
+            raise
         except Exception as e:
             return {
                 'success': False,
@@ -0,0 +1,174 @@
+import re
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional
+
+import numpy as np
+from flask import has_request_context, request
+from langchain.schema import Document
+
+from src.config import AnswerCacheConfig
+
+
+def normalize_question(question: str) -> str:
+    """NFC, chữ thường, gộp khoảng trắng, bỏ dấu câu ở cuối"""
+    question = unicodedata.normalize('NFC', question or '').lower()
+    question = re.sub(r'\s+', ' ', question).strip()
+    return question.rstrip(' ?!.…')
+
+
+def document_signature(documents: List[Document], memory_scope: str = None, caller: str = None) -> tuple:
+    """Định danh các chunk tài liệu được retrieve, kèm loại người gọi (admin/public/user) để câu trả
+    lời admin tạo từ mọi file không dùng cho public chat. Bộ nhớ hội thoại là riêng của từng scope
+    nên khi prompt có Q&A cũ, chữ ký gồm memory_scope và hash các mục bộ nhớ đã dùng"""
+    signature = {f"caller:{caller or ''}"}
+    memory = []
+    for doc in documents:
+        metadata = doc.metadata or {}
+        content_hash = hashlib.sha1(doc.page_content.encode('utf-8')).hexdigest()[:16]
+        if metadata.get('source') == 'chat-history':
+            memory.append(f"{metadata.get('memory_id', '')}:{content_hash}")
+            continue
+        signature.add(f"{metadata.get('file_id', metadata.get('source', ''))}:{content_hash}")
+    if memory:
+        memory_hash = hashlib.sha1('|'.join(sorted(memory)).encode('utf-8')).hexdigest()[:16]
+        signature.add(f"memory:{memory_scope or ''}:{memory_hash}")
+    return tuple(sorted(signature))
+
+
+def current_endpoint() -> str:
+    if has_request_context() and request.endpoint:
+        return request.endpoint
+    return 'internal'
+
+
+class AnswerCache:
+    """Cache câu trả lời của workflow RAG (in-memory, LRU + TTL).
+
+    Key = (câu hỏi chuẩn hóa, chữ ký người gọi + các chunk + mục bộ nhớ được retrieve, model). Khi không khớp
+    chính xác, có thể dùng lại câu trả lời của câu hỏi gần giống (cosine >=
+    SimilarityThreshold) nhưng chỉ khi retrieve ra đúng cùng các chunk. Mục trích dẫn
+    một file bị xóa khi file đó bị index lại hoặc xóa.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, Dict]" = OrderedDict()
+        # (chữ ký, model) -> key, cho lookup theo độ tương đồng
+        self._by_signature = defaultdict(set)
+        # file_id -> key, cho invalidation
+        self._by_file = defaultdict(set)
+        self._stats = defaultdict(lambda: {'hits': 0, 'similar_hits': 0, 'misses': 0})
+
+    def _drop(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        _, signature, model = key
+        self._by_signature[(signature, model)].discard(key)
+        if not self._by_signature[(signature, model)]:
+            del self._by_signature[(signature, model)]
+        for file_id in entry['file_ids']:
+            self._by_file[file_id].discard(key)
+            if not self._by_file[file_id]:
+                del self._by_file[file_id]
+
+    def _fresh(self, key: tuple, now: float) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is not None and now - entry['created_at'] > AnswerCacheConfig.TtlSeconds:
+            self._drop(key)
+            return None
+        return entry
+
+    def get(self, question: str, documents: List[Document], model: str,
+            embedding: List[float] = None, endpoint: str = None, memory_scope: str = None,
+            caller: str = None) -> Optional[str]:
+        if not AnswerCacheConfig.Enabled:
+            return None
+        endpoint = endpoint or current_endpoint()
+        signature = document_signature(documents, memory_scope, caller)
+        key = (normalize_question(question), signature, model)
+        now = time.time()
+        with self._lock:
+            stats = self._stats[endpoint]
+            entry = self._fresh(key, now)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                stats['hits'] += 1
+                return entry['answer']
+
+            threshold = AnswerCacheConfig.SimilarityThreshold
+            if threshold and embedding is not None:
+                query = np.asarray(embedding, dtype=np.float32)
+                query = query / (np.linalg.norm(query) or 1.0)
+                best_key, best_score = None, threshold
+                for candidate in list(self._by_signature.get((signature, model), ())):
+                    candidate_entry = self._fresh(candidate, now)
+                    if candidate_entry is None or candidate_entry['vector'] is None:
+                        continue
+                    score = float(candidate_entry['vector'] @ query)
+                    if score >= best_score:
+                        best_key, best_score = candidate, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    stats['similar_hits'] += 1
+                    return self._entries[best_key]['answer']
+
+            stats['misses'] += 1
+            return None
+
+    def put(self, question: str, documents: List[Document], model: str, answer: str,
+            embedding: List[float] = None, memory_scope: str = None, caller: str = None):
+        if not AnswerCacheConfig.Enabled or not answer:
+            return
+        signature = document_signature(documents, memory_scope, caller)
+        key = (normalize_question(question), signature, model)
+        vector = None
+        if embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        file_ids = {doc.metadata['file_id'] for doc in documents if (doc.metadata or {}).get('file_id')}
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = {
+                'answer': answer,
+                'vector': vector,
+                'file_ids': file_ids,
+                'created_at': time.time()
+            }
+            self._by_signature[(signature, model)].add(key)
+            for file_id in file_ids:
+                self._by_file[file_id].add(key)
+            while len(self._entries) > AnswerCacheConfig.MaxEntries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_file(self, file_id: str) -> int:
+        """Xóa các câu trả lời trích dẫn file (gọi khi file bị index lại hoặc xóa)"""
+        with self._lock:
+            keys = list(self._by_file.get(file_id, ()))
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_signature.clear()
+            self._by_file.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            endpoints = {}
+            for endpoint, stats in self._stats.items():
+                lookups = stats['hits'] + stats['similar_hits'] + stats['misses']
+                endpoints[endpoint] = {
+                    **stats,
+                    'hit_rate': round((stats['hits'] + stats['similar_hits']) / lookups, 4) if lookups else 0.0
+                }
+            return {'entries': len(self._entries), 'endpoints': endpoints}
+
+
+answer_cache = AnswerCache()
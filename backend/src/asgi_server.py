@@ -0,0 +1,133 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from asgiref.sync import async_to_sync, sync_to_async
+
+
+def build_environ(scope, body) -> dict:
+    """ASGI http scope + body -> WSGI environ (PEP 3333)"""
+    script_name = scope.get('root_path', '').encode('utf8').decode('latin1')
+    path_info = scope['path'].encode('utf8').decode('latin1')
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name,
+        'PATH_INFO': path_info,
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': BytesIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class _WsgiRequest:
+    """Một request: WSGI app chạy trên thread của pool, response gửi về event loop qua async_to_sync(send)"""
+
+    def __init__(self, wsgi_app, scope, send):
+        self.wsgi_app = wsgi_app
+        self.scope = scope
+        self.send = async_to_sync(send)
+        self.response_start = None
+        self.response_started = False
+
+    def start_response(self, status, response_headers, exc_info=None):
+        if exc_info is not None and self.response_started:
+            raise exc_info[1].with_traceback(exc_info[2])
+        if self.response_start is not None and exc_info is None:
+            raise ValueError("start_response called a second time without exc_info")
+        self.response_start = {
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in response_headers]
+        }
+        return self.write
+
+    def write(self, data: bytes):
+        if not self.response_started:
+            self.response_started = True
+            self.send(self.response_start)
+        if data:
+            self.send({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+    def run(self, body):
+        result = self.wsgi_app(build_environ(self.scope, body), self.start_response)
+        try:
+            # Gửi từng chunk ngay khi có (SSE / response stream)
+            for output in result:
+                self.write(output)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        self.write(b'')
+        self.send({'type': 'http.response.body'})
+
+
+class FlaskAsgiApp:
+    """Bọc WSGI app thành ASGI app, mỗi request chạy trên thread pool `threads` worker.
+
+    asgiref.wsgi.WsgiToAsgi dùng sync_to_async(thread_sensitive=True) nên mọi request chạy
+    tuần tự trên một thread; ở đây dùng sync_to_async(thread_sensitive=False, executor=pool)."""
+
+    def __init__(self, wsgi_app, threads: int):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self._executor = None
+
+    def _ensure_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='asgi-worker')
+        return self._executor
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._ensure_executor()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+        with SpooledTemporaryFile(max_size=65536) as body:
+            while True:
+                message = await receive()
+                if message['type'] != 'http.request':
+                    # Client ngắt kết nối trước khi gửi xong body
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+            request = _WsgiRequest(self.wsgi_app, scope, send)
+            await sync_to_async(request.run, thread_sensitive=False, executor=self._ensure_executor())(body)
@@ -1,14 +1,18 @@
 import uuid
-from typing import Dict, List, Optional
+from contextlib import closing
+from typing import Dict, List, Optional, Iterator
 from datetime import datetime
-from src.database import get_db, ChatSession as DBChatSession, ChatMessage as DBChatMessage
-from src.llm import workflow, RagDataContext
+from src.database import get_db, ChatSession as DBChatSession, ChatMessage as DBChatMessage, FilePermission
+from src.llm import workflow, stream_workflow, RagDataContext, ANONYMOUS_FILTER
+from src.streaming import format_sse
+from src.llm_gateway import GatewaySaturated
+from src.chat_memory import PUBLIC_SCOPE
 import src.vectordb as vectordb
 import logging
 
 class ChatManager:
     def __init__(self):
-        self.vectorstore = vectordb.init_vector_store()
+        self.vectorstore = vectordb.get_vector_store()
 
     def create_chat_session(self, user_id: str = None, username: str = "anonymous", title: str = "New Chat") -> Dict:
         """Tạo chat session mới"""
@@ -106,31 +110,112 @@ class ChatManager:
         finally:
             db.close()
 
+    def build_access_filter(self, user_id: str = None, user_role: str = None,
+                            department: str = None) -> Optional[List[Dict]]:
+        """Filter metadata cho retrieval: user thường chỉ thấy file mình upload,
+        file của department mình và file được cấp quyền; admin không lọc (None).
+        Không xác định user (public chat) thì không thấy file upload nào"""
+        if user_id and user_role == 'admin':
+            return None
+        if not user_id:
+            return ANONYMOUS_FILTER
+        clauses = [{"source": "uploaded_file", "uploaded_by": user_id}]
+        if department:
+            clauses.append({"source": "uploaded_file", "department": department})
+        db = next(get_db())
+        try:
+            granted = [
+                p.file_id for p in db.query(FilePermission.file_id).filter(
+                    FilePermission.user_id == user_id,
+                    FilePermission.can_read == True
+                ).all()
+            ]
+            if granted:
+                clauses.append({"source": "uploaded_file", "file_id": granted})
+        except Exception as e:
+            print(f"Error loading file permissions for {user_id}: {e}")
+        finally:
+            db.close()
+        return clauses
+
+    def _build_rag_context(self, session_id: str, message: str, user_id: str = None,
+                           file_urls: List[str] = None, user_role: str = None,
+                           department: str = None):
+        """Tạo RagDataContext kèm context từ lịch sử chat, trả về (rag_context, số message context)"""
+        # Lấy context từ các messages trước đó
+        context_messages = self.get_chat_messages(session_id, limit=10)
+        
+        # Tạo context string từ lịch sử chat
+        context = ""
+        if context_messages:
+            context = "\n".join([
+                f"User: {msg['message']}\nAssistant: {msg['response']}"
+                for msg in context_messages[-5:]  # Lấy 5 messages gần nhất
+            ])
+        
+        rag_context = RagDataContext(
+            question=message,
+            generation="",
+            documents=[],
+            steps=[],
+            file_urls=file_urls or [],
+            file_documents=[],
+            chat_context=context,
+            metadata_filter=self.build_access_filter(user_id, user_role, department),
+            memory_scope=user_id or PUBLIC_SCOPE
+        )
+        return rag_context, len(context_messages)
+
+    def _collect_file_sources(self, message: str, documents: List) -> List[Dict]:
+        """Lọc file_sources chỉ lấy file thực sự liên quan đến prompt"""
+        keyword = message.lower()
+        file_sources = []
+        for doc in documents:
+            logging.info(f"[DEBUG] doc.metadata: {getattr(doc, 'metadata', None)}")
+            logging.info(f"[DEBUG] doc.page_content: {getattr(doc, 'page_content', None)}")
+            if hasattr(doc, 'metadata') and doc.metadata:
+                file_name = doc.metadata.get('file_name', '')
+                file_id = doc.metadata.get('file_id', '')
+                content = getattr(doc, 'page_content', '').lower()
+                # Chỉ thêm file nếu có đủ file_name, file_id và nội dung/tên file chứa từ khóa
+                if file_name and file_id and ((keyword in file_name.lower()) or (content and keyword in content)):
+                    file_sources.append({
+                        'filename': file_name,
+                        'download_url': f"/api/user/files/download/{file_id}"
+                    })
+        return file_sources
+
+    def _save_exchange(self, db, session_id: str, message: str, response: str,
+                       user_id: str = None, username: str = "anonymous") -> DBChatMessage:
+        """Lưu message và response vào database, cập nhật updated_at của session"""
+        chat_message = DBChatMessage(
+            id=str(uuid.uuid4()),
+            session_id=session_id,
+            user_id=user_id,
+            username=username,
+            message=message,
+            response=response,
+            created_at=datetime.utcnow(),
+            message_type="user"
+        )
+        
+        db.add(chat_message)
+        
+        session = db.query(DBChatSession).filter(DBChatSession.id == session_id).first()
+        if session:
+            session.updated_at = datetime.utcnow()
+        
+        db.commit()
+        return chat_message
+
     def send_message(self, session_id: str, message: str, user_id: str = None, 
-                    username: str = "anonymous", file_urls: List[str] = None) -> Dict:
+                    username: str = "anonymous", file_urls: List[str] = None,
+                    user_role: str = None, department: str = None) -> Dict:
         """Gửi message và nhận response với context memory"""
         db = next(get_db())
         try:
-            # Lấy context từ các messages trước đó
-            context_messages = self.get_chat_messages(session_id, limit=10)
-            
-            # Tạo context string từ lịch sử chat
-            context = ""
-            if context_messages:
-                context = "\n".join([
-                    f"User: {msg['message']}\nAssistant: {msg['response']}"
-                    for msg in context_messages[-5:]  # Lấy 5 messages gần nhất
-                ])
-            
-            # Tạo RagDataContext với context
-            rag_context = RagDataContext(
-                question=message,
-                generation="",
-                documents=[],
-                steps=[],
-                file_urls=file_urls or [],
-                file_documents=[],
-                chat_context=context  # Thêm context vào
+            rag_context, context_used = self._build_rag_context(
+                session_id, message, user_id, file_urls, user_role, department
             )
             
             # Chạy workflow để generate response
@@ -140,63 +225,73 @@ class ChatManager:
             response = result.get("generation", "Xin lỗi, tôi không thể trả lời câu hỏi này.")
             
             # Lấy metadata của documents được sử dụng
-            documents = result.get("documents", [])
-            file_documents = result.get("file_documents", [])
-            
-            # Lọc file_sources chỉ lấy file thực sự liên quan đến prompt
-            keyword = message.lower()
-            file_sources = []
-            for doc in documents + file_documents:
-                logging.info(f"[DEBUG] doc.metadata: {getattr(doc, 'metadata', None)}")
-                logging.info(f"[DEBUG] doc.page_content: {getattr(doc, 'page_content', None)}")
-                if hasattr(doc, 'metadata') and doc.metadata:
-                    file_name = doc.metadata.get('file_name', '')
-                    file_id = doc.metadata.get('file_id', '')
-                    content = getattr(doc, 'page_content', '').lower()
-                    # Chỉ thêm file nếu có đủ file_name, file_id và nội dung/tên file chứa từ khóa
-                    if file_name and file_id and ((keyword in file_name.lower()) or (content and keyword in content)):
-                        file_sources.append({
-                            'filename': file_name,
-                            'download_url': f"/api/user/files/download/{file_id}"
-                        })
-            
-            # Lưu message và response vào database
-            chat_message = DBChatMessage(
-                id=str(uuid.uuid4()),
-                session_id=session_id,
-                user_id=user_id,
-                username=username,
-                message=message,
-                response=response,
-                created_at=datetime.utcnow(),
-                message_type="user"
-            )
-            
-            db.add(chat_message)
+            documents = result.get("documents", []) + result.get("file_documents", [])
+            file_sources = self._collect_file_sources(message, documents)
             
-            # Cập nhật updated_at của session
-            session = db.query(DBChatSession).filter(DBChatSession.id == session_id).first()
-            if session:
-                session.updated_at = datetime.utcnow()
-            
-            db.commit()
+            chat_message = self._save_exchange(db, session_id, message, response, user_id, username)
             
             return {
                 "success": True,
                 "message": "Gửi message thành công",
                 "response": response,
                 "message_id": chat_message.id,
-                "context_used": len(context_messages),
-                "documents_used": len(documents + file_documents),
+                "context_used": context_used,
+                "documents_used": len(documents),
                 "file_sources": file_sources  # Danh sách file sources kèm download_url
             }
             
+        except GatewaySaturated:
+            db.rollback()
+            raise
         except Exception as e:
             db.rollback()
             return {"success": False, "message": f"Lỗi khi gửi message: {str(e)}"}
         finally:
             db.close()
 
+    def send_message_stream(self, session_id: str, message: str, user_id: str = None,
+                            username: str = "anonymous", file_urls: List[str] = None,
+                            user_role: str = None, department: str = None) -> Iterator[str]:
+        """Như send_message nhưng trả về các event SSE (step, retrieval, token, done/error).
+
+        Message chỉ được lưu vào database khi đã generate xong; nếu client ngắt kết nối
+        giữa chừng thì generator bị đóng, request tới Ollama bị hủy và không lưu gì."""
+        db = next(get_db())
+        try:
+            rag_context, context_used = self._build_rag_context(
+                session_id, message, user_id, file_urls, user_role, department
+            )
+            result = None
+            # closing(): đóng stream_workflow (và stream tới Ollama) ngay khi client ngắt kết nối
+            with closing(stream_workflow(rag_context)) as events:
+                for event in events:
+                    if event["event"] == "complete":
+                        result = event["data"]
+                    else:
+                        yield format_sse(event["event"], event["data"])
+            
+            response = result.get("generation") or "Xin lỗi, tôi không thể trả lời câu hỏi này."
+            documents = result.get("documents", []) + result.get("file_documents", [])
+            chat_message = self._save_exchange(db, session_id, message, response, user_id, username)
+            yield format_sse("done", {
+                "success": True,
+                "message_id": chat_message.id,
+                "response": response,
+                "context_used": context_used,
+                "documents_used": len(documents),
+                "file_sources": self._collect_file_sources(message, documents)
+            })
+        except GeneratorExit:
+            print(f"[CHAT STREAM] Client disconnected, generation cancelled for session {session_id}")
+            raise
+        except GatewaySaturated as e:
+            yield format_sse("error", {"success": False, "message": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            db.rollback()
+            yield format_sse("error", {"success": False, "message": f"Lỗi khi gửi message: {str(e)}"})
+        finally:
+            db.close()
+
     def delete_chat_session(self, session_id: str, user_id: str = None) -> Dict:
         """Xóa chat session"""
         db = next(get_db())
@@ -0,0 +1,137 @@
+import os
+import time
+import atexit
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.schema import Document
+
+from src.config import MemoryConfig
+from src.embedding_cache import get_embeddings
+
+PUBLIC_SCOPE = "public"
+
+
+class ConversationMemory:
+    """Bộ nhớ hội thoại (các cặp Q&A đã trả lời) tách riêng khỏi index tài liệu.
+
+    Mỗi scope (user_id, hoặc "public" cho chat không đăng nhập) giữ tối đa
+    MaxEntriesPerScope mục, mục cũ hơn TtlSeconds bị bỏ qua và dọn đi; khi vượt
+    giới hạn thì loại mục / scope ít được dùng gần đây nhất (LRU).
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        # scope -> OrderedDict(entry_id -> entry), thứ tự = mức độ dùng gần đây
+        self._scopes: "OrderedDict[str, OrderedDict]" = OrderedDict()
+        self._next_id = 0
+        self._unsaved = 0
+        self.load()
+
+    def _scope(self, scope: str) -> OrderedDict:
+        entries = self._scopes.get(scope)
+        if entries is None:
+            entries = self._scopes[scope] = OrderedDict()
+            while len(self._scopes) > MemoryConfig.MaxScopes:
+                self._scopes.popitem(last=False)
+        self._scopes.move_to_end(scope)
+        return entries
+
+    def _expire(self, entries: OrderedDict, now: float):
+        expired = [entry_id for entry_id, entry in entries.items()
+                   if now - entry['created_at'] > MemoryConfig.TtlSeconds]
+        for entry_id in expired:
+            del entries[entry_id]
+
+    def add(self, scope: str, question: str, answer: str, metadata: Dict = None):
+        content = f"Q: {question}\nA: {answer}"
+        vector = np.asarray(get_embeddings().embed_documents([content])[0], dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            entries = self._scope(scope)
+            self._expire(entries, now)
+            entries[self._next_id] = {
+                'content': content,
+                'vector': vector,
+                'metadata': {"source": "chat-history", "type": "Q&A", **(metadata or {})},
+                'created_at': now
+            }
+            self._next_id += 1
+            while len(entries) > MemoryConfig.MaxEntriesPerScope:
+                entries.popitem(last=False)
+            self._unsaved += 1
+            should_save = self._unsaved >= MemoryConfig.SaveEvery
+        if should_save:
+            self.save()
+
+    def search(self, scope: str, embedding: List[float], k: int = None) -> List[Document]:
+        """Top-k Q&A gần nhất với câu hỏi trong scope (khoảng cách L2, như index tài liệu)"""
+        k = k or MemoryConfig.TopK
+        now = time.time()
+        with self._lock:
+            if scope not in self._scopes:
+                return []
+            entries = self._scope(scope)
+            self._expire(entries, now)
+            if not entries:
+                return []
+            entry_ids = list(entries.keys())
+            vectors = np.vstack([entries[entry_id]['vector'] for entry_id in entry_ids])
+            distances = ((vectors - np.asarray(embedding, dtype=np.float32)) ** 2).sum(axis=1)
+            results = []
+            for i in np.argsort(distances)[:k]:
+                entry_id = entry_ids[i]
+                if MemoryConfig.MaxDistance and distances[i] > MemoryConfig.MaxDistance:
+                    break
+                entries.move_to_end(entry_id)
+                entry = entries[entry_id]
+                results.append(Document(page_content=entry['content'],
+                                        metadata={**entry['metadata'], 'memory_id': entry_id}))
+            return results
+
+    def clear(self, scope: str):
+        with self._lock:
+            self._scopes.pop(scope, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'scopes': len(self._scopes),
+                'entries': sum(len(entries) for entries in self._scopes.values())
+            }
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            data = np.load(self.path, allow_pickle=True).item()
+            self._scopes = OrderedDict(
+                (scope, OrderedDict(entries)) for scope, entries in data.get('scopes', [])
+            )
+            self._next_id = data.get('next_id', 0)
+        except Exception as e:
+            print(f"[CHAT MEMORY] Error loading memory: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {
+                'scopes': [(scope, list(entries.items())) for scope, entries in self._scopes.items()],
+                'next_id': self._next_id
+            }
+            self._unsaved = 0
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, data, allow_pickle=True)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[CHAT MEMORY] Error saving memory: {e}")
+
+
+conversation_memory = ConversationMemory(MemoryConfig.Path)
+atexit.register(conversation_memory.save)
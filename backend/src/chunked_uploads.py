@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import uuid
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from src.file_utils.upload_writer import UploadWriter, needs_utf8
+
+
+class UploadOffsetMismatch(Exception):
+    """Chunk gửi tới không nối tiếp phần server đã nhận, client nên gửi lại từ `expected`"""
+
+    def __init__(self, expected: int):
+        super().__init__(f"Offset không khớp, server đã nhận {expected} byte")
+        self.expected = expected
+
+
+class ChunkedUploadManager:
+    """Upload nhiều phần, resume được, cho file lớn hơn MAX_CONTENT_LENGTH.
+
+    Mỗi session gồm <upload_id>.json (metadata, số byte đã nhận) và <upload_id>.part
+    (dữ liệu). Hash và encoding được tính dần qua UploadWriter giữ trong bộ nhớ; sau
+    khi server restart thì dựng lại từ file .part ở chunk kế tiếp."""
+
+    def __init__(self, session_dir: str, chunk_size: int, max_file_size: int, ttl_seconds: int):
+        self.session_dir = session_dir
+        self.chunk_size = chunk_size
+        self.max_file_size = max_file_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._upload_locks: Dict[str, threading.Lock] = {}
+        self._writers: Dict[str, UploadWriter] = {}
+        os.makedirs(session_dir, exist_ok=True)
+
+    def _meta_path(self, upload_id: str) -> str:
+        return os.path.join(self.session_dir, f"{upload_id}.json")
+
+    def _part_path(self, upload_id: str) -> str:
+        return os.path.join(self.session_dir, f"{upload_id}.part")
+
+    def _upload_lock(self, upload_id: str) -> threading.Lock:
+        with self._lock:
+            return self._upload_locks.setdefault(upload_id, threading.Lock())
+
+    def _save(self, session: Dict):
+        session['updated_at'] = time.time()
+        tmp_path = self._meta_path(session['upload_id']) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(session, f, ensure_ascii=False)
+        os.replace(tmp_path, self._meta_path(session['upload_id']))
+
+    def create(self, filename: str, total_size: int, content_type: str, uploaded_by: str,
+               department: str = None, allowed_users: List[str] = None) -> Dict:
+        if total_size <= 0:
+            raise ValueError("Kích thước file không hợp lệ")
+        if total_size > self.max_file_size:
+            raise ValueError(f"File quá lớn, tối đa {self.max_file_size} byte")
+        self.cleanup_expired()
+        upload_id = str(uuid.uuid4())
+        session = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'total_size': total_size,
+            'received': 0,
+            'content_type': content_type,
+            'uploaded_by': uploaded_by,
+            'department': department,
+            'allowed_users': allowed_users,
+            'created_at': time.time()
+        }
+        self._writers[upload_id] = UploadWriter(self._part_path(upload_id), needs_utf8(filename))
+        self._save(session)
+        return session
+
+    def get(self, upload_id: str) -> Optional[Dict]:
+        try:
+            with open(self._meta_path(upload_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _writer(self, session: Dict) -> UploadWriter:
+        writer = self._writers.get(session['upload_id'])
+        if writer is None or writer.size != session['received']:
+            writer = UploadWriter.resume(self._part_path(session['upload_id']),
+                                         needs_utf8(session['filename']), session['received'])
+            self._writers[session['upload_id']] = writer
+        return writer
+
+    def append(self, upload_id: str, offset: int, stream) -> Dict:
+        """Ghi một chunk bắt đầu tại `offset`, trả về session sau khi ghi"""
+        with self._upload_lock(upload_id):
+            session = self.get(upload_id)
+            if session is None:
+                raise KeyError(upload_id)
+            if offset != session['received']:
+                raise UploadOffsetMismatch(session['received'])
+            writer = self._writer(session)
+            try:
+                writer.write_stream(stream, limit=session['total_size'] - session['received'])
+            finally:
+                # Client ngắt giữa chừng: giữ phần đã ghi, client hỏi lại offset rồi gửi tiếp
+                writer.close()
+                session['received'] = writer.size
+                self._save(session)
+            return session
+
+    def finish(self, upload_id: str) -> Tuple[Dict, str, Dict]:
+        """Kết thúc upload: trả về (session, đường dẫn file .part, kết quả UploadWriter.finish)"""
+        with self._upload_lock(upload_id):
+            session = self.get(upload_id)
+            if session is None:
+                raise KeyError(upload_id)
+            if session['received'] != session['total_size']:
+                raise UploadOffsetMismatch(session['received'])
+            written = self._writer(session).finish()
+            return session, self._part_path(upload_id), written
+
+    def discard(self, upload_id: str):
+        with self._upload_lock(upload_id):
+            self._writers.pop(upload_id, None)
+            for path in (self._meta_path(upload_id), self._part_path(upload_id)):
+                if os.path.exists(path):
+                    os.remove(path)
+        with self._lock:
+            self._upload_locks.pop(upload_id, None)
+
+    def cleanup_expired(self) -> int:
+        """Xóa các session bị bỏ dở quá SessionTtlSeconds"""
+        removed = 0
+        cutoff = time.time() - self.ttl_seconds
+        for name in os.listdir(self.session_dir):
+            if not name.endswith('.json'):
+                continue
+            upload_id = name[:-len('.json')]
+            session = self.get(upload_id)
+            if session is None or session.get('updated_at', 0) < cutoff:
+                self.discard(upload_id)
+                removed += 1
+        return removed
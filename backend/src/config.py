@@ -48,16 +48,57 @@ config = {
 class ServerConfig:
     Host = os.getenv("SERVER__HOST", "0.0.0.0")
     Port = os.getenv("SERVER__PORT", "8000")
+    # Số thread xử lý request khi chạy ASGI (asgi.py)
+    AsgiThreads = int(os.getenv("SERVER__ASGI_THREADS", "256"))
 
 class OllamaConfig:
     Host = os.getenv("OLLAMA__HOST", "http://localhost:11434")
     EmbeddingModel = os.getenv("OLLAMA__EMBEDDING_MODEL", "nomic-embed-text")
     RagModel = os.getenv("OLLAMA__RAG", "mistral")
+    # Số đoạn text tối đa trong một lần gọi embed
+    EmbeddingBatchSize = int(os.getenv("OLLAMA__EMBEDDING_BATCH_SIZE", "32"))
+    # Cache embedding theo nội dung (để trống để tắt)
+    EmbeddingCachePath = os.getenv("OLLAMA__EMBEDDING_CACHE_PATH", os.path.join(DATA_DIR, "embedding_cache.sqlite"))
+    # LRU embedding câu hỏi trong bộ nhớ, giới hạn theo byte (0 = tắt)
+    QueryCacheMaxBytes = int(os.getenv("OLLAMA__QUERY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    # Lưu embedding câu hỏi vào EmbeddingCachePath để dùng lại sau khi khởi động lại
+    QueryCachePersist = os.getenv("OLLAMA__QUERY_CACHE_PERSIST", "false").lower() == "true"
+    # Số request đồng thời tối đa tới Ollama (chat, embedding, classify)
+    MaxConcurrency = int(os.getenv("OLLAMA__MAX_CONCURRENCY", "4"))
+
+class LLMGatewayConfig:
+    # Giới hạn in-flight theo priority (0 = dùng OLLAMA__MAX_CONCURRENCY), chat luôn được dùng toàn bộ
+    MaxInFlightAgentic = int(os.getenv("LLM_GATEWAY__MAX_IN_FLIGHT_AGENTIC", "0"))
+    MaxInFlightBackground = int(os.getenv("LLM_GATEWAY__MAX_IN_FLIGHT_BACKGROUND", "1"))
+    # Độ dài hàng đợi tối đa theo priority (0 = không giới hạn), vượt quá trả về 429
+    MaxQueueInteractive = int(os.getenv("LLM_GATEWAY__MAX_QUEUE_INTERACTIVE", "64"))
+    MaxQueueAgentic = int(os.getenv("LLM_GATEWAY__MAX_QUEUE_AGENTIC", "16"))
+    MaxQueueBackground = int(os.getenv("LLM_GATEWAY__MAX_QUEUE_BACKGROUND", "0"))
+    # Thời gian chờ slot tối đa của chat / agentic trước khi trả về 429
+    QueueTimeoutSeconds = float(os.getenv("LLM_GATEWAY__QUEUE_TIMEOUT_SECONDS", "60"))
 
 class FaissConfig:
     IndexPath = os.getenv("FAISS__INDEX_PATH", os.path.join(DATA_DIR, "index.bin"))
     DocumentStorePath = os.getenv("FAISS__DOCUMENT_STORE_PATH", os.path.join(DATA_DIR, "docstore.npy"))
     MapIdPath = os.getenv("FAISS__MAP_ID_PATH", os.path.join(DATA_DIR, "map_id.npy"))
+    FingerprintPath = os.getenv("FAISS__FINGERPRINT_PATH", os.path.join(DATA_DIR, "file_fingerprints.json"))
+    ReindexCheckpointPath = os.getenv("FAISS__REINDEX_CHECKPOINT_PATH", os.path.join(DATA_DIR, "reindex_checkpoint.json"))
+    # Loại index: flat | ivfpq | hnsw; index ít hơn AnnMinVectors vector luôn dùng flat
+    IndexType = os.getenv("FAISS__INDEX_TYPE", "flat")
+    AnnMinVectors = int(os.getenv("FAISS__ANN_MIN_VECTORS", "10000"))
+    IvfNlist = int(os.getenv("FAISS__IVF_NLIST", "0"))  # 0 = tự tính ~4*sqrt(n)
+    IvfNprobe = int(os.getenv("FAISS__IVF_NPROBE", "16"))
+    PqM = int(os.getenv("FAISS__PQ_M", "64"))
+    HnswM = int(os.getenv("FAISS__HNSW_M", "32"))
+    HnswEfConstruction = int(os.getenv("FAISS__HNSW_EF_CONSTRUCTION", "200"))
+    HnswEfSearch = int(os.getenv("FAISS__HNSW_EF_SEARCH", "64"))
+    # Filter khớp ít hơn ngưỡng này thì search chính xác trên tập id được phép (với IVF/HNSW)
+    FilterExactSearchMax = int(os.getenv("FAISS__FILTER_EXACT_SEARCH_MAX", "2000"))
+    # Tự động compact index khi tỉ lệ vector đã xóa (tombstone) vượt ngưỡng
+    CompactDeadRatio = float(os.getenv("FAISS__COMPACT_DEAD_RATIO", "0.2"))
+    # Ghi index xuống đĩa theo lô: flush khi đủ số document chưa lưu hoặc quá thời gian
+    FlushDirtyThreshold = int(os.getenv("FAISS__FLUSH_DIRTY_THRESHOLD", "64"))
+    FlushIntervalSeconds = float(os.getenv("FAISS__FLUSH_INTERVAL_SECONDS", "5"))
 
     @staticmethod
     def print_paths():
@@ -65,6 +106,70 @@ class FaissConfig:
         print(f"[FAISS PATHS] DocumentStorePath: {FaissConfig.DocumentStorePath}")
         print(f"[FAISS PATHS] MapIdPath: {FaissConfig.MapIdPath}")
 
+class ChunkConfig:
+    # Kích thước chunk tính theo ký tự (nomic-embed-text ~ 2048 token)
+    ChunkSize = int(os.getenv("CHUNK__SIZE", "1000"))
+    ChunkOverlap = int(os.getenv("CHUNK__OVERLAP", "150"))
+
+class MemoryConfig:
+    # Bộ nhớ hội thoại (Q&A đã trả lời), tách khỏi index tài liệu
+    Path = os.getenv("MEMORY__PATH", os.path.join(DATA_DIR, "chat_memory.npy"))
+    MaxEntriesPerScope = int(os.getenv("MEMORY__MAX_ENTRIES_PER_SCOPE", "200"))
+    MaxScopes = int(os.getenv("MEMORY__MAX_SCOPES", "1000"))
+    TtlSeconds = int(os.getenv("MEMORY__TTL_SECONDS", str(30 * 24 * 3600)))
+    TopK = int(os.getenv("MEMORY__TOP_K", "2"))
+    MaxDistance = float(os.getenv("MEMORY__MAX_DISTANCE", "0"))  # 0 = không giới hạn
+    SaveEvery = int(os.getenv("MEMORY__SAVE_EVERY", "20"))
+
+class UploadJobConfig:
+    # Hàng đợi xử lý sau upload (SQLite), chạy bởi các worker thread
+    QueuePath = os.getenv("UPLOAD_JOBS__QUEUE_PATH", os.path.join(DATA_DIR, "upload_jobs.sqlite"))
+    Workers = int(os.getenv("UPLOAD_JOBS__WORKERS", "2"))
+    # Số file của một upload batch được lưu / phân loại song song
+    BatchWorkers = int(os.getenv("UPLOAD_JOBS__BATCH_WORKERS", "4"))
+    MaxAttempts = int(os.getenv("UPLOAD_JOBS__MAX_ATTEMPTS", "3"))
+    RetryBackoffSeconds = float(os.getenv("UPLOAD_JOBS__RETRY_BACKOFF_SECONDS", "10"))
+    PollIntervalSeconds = float(os.getenv("UPLOAD_JOBS__POLL_INTERVAL_SECONDS", "2"))
+
+class FileSearchConfig:
+    # Index tìm kiếm file (preview, keyword) lưu trên đĩa, chỉ làm mới file có thay đổi
+    IndexPath = os.getenv("FILE_SEARCH__INDEX_PATH", os.path.join(DATA_DIR, "file_search_index.sqlite"))
+    # Số ký tự tối đa của một file được đưa vào inverted index (toàn văn)
+    MaxIndexedChars = int(os.getenv("FILE_SEARCH__MAX_INDEXED_CHARS", str(2_000_000)))
+    Bm25K1 = float(os.getenv("FILE_SEARCH__BM25_K1", "1.2"))
+    Bm25B = float(os.getenv("FILE_SEARCH__BM25_B", "0.75"))
+    # Độ giống trigram tối thiểu để tên file được coi là khớp (0..1)
+    NameMinSimilarity = float(os.getenv("FILE_SEARCH__NAME_MIN_SIMILARITY", "0.5"))
+
+class HybridSearchConfig:
+    # Trộn hạng tìm kiếm từ khóa (BM25 + tên file) với vector (FAISS) bằng reciprocal rank fusion
+    Enabled = os.getenv("HYBRID_SEARCH__ENABLED", "true").lower() == "true"
+    RrfK = int(os.getenv("HYBRID_SEARCH__RRF_K", "60"))
+    LexicalWeight = float(os.getenv("HYBRID_SEARCH__LEXICAL_WEIGHT", "1.0"))
+    VectorWeight = float(os.getenv("HYBRID_SEARCH__VECTOR_WEIGHT", "1.0"))
+    # Số chunk lấy từ FAISS cho mỗi danh sách hạng
+    FetchK = int(os.getenv("HYBRID_SEARCH__FETCH_K", "20"))
+    # Số file đứng đầu tìm kiếm từ khóa được lấy chunk cho RAG
+    LexicalFiles = int(os.getenv("HYBRID_SEARCH__LEXICAL_FILES", "5"))
+    MaxChunksPerFile = int(os.getenv("HYBRID_SEARCH__MAX_CHUNKS_PER_FILE", "2"))
+
+class UploadConfig:
+    # Kích thước block khi ghi upload xuống đĩa (hash/nhận diện encoding tính cùng lúc)
+    WriteBlockSize = int(os.getenv("UPLOAD__WRITE_BLOCK_SIZE", str(1024 * 1024)))
+    # Upload nhiều phần (resume được) cho file lớn hơn MAX_CONTENT_LENGTH
+    SessionDir = os.getenv("UPLOAD__SESSION_DIR", os.path.join(DATA_DIR, "upload_sessions"))
+    ChunkSize = int(os.getenv("UPLOAD__CHUNK_SIZE", str(8 * 1024 * 1024)))
+    MaxFileSize = int(os.getenv("UPLOAD__MAX_FILE_SIZE", str(2 * 1024 * 1024 * 1024)))
+    SessionTtlSeconds = int(os.getenv("UPLOAD__SESSION_TTL_SECONDS", str(24 * 3600)))
+
+class AnswerCacheConfig:
+    # Cache câu trả lời RAG theo câu hỏi chuẩn hóa + các chunk được retrieve + model
+    Enabled = os.getenv("ANSWER_CACHE__ENABLED", "true").lower() == "true"
+    MaxEntries = int(os.getenv("ANSWER_CACHE__MAX_ENTRIES", "1000"))
+    TtlSeconds = int(os.getenv("ANSWER_CACHE__TTL_SECONDS", str(24 * 3600)))
+    # Cosine similarity tối thiểu giữa hai câu hỏi để dùng lại câu trả lời, 0 = chỉ khớp chính xác
+    SimilarityThreshold = float(os.getenv("ANSWER_CACHE__SIMILARITY_THRESHOLD", "0.95"))
+
 class CloudinaryConfig:
     CloudName=os.getenv("CLOUDINARY__CLOUD_NAME")
     ApiKey=os.getenv("CLOUDINARY__API_KEY")
@@ -2,6 +2,7 @@ from flask import Blueprint, request, jsonify
 from src.auth import require_auth
 from src.agentic_ai import agentic_ai
 from src.agentic_session_manager import agentic_session_manager
+from src.llm_gateway import GatewaySaturated, saturated_response
 
 agentic_ai_bp = Blueprint('agentic_ai', __name__)
 
@@ -125,6 +126,8 @@ def plan_actions():
         
         return jsonify(plan_result)
         
+    except GatewaySaturated as e:
+        return saturated_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -405,6 +408,8 @@ def plan_and_execute():
             'summary': summary
         })
         
+    except GatewaySaturated as e:
+        return saturated_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -8,6 +8,8 @@ from src.file_manager import file_manager
 from src.file_reasoner import generate_chain_of_thought
 from src.feedback_store import load_feedback
 from src.file_comparator import file_comparator
+from src.streaming import sse_response
+from src.llm_gateway import GatewaySaturated, saturated_response, llm_gateway, Priority
 
 chat_bp = Blueprint('chat', __name__)
 
@@ -316,7 +318,8 @@ def send_message(session_id):
             user_role = request.user['role']
             
             # Tìm file phù hợp để so sánh
-            files_to_compare = file_comparator.find_files_for_comparison(message, user_id, user_role)
+            files_to_compare = file_comparator.find_files_for_comparison(message, user_id, user_role,
+                                                                         request.user.get('department'))
             print(f"[DEBUG][send_message] Files to compare: {files_to_compare}")
             
             if len(files_to_compare) < 2:
@@ -375,7 +378,7 @@ def send_message(session_id):
             # 2. Tìm file với lọc theo quyền truy cập
             user_id = request.user['user_id']
             user_role = request.user['role']
-            search_results = file_search_engine.search_all(message, user_id, user_role)
+            search_results = file_search_engine.search_all(message, user_id, user_role, request.user.get('department'))
             print(f"[DEBUG][send_message] Search results: {search_results}")
             files_found = []
             metadata_results = []
@@ -441,13 +444,88 @@ def send_message(session_id):
             session_id=session_id,
             message=message,
             user_id=request.user['user_id'],
-            username=request.user['username']
+            username=request.user['username'],
+            user_role=request.user.get('role'),
+            department=request.user.get('department')
         )
         return jsonify(result)
+    except GatewaySaturated as e:
+        return saturated_response(e)
     except Exception as e:
         print(f"[DEBUG][send_message] Exception: {e}")
         return jsonify({'error': str(e)}), 500
 
+@chat_bp.route('/chat/sessions/<session_id>/send/stream', methods=['POST'])
+@require_auth
+def send_message_stream(session_id):
+    """
+    Gửi message trong session và stream câu trả lời AI theo từng token (Server-Sent Events)
+    ---
+    tags:
+      - Chat
+    produces:
+      - text/event-stream
+    parameters:
+      - name: Authorization
+        in: header
+        type: string
+        required: true
+        description: Bearer token
+      - name: session_id
+        in: path
+        type: string
+        required: true
+        description: ID session
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - message
+          properties:
+            message:
+              type: string
+              example: "Tóm tắt kế hoạch 2024"
+            file_urls:
+              type: array
+              items:
+                type: string
+    responses:
+      200:
+        description: |
+          Stream các event SSE theo thứ tự:
+          `step` ({"step": ...}), `retrieval` ({"documents": [...]}), nhiều `token` ({"text": ...}),
+          cuối cùng `done` (giống response của /send, kèm message_id) hoặc `error`.
+          Ngắt kết nối giữa chừng sẽ hủy việc generate và không lưu message.
+        examples:
+          text/event-stream: "event: token\ndata: {\"text\": \"Kế hoạch\"}\n\n"
+      400:
+        description: Message trống
+      401:
+        description: Không xác thực
+      429:
+        description: LLM đang quá tải, thử lại sau số giây trong header Retry-After
+    """
+    data = request.get_json() or {}
+    message = data.get('message', '').strip()
+    if not message:
+        return jsonify({'error': 'Message không được để trống'}), 400
+    # Hàng đợi chat đã đầy thì trả 429 ngay thay vì mở stream
+    try:
+        llm_gateway.check_capacity(Priority.INTERACTIVE)
+    except GatewaySaturated as e:
+        return saturated_response(e)
+    return sse_response(chat_manager.send_message_stream(
+        session_id=session_id,
+        message=message,
+        user_id=request.user['user_id'],
+        username=request.user['username'],
+        file_urls=data.get('file_urls', []),
+        user_role=request.user.get('role'),
+        department=request.user.get('department')
+    ))
+
 @chat_bp.route('/chat/sessions/<session_id>', methods=['DELETE'])
 @require_auth
 def delete_chat_session(session_id):
@@ -802,7 +880,9 @@ def chat():
                 session_id=session_id,
                 message=message,
                 user_id=user_id,
-                username=username
+                username=username,
+                user_role=request.user.get('role'),
+                department=request.user.get('department')
             )
             
             if result['success']:
@@ -812,6 +892,8 @@ def chat():
         else:
             return jsonify(session_result), 400
             
+    except GatewaySaturated as e:
+        return saturated_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -960,7 +1042,7 @@ def chat_enhanced():
             # Thực hiện tìm kiếm file với lọc theo quyền truy cập
             user_id = request.user['user_id']
             user_role = request.user['role']
-            search_results = file_search_engine.search_all(message, user_id, user_role)
+            search_results = file_search_engine.search_all(message, user_id, user_role, request.user.get('department'))
             
             # Tạo response cho tìm kiếm file
             if search_results['total_results'] > 0:
@@ -1008,7 +1090,9 @@ def chat_enhanced():
                     session_id=session_id,
                     message=message,
                     user_id=request.user['user_id'],
-                    username=request.user['username']
+                    username=request.user['username'],
+                    user_role=request.user.get('role'),
+                    department=request.user.get('department')
                 )
             else:
                 # Tạo session mới
@@ -1023,7 +1107,9 @@ def chat_enhanced():
                         session_id=session_result['session']['id'],
                         message=message,
                         user_id=request.user['user_id'],
-                        username=request.user['username']
+                        username=request.user['username'],
+                        user_role=request.user.get('role'),
+                        department=request.user.get('department')
                     )
                 else:
                     return jsonify(session_result), 400
@@ -1035,5 +1121,7 @@ def chat_enhanced():
                 'is_file_search': False
             })
             
+    except GatewaySaturated as e:
+        return saturated_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500 
\ No newline at end of file
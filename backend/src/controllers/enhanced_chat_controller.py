@@ -194,7 +194,8 @@ def chat_enhanced():
                 user_id=user_id,
                 user_role=user_role,
                 search_type='both',
-                limit=5
+                limit=5,
+                department=request.user.get('department')
             )
             response_data['related_files'] = search_results
             
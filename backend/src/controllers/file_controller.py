@@ -1,8 +1,10 @@
 from flask import Blueprint, request, jsonify, send_file
 from src.auth import require_auth, require_admin, require_department_access
 from src.file_manager import file_manager
+from src.chunked_uploads import UploadOffsetMismatch
 from src.file_classifier import file_classifier
 from src.cloud_integration import cloud_integration
+from src.streaming import format_sse, sse_response
 import os
 import json
 
@@ -111,6 +113,19 @@ def user_upload_file():
                   type: string
                   format: date-time
                   example: "2024-01-01T00:00:00Z"
+                sha256:
+                  type: string
+                  description: sha256 của nội dung gốc, tính trong lúc ghi file
+            processing:
+              type: object
+              description: Xử lý nền (embedding, phân loại...) đã được xếp hàng, theo dõi qua status_url
+              properties:
+                status:
+                  type: string
+                  example: "queued"
+                status_url:
+                  type: string
+                  example: "/api/files/file_123/status"
         examples:
           application/json: {
             "success": true,
@@ -122,7 +137,8 @@ def user_upload_file():
               "file_size": 1024000,
               "uploaded_by": "user1",
               "uploaded_at": "2024-01-01T00:00:00Z"
-            }
+            },
+            "processing": {"status": "queued", "status_url": "/api/files/file_123/status"}
           }
       400:
         description: Dữ liệu không hợp lệ
@@ -191,6 +207,214 @@ def user_upload_file():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# ==================== UPLOAD NHIỀU PHẦN (FILE LỚN) ====================
+
+def _own_upload(upload_id):
+    """Session upload của user hiện tại, hoặc (None, response lỗi)"""
+    upload = file_manager.get_chunked_upload(upload_id)
+    if upload is None:
+        return None, (jsonify({'error': 'Upload không tồn tại hoặc đã hết hạn'}), 404)
+    if upload['uploaded_by'] != request.user['user_id']:
+        return None, (jsonify({'error': 'Không có quyền truy cập upload này'}), 403)
+    return upload, None
+
+@file_bp.route('/user/files/uploads', methods=['POST'])
+@require_auth
+def start_chunked_upload():
+    """
+    Mở upload nhiều phần (resume được) cho file lớn hơn giới hạn của một request
+    ---
+    tags:
+      - File
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - filename
+            - size
+          properties:
+            filename:
+              type: string
+              example: "video.txt"
+            size:
+              type: integer
+              description: Tổng số byte của file
+              example: 104857600
+            content_type:
+              type: string
+              example: "text/plain"
+            department:
+              type: string
+    responses:
+      201:
+        description: Đã tạo session, gửi từng chunk bằng PUT upload_url
+        examples:
+          application/json: {
+            "success": true,
+            "upload": {
+              "upload_id": "0b6f...",
+              "filename": "video.txt",
+              "total_size": 104857600,
+              "received": 0,
+              "chunk_size": 8388608,
+              "upload_url": "/api/user/files/uploads/0b6f..."
+            }
+          }
+      400:
+        description: Dữ liệu không hợp lệ hoặc file quá lớn
+    """
+    try:
+        data = request.get_json() or {}
+        try:
+            total_size = int(data.get('size', 0))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'size không hợp lệ'}), 400
+        department = data.get('department', request.user.get('department'))
+        result = file_manager.start_chunked_upload(data.get('filename'), total_size, data.get('content_type'),
+                                                   request.user['user_id'], department)
+        if result['success']:
+            return jsonify(result), 201
+        return jsonify(result), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@file_bp.route('/user/files/uploads/<upload_id>', methods=['GET'])
+@require_auth
+def get_chunked_upload(upload_id):
+    """
+    Số byte server đã nhận, client dùng để gửi tiếp sau khi mất kết nối
+    ---
+    tags:
+      - File
+    parameters:
+      - name: upload_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: Trạng thái upload
+      404:
+        description: Upload không tồn tại hoặc đã hết hạn
+    """
+    try:
+        upload, error = _own_upload(upload_id)
+        if error:
+            return error
+        return jsonify({'success': True, 'upload': upload})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@file_bp.route('/user/files/uploads/<upload_id>', methods=['PUT'])
+@require_auth
+def upload_chunk(upload_id):
+    """
+    Gửi một chunk (body là byte thô), bắt đầu tại offset = số byte server đã nhận
+    ---
+    tags:
+      - File
+    consumes:
+      - application/octet-stream
+    parameters:
+      - name: upload_id
+        in: path
+        type: string
+        required: true
+      - name: Upload-Offset
+        in: header
+        type: integer
+        required: false
+        description: Vị trí bắt đầu của chunk (hoặc query ?offset=)
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: string
+          format: binary
+    responses:
+      200:
+        description: Đã ghi chunk, trả về số byte đã nhận
+      409:
+        description: Offset không khớp, gửi lại từ expected_offset
+      413:
+        description: Chunk lớn hơn chunk_size
+    """
+    try:
+        upload, error = _own_upload(upload_id)
+        if error:
+            return error
+        offset = request.headers.get('Upload-Offset', request.args.get('offset'))
+        if offset is None or not str(offset).isdigit():
+            return jsonify({'error': 'Thiếu offset của chunk'}), 400
+        if request.content_length and request.content_length > upload['chunk_size']:
+            return jsonify({'error': f"Chunk quá lớn, tối đa {upload['chunk_size']} byte"}), 413
+        try:
+            result = file_manager.append_chunk(upload_id, int(offset), request.stream)
+        except UploadOffsetMismatch as e:
+            return jsonify({'error': str(e), 'expected_offset': e.expected}), 409
+        return jsonify({'success': True, 'upload': result})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@file_bp.route('/user/files/uploads/<upload_id>/complete', methods=['POST'])
+@require_auth
+def complete_chunked_upload(upload_id):
+    """
+    Kết thúc upload nhiều phần: lưu file và xếp hàng xử lý nền như upload thường
+    ---
+    tags:
+      - File
+    parameters:
+      - name: upload_id
+        in: path
+        type: string
+        required: true
+    responses:
+      201:
+        description: Upload file thành công (cùng định dạng với POST /user/files)
+      400:
+        description: Upload chưa nhận đủ dữ liệu
+    """
+    try:
+        upload, error = _own_upload(upload_id)
+        if error:
+            return error
+        result = file_manager.complete_chunked_upload(upload_id)
+        if result['success']:
+            return jsonify(result), 201
+        return jsonify(result), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@file_bp.route('/user/files/uploads/<upload_id>', methods=['DELETE'])
+@require_auth
+def abort_chunked_upload(upload_id):
+    """
+    Hủy upload nhiều phần và xóa dữ liệu đã nhận
+    ---
+    tags:
+      - File
+    parameters:
+      - name: upload_id
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: Đã hủy upload
+    """
+    try:
+        upload, error = _own_upload(upload_id)
+        if error:
+            return error
+        file_manager.chunked_uploads.discard(upload_id)
+        return jsonify({'success': True, 'message': 'Đã hủy upload'})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @file_bp.route('/user/files/enhanced', methods=['GET'])
 @require_auth
 def get_user_files_enhanced():
@@ -559,6 +783,98 @@ def get_file_metadata(file_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@file_bp.route('/files/<file_id>/status', methods=['GET'])
+@require_auth
+def get_file_processing_status(file_id):
+    """
+    Tiến độ xử lý nền sau upload (search index, embedding, phân loại, cloud)
+    Trạng thái theo job mới nhất của file; `jobs` là mọi job của file (mới nhất trước).
+    ---
+    tags:
+      - File
+    parameters:
+      - name: file_id
+        in: path
+        type: string
+        required: true
+        description: ID file
+    responses:
+      200:
+        description: Trạng thái từng stage
+        examples:
+          application/json: {
+            "file_id": "file_123",
+            "status": "running",
+            "progress": 0.25,
+            "stages": [
+              {"name": "search_index", "status": "done"},
+              {"name": "embed", "status": "running", "started_at": "2024-01-01T00:00:01"},
+              {"name": "classify", "status": "pending"},
+              {"name": "cloud_metadata", "status": "pending"}
+            ],
+            "attempts": 0,
+            "last_error": null,
+            "jobs": ["job_456"],
+            "classification": null
+          }
+      403:
+        description: Không có quyền truy cập file
+      404:
+        description: File không tồn tại hoặc không có job xử lý
+    """
+    try:
+        user_id = request.user['user_id']
+        user_role = request.user.get('role', 'user')
+        file_info = file_manager.get_file_by_id(file_id)
+        if not file_info:
+            return jsonify({'error': 'File không tồn tại'}), 404
+        if user_role != 'admin' and file_info['uploaded_by'] != user_id:
+            return jsonify({'error': 'Không có quyền truy cập file này'}), 403
+        status = file_manager.get_processing_status(file_id)
+        if status is None:
+            return jsonify({'error': 'File không có job xử lý'}), 404
+        return jsonify(status)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@file_bp.route('/files/<file_id>/retry', methods=['POST'])
+@require_auth
+def retry_file_processing(file_id):
+    """
+    Chạy lại xử lý nền của file bị lỗi, tiếp tục từ stage lỗi
+    ---
+    tags:
+      - File
+    parameters:
+      - name: file_id
+        in: path
+        type: string
+        required: true
+        description: ID file
+    responses:
+      200:
+        description: Đã xếp lại hàng đợi
+      400:
+        description: Job không ở trạng thái failed
+      403:
+        description: Không có quyền truy cập file
+      404:
+        description: File không tồn tại
+    """
+    try:
+        user_id = request.user['user_id']
+        user_role = request.user.get('role', 'user')
+        file_info = file_manager.get_file_by_id(file_id)
+        if not file_info:
+            return jsonify({'error': 'File không tồn tại'}), 404
+        if user_role != 'admin' and file_info['uploaded_by'] != user_id:
+            return jsonify({'error': 'Không có quyền truy cập file này'}), 403
+        if not file_manager.upload_jobs.retry(file_id):
+            return jsonify({'error': 'Chỉ chạy lại được job đang ở trạng thái failed'}), 400
+        return jsonify({'success': True, 'status': file_manager.get_processing_status(file_id)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @file_bp.route('/files/metadata/batch', methods=['POST'])
 @require_auth
 def send_metadata_batch():
@@ -682,6 +998,52 @@ def admin_upload_file():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def batch_upload_response(results):
+    """Response cho upload batch: các file được lưu song song, kết quả từng file được
+    stream (SSE, event `file`) ngay khi xong nếu client gửi ?stream=true hoặc
+    Accept: text/event-stream; ngược lại trả về JSON tổng hợp như trước"""
+    if request.args.get('stream') == 'true' or request.accept_mimetypes.best == 'text/event-stream':
+        def events():
+            successful = 0
+            for result in results:
+                if 'batch' in result:
+                    yield format_sse('done', {'uploaded': successful, **result['batch']})
+                else:
+                    successful += 1 if result['success'] else 0
+                    yield format_sse('file', result)
+        return sse_response(events())
+
+    successful_files = []
+    failed_files = []
+    batch = {}
+    for result in results:
+        if 'batch' in result:
+            batch = result['batch']
+        elif result['success']:
+            successful_files.append(result['file'])
+        else:
+            failed_files.append({
+                'original_name': result['original_name'],
+                'error': result.get('message', 'Lỗi không xác định')
+            })
+
+    response_data = {
+        'success': len(successful_files) > 0,
+        'message': f'Upload thành công {len(successful_files)} file(s)',
+        'files': successful_files,
+        'failed_files': failed_files,
+        'processing': {
+            'job_id': batch.get('job_id'),
+            'status': batch.get('status'),
+            'status_urls': {file['id']: f"/api/files/{file['id']}/status" for file in successful_files}
+        }
+    }
+
+    if successful_files:
+        return jsonify(response_data), 201
+    else:
+        return jsonify(response_data), 400
+
 @file_bp.route('/user/files/batch', methods=['POST'])
 @require_auth
 def user_upload_files_batch():
@@ -703,9 +1065,14 @@ def user_upload_files_batch():
         type: file
         required: true
         description: "Danh sách files cần upload - multiple"
+      - name: stream
+        in: query
+        type: boolean
+        required: false
+        description: "true: stream kết quả từng file (SSE, event `file`, cuối cùng `done`) ngay khi lưu xong"
     responses:
       201:
-        description: Upload files thành công
+        description: Upload files thành công (các file được lưu song song, xử lý nền chung một job)
         schema:
           type: object
           properties:
@@ -761,39 +1128,8 @@ def user_upload_files_batch():
         user_id = request.user['user_id']
         user_department = request.user.get('department')
         department = request.form.get('department', user_department)  # Lấy từ form hoặc từ user
-        successful_files = []
-        failed_files = []
-        
-        for file in files:
-            if file.filename == '':
-                continue
-                
-            try:
-                result = file_manager.add_file(file, user_id, department)
-                if result['success']:
-                    successful_files.append(result['file'])
-                else:
-                    failed_files.append({
-                        'original_name': file.filename,
-                        'error': result.get('message', 'Lỗi không xác định')
-                    })
-            except Exception as e:
-                failed_files.append({
-                    'original_name': file.filename,
-                    'error': str(e)
-                })
-        
-        response_data = {
-            'success': len(successful_files) > 0,
-            'message': f'Upload thành công {len(successful_files)} file(s)',
-            'files': successful_files,
-            'failed_files': failed_files
-        }
-        
-        if successful_files:
-            return jsonify(response_data), 201
-        else:
-            return jsonify(response_data), 400
+        results = file_manager.add_files_batch(files, user_id, department)
+        return batch_upload_response(results)
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -830,9 +1166,14 @@ def admin_upload_files_batch():
         type: string
         required: false
         description: Department của files
+      - name: stream
+        in: query
+        type: boolean
+        required: false
+        description: "true: stream kết quả từng file (SSE, event `file`, cuối cùng `done`) ngay khi lưu xong"
     responses:
       201:
-        description: Upload files thành công
+        description: Upload files thành công (các file được lưu song song, xử lý nền chung một job)
       400:
         description: Dữ liệu không hợp lệ
       401:
@@ -860,46 +1201,14 @@ def admin_upload_files_batch():
         # Lấy thông tin department
         department = request.form.get('department', None)
         
-        successful_files = []
-        failed_files = []
-        
-        for file in files:
-            if file.filename == '':
-                continue
-                
-            try:
-                # Upload file với thông tin phân quyền và department
-                result = file_manager.add_file_with_permissions(
-                    file=file,
-                    uploaded_by=request.user['user_id'],
-                    allowed_users=allowed_users,
-                    department=department
-                )
-                
-                if result['success']:
-                    successful_files.append(result['file'])
-                else:
-                    failed_files.append({
-                        'original_name': file.filename,
-                        'error': result.get('message', 'Lỗi không xác định')
-                    })
-            except Exception as e:
-                failed_files.append({
-                    'original_name': file.filename,
-                    'error': str(e)
-                })
-        
-        response_data = {
-            'success': len(successful_files) > 0,
-            'message': f'Upload thành công {len(successful_files)} file(s)',
-            'files': successful_files,
-            'failed_files': failed_files
-        }
-        
-        if successful_files:
-            return jsonify(response_data), 201
-        else:
-            return jsonify(response_data), 400
+        # Upload file với thông tin phân quyền và department
+        results = file_manager.add_files_batch(
+            files,
+            uploaded_by=request.user['user_id'],
+            department=department,
+            allowed_users=allowed_users
+        )
+        return batch_upload_response(results)
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500 
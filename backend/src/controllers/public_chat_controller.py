@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
-from src.llm import workflow, RagDataContext
+from src.llm import workflow, stream_workflow, RagDataContext, ANONYMOUS_FILTER
+from src.streaming import format_sse, sse_response
+from src.llm_gateway import GatewaySaturated, saturated_response, llm_gateway, Priority
 import uuid
+from contextlib import closing
 from datetime import datetime
 
 public_chat_bp = Blueprint('public_chat', __name__)
@@ -93,7 +96,8 @@ def public_chat():
             steps=[],
             file_urls=[],
             file_documents=[],
-            chat_context=""
+            chat_context="",
+            metadata_filter=ANONYMOUS_FILTER
         )
         
         # Chạy workflow để generate response
@@ -109,9 +113,87 @@ def public_chat():
             'timestamp': datetime.utcnow().isoformat()
         })
         
+    except GatewaySaturated as e:
+        return saturated_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@public_chat_bp.route('/public/chat/stream', methods=['POST'])
+def public_chat_stream():
+    """
+    Chat công khai, stream câu trả lời theo từng token (Server-Sent Events)
+    ---
+    tags:
+      - Public Chat
+    consumes:
+      - application/json
+    produces:
+      - text/event-stream
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - message
+          properties:
+            message:
+              type: string
+              description: Nội dung tin nhắn
+              example: "Xin chào, bạn có thể giúp gì cho tôi?"
+    responses:
+      200:
+        description: |
+          Stream các event SSE: `step`, nhiều `token` ({"text": ...}),
+          cuối cùng `done` ({"response", "timestamp"}) hoặc `error`.
+          Không có event `retrieval`: public chat không được thấy tên/id file.
+      400:
+        description: Dữ liệu không hợp lệ
+      429:
+        description: LLM đang quá tải, thử lại sau số giây trong header Retry-After
+    """
+    data = request.get_json() or {}
+    message = data.get('message', '').strip()
+    if not message:
+        return jsonify({'error': 'Message không được để trống'}), 400
+    try:
+        llm_gateway.check_capacity(Priority.INTERACTIVE)
+    except GatewaySaturated as e:
+        return saturated_response(e)
+
+    rag_context = RagDataContext(
+        question=message,
+        generation="",
+        documents=[],
+        steps=[],
+        file_urls=[],
+        file_documents=[],
+        chat_context="",
+        metadata_filter=ANONYMOUS_FILTER
+    )
+
+    def events():
+        try:
+            # Không gửi danh sách file/trích dẫn cho người dùng không đăng nhập
+            with closing(stream_workflow(rag_context, include_sources=False)) as workflow_events:
+                for event in workflow_events:
+                    if event["event"] == "complete":
+                        yield format_sse("done", {
+                            'success': True,
+                            'message': message,
+                            'response': event["data"].get("generation", ""),
+                            'timestamp': datetime.utcnow().isoformat()
+                        })
+                    else:
+                        yield format_sse(event["event"], event["data"])
+        except GatewaySaturated as e:
+            yield format_sse("error", {'error': str(e), 'retry_after': e.retry_after})
+        except Exception as e:
+            yield format_sse("error", {'error': str(e)})
+
+    return sse_response(events())
+
 @public_chat_bp.route('/public/chat/simple', methods=['POST'])
 def simple_chat():
     """
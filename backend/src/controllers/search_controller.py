@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from src.auth import require_auth
 from src.file_search import file_search_engine
+from src.hybrid_search import hybrid_retriever
 
 search_bp = Blueprint('search', __name__)
 
@@ -37,9 +38,9 @@ def search_files():
               example: "kế hoạch 2024"
             search_type:
               type: string
-              description: "Loại tìm kiếm - name, content, both"
+              description: "Loại tìm kiếm - name, content, both, hybrid (từ khóa + vector, trả về kèm timings)"
               example: "both"
-              enum: ["name", "content", "both"]
+              enum: ["name", "content", "both", "hybrid"]
             limit:
               type: integer
               description: "Số lượng kết quả tối đa - mặc định 20"
@@ -59,6 +60,10 @@ def search_files():
             total:
               type: integer
               example: 5
+            timings:
+              type: object
+              description: "Thời gian từng bước (ms), chỉ có khi search_type là hybrid"
+              example: {"lexical_ms": 1.2, "embed_ms": 35.4, "vector_ms": 2.1, "fusion_ms": 0.3, "total_ms": 39.0}
             results:
               type: array
               items:
@@ -145,25 +150,39 @@ def search_files():
         if not query:
             return jsonify({'error': 'Query không được để trống'}), 400
             
-        if search_type not in ['name', 'content', 'both']:
+        if search_type not in ['name', 'content', 'both', 'hybrid']:
             return jsonify({'error': 'Search type không hợp lệ'}), 400
         
         user_id = request.user['user_id']
         user_role = request.user['role']
-        results = file_search_engine.search_files(
-            query=query,
-            user_id=user_id,
-            user_role=user_role,
-            search_type=search_type,
-            limit=limit
-        )
+        timings = None
+        if search_type == 'hybrid':
+            results, timings = hybrid_retriever.search_files(
+                query=query,
+                user_id=user_id,
+                user_role=user_role,
+                department=request.user.get('department'),
+                limit=limit
+            )
+        else:
+            results = file_search_engine.search_files(
+                query=query,
+                user_id=user_id,
+                user_role=user_role,
+                search_type=search_type,
+                limit=limit,
+                department=request.user.get('department')
+            )
         
-        return jsonify({
+        response = {
             'query': query,
             'search_type': search_type,
             'results': results,
             'total': len(results)
-        })
+        }
+        if timings is not None:
+            response['timings'] = timings
+        return jsonify(response)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -239,7 +258,8 @@ def get_search_suggestions():
         suggestions = file_search_engine.get_search_suggestions(
             user_id=user_id,
             user_role=user_role,
-            query=query
+            query=query,
+            department=request.user.get('department')
         )
         
         return jsonify({
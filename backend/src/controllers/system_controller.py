@@ -1,5 +1,5 @@
 from flask import Blueprint, request, jsonify
-from src.auth import require_auth
+from src.auth import require_auth, require_admin
 from datetime import datetime
 
 system_bp = Blueprint('system', __name__)
@@ -163,4 +163,124 @@ def health_check():
             'status': 'unhealthy',
             'error': str(e),
             'timestamp': datetime.now().isoformat()
-        }), 500 
\ No newline at end of file
+        }), 500
+
+@system_bp.route('/system/metrics', methods=['GET'])
+@require_auth
+@require_admin
+def system_metrics():
+    """
+    Thống kê hiệu năng các thành phần AI (admin)
+    ---
+    tags:
+      - System
+    parameters:
+      - name: Authorization
+        in: header
+        type: string
+        required: true
+        description: "Bearer token JWT - Admin only"
+    responses:
+      200:
+        description: Thống kê hiện tại
+        schema:
+          type: object
+          properties:
+            timestamp:
+              type: string
+              format: date-time
+            embeddings:
+              type: object
+              properties:
+                model:
+                  type: string
+                  example: "nomic-embed-text"
+                hits:
+                  type: integer
+                  example: 120
+                misses:
+                  type: integer
+                  example: 30
+                hit_rate:
+                  type: number
+                  example: 0.8
+                model_calls:
+                  type: integer
+                  example: 4
+                texts_embedded:
+                  type: integer
+                  example: 30
+                query_hits:
+                  type: integer
+                  example: 45
+                query_misses:
+                  type: integer
+                  example: 15
+                query_hit_rate:
+                  type: number
+                  example: 0.75
+                query_cache:
+                  type: object
+                  description: LRU embedding câu hỏi trong bộ nhớ
+                  example: {"entries": 15, "bytes": 46500, "max_bytes": 33554432}
+            chat_memory:
+              type: object
+              properties:
+                scopes:
+                  type: integer
+                  example: 12
+                entries:
+                  type: integer
+                  example: 340
+            answer_cache:
+              type: object
+              description: Hit rate của answer cache theo endpoint (hits = khớp chính xác, similar_hits = câu hỏi gần giống)
+              properties:
+                entries:
+                  type: integer
+                  example: 85
+                endpoints:
+                  type: object
+                  example: {"public_chat.public_chat": {"hits": 40, "similar_hits": 5, "misses": 55, "hit_rate": 0.45}}
+            llm_gateway:
+              type: object
+              description: Số lời gọi Ollama đang chạy / đang chờ, theo priority (interactive, agentic, background)
+              properties:
+                max_in_flight:
+                  type: integer
+                  example: 4
+                in_flight:
+                  type: integer
+                  example: 4
+                queued:
+                  type: integer
+                  example: 7
+                classes:
+                  type: object
+                  example: {"interactive": {"in_flight": 3, "queued": 2, "max_queued": 9, "completed": 1530, "rejected": 0, "avg_wait_ms": 120.5, "avg_service_ms": 2400.0, "max_in_flight": 4, "max_queue": 64}}
+            upload_jobs:
+              type: object
+              description: Số job xử lý sau upload theo trạng thái
+              example: {"queued": 3, "running": 2, "done": 120, "failed": 1}
+      403:
+        description: Không có quyền admin
+      500:
+        description: Lỗi server
+    """
+    try:
+        from src.embedding_cache import get_embedding_stats
+        from src.chat_memory import conversation_memory
+        from src.answer_cache import answer_cache
+        from src.llm_gateway import get_gateway_stats
+        from src.file_manager import file_manager
+        return jsonify({
+            'timestamp': datetime.now().isoformat(),
+            'embeddings': get_embedding_stats(),
+            'chat_memory': conversation_memory.stats(),
+            'answer_cache': answer_cache.stats(),
+            'llm_gateway': get_gateway_stats(),
+            'upload_jobs': file_manager.upload_jobs.stats()
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
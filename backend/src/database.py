@@ -63,6 +63,7 @@ class File(Base):
     file_type = Column(String(100), nullable=False)
     uploaded_by = Column(String(50), nullable=False)
     department = Column(String(50), nullable=True)  # Department của file
+    content_hash = Column(String(64), nullable=True, index=True)  # sha256 nội dung, file trùng dùng chung blob
     uploaded_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     is_active = Column(Boolean, default=True, nullable=False)
 
@@ -0,0 +1,238 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_ollama import OllamaEmbeddings
+
+from src.config import OllamaConfig
+from src.llm_gateway import call_llm
+
+
+class EmbeddingCache:
+    """Cache embedding trên đĩa (SQLite), khóa là model + sha256 của nội dung"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, content_hash)
+            )
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        unique_hashes = list(set(hashes))
+        with self._lock:
+            # SQLite giới hạn số tham số trong một câu lệnh
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT content_hash, vector FROM embeddings WHERE model = ? AND content_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for content_hash, blob in rows:
+                    found[content_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]):
+        if not items:
+            return
+        rows = [
+            (model, content_hash, len(vector), np.asarray(vector, dtype=np.float32).tobytes())
+            for content_hash, vector in items.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, content_hash, dim, vector) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+
+class QueryEmbeddingCache:
+    """LRU câu hỏi -> embedding trong bộ nhớ, giới hạn theo tổng số byte (vector float32 + text)"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Câu hỏi chỉ khác khoảng trắng / dạng Unicode dùng chung một embedding"""
+        return " ".join(unicodedata.normalize('NFC', text).split())
+
+    @staticmethod
+    def _size(key: str, vector: np.ndarray) -> int:
+        return vector.nbytes + len(key.encode('utf-8'))
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                return None
+            self._entries.move_to_end(key)
+        # Trả về list mới để caller sửa cũng không ảnh hưởng cache
+        return vector.tolist()
+
+    def put(self, key: str, embedding: List[float]):
+        vector = np.asarray(embedding, dtype=np.float32)
+        size = self._size(key, vector)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= self._size(key, old)
+            self._entries[key] = vector
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key, old_vector = self._entries.popitem(last=False)
+                self._bytes -= self._size(old_key, old_vector)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+
+class CachedEmbeddings(Embeddings):
+    """Gom các đoạn text thành batch gọi Ollama, bỏ qua những đoạn đã có trong cache"""
+
+    def __init__(self, model: str, cache: Optional[EmbeddingCache] = None, batch_size: int = None,
+                 query_cache: Optional[QueryEmbeddingCache] = None, persist_queries: bool = False):
+        self.model = model
+        self.client = OllamaEmbeddings(model=model)
+        self.cache = cache
+        self.batch_size = batch_size or OllamaConfig.EmbeddingBatchSize
+        self.query_cache = query_cache
+        # Embedding câu hỏi lưu trong cache trên đĩa theo model riêng, không lẫn với document
+        self.persist_queries = persist_queries and cache is not None
+        self._query_model = f"{model}#query"
+        self._stats_lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'model_calls': 0, 'texts_embedded': 0,
+                      'query_hits': 0, 'query_misses': 0}
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def _embed_batches(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            vectors.extend(call_llm(self.client.embed_documents, batch))
+            self._count(model_calls=1, texts_embedded=len(batch))
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if self.cache is None:
+            self._count(misses=len(texts))
+            return self._embed_batches(texts)
+
+        hashes = [EmbeddingCache.content_hash(text) for text in texts]
+        cached = self.cache.get_many(self.model, hashes)
+
+        # Chỉ embed mỗi nội dung chưa có trong cache một lần
+        missing = {}
+        for content_hash, text in zip(hashes, texts):
+            if content_hash not in cached and content_hash not in missing:
+                missing[content_hash] = text
+        self._count(hits=len(texts) - len(missing), misses=len(missing))
+
+        if missing:
+            new_vectors = dict(zip(missing.keys(), self._embed_batches(list(missing.values()))))
+            self.cache.put_many(self.model, new_vectors)
+            cached.update(new_vectors)
+
+        return [cached[content_hash] for content_hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Câu hỏi lặp lại (chat, search, agentic trong cùng một lượt) không gọi lại model"""
+        if self.query_cache is None:
+            self._count(model_calls=1, texts_embedded=1)
+            return call_llm(self.client.embed_query, text)
+
+        key = QueryEmbeddingCache.normalize(text)
+        embedding = self.query_cache.get(key)
+        if embedding is None and self.persist_queries:
+            content_hash = EmbeddingCache.content_hash(key)
+            embedding = self.cache.get_many(self._query_model, [content_hash]).get(content_hash)
+            if embedding is not None:
+                self.query_cache.put(key, embedding)
+        if embedding is not None:
+            self._count(query_hits=1)
+            return embedding
+
+        self._count(query_misses=1, model_calls=1, texts_embedded=1)
+        embedding = call_llm(self.client.embed_query, key)
+        self.query_cache.put(key, embedding)
+        if self.persist_queries:
+            try:
+                self.cache.put_many(self._query_model, {EmbeddingCache.content_hash(key): embedding})
+            except Exception as e:
+                print(f"[EMBEDDING CACHE] Could not persist query embedding: {e}")
+        return embedding
+
+    def get_stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        query_lookups = stats['query_hits'] + stats['query_misses']
+        stats['query_hit_rate'] = round(stats['query_hits'] / query_lookups, 4) if query_lookups else 0.0
+        if self.query_cache is not None:
+            stats['query_cache'] = self.query_cache.stats()
+        stats['model'] = self.model
+        return stats
+
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+def get_embeddings() -> CachedEmbeddings:
+    """Embedding client dùng chung cho cả process"""
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                cache = None
+                if OllamaConfig.EmbeddingCachePath:
+                    try:
+                        cache = EmbeddingCache(OllamaConfig.EmbeddingCachePath)
+                    except Exception as e:
+                        print(f"[EMBEDDING CACHE] Could not open cache, running without it: {e}")
+                query_cache = None
+                if OllamaConfig.QueryCacheMaxBytes > 0:
+                    query_cache = QueryEmbeddingCache(OllamaConfig.QueryCacheMaxBytes)
+                _embeddings = CachedEmbeddings(OllamaConfig.EmbeddingModel, cache=cache, query_cache=query_cache,
+                                               persist_queries=OllamaConfig.QueryCachePersist)
+    return _embeddings
+
+def get_embedding_stats() -> Dict:
+    return get_embeddings().get_stats()
@@ -0,0 +1,120 @@
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import faiss
+
+from src.config import FaissConfig
+
+INDEX_TYPES = ('flat', 'ivfpq', 'hnsw')
+
+
+def index_type_of(index) -> str:
+    """Loại index bên trong IndexIDMap2: flat / ivfpq / hnsw"""
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(inner, faiss.IndexIVF):
+        return 'ivfpq'
+    if isinstance(inner, faiss.IndexHNSW):
+        return 'hnsw'
+    return 'flat'
+
+
+def resolve_index_type(ntotal: int, index_type: str = None) -> str:
+    """Index nhỏ dùng Flat: brute-force vừa nhanh vừa chính xác hơn ANN"""
+    index_type = (index_type or FaissConfig.IndexType).lower()
+    if index_type not in INDEX_TYPES:
+        print(f"[FAISS] Unknown index type '{index_type}', falling back to flat")
+        return 'flat'
+    if index_type != 'flat' and ntotal < FaissConfig.AnnMinVectors:
+        return 'flat'
+    return index_type
+
+
+def _pq_subquantizers(dim: int) -> int:
+    # Số subquantizer phải chia hết số chiều
+    m = min(FaissConfig.PqM, dim)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def build_index(dim: int, vectors: Optional[np.ndarray] = None, ids: Optional[np.ndarray] = None,
+                index_type: str = None):
+    """Tạo IndexIDMap2 theo loại cấu hình, train (IVF-PQ) trên chính các vector cần add"""
+    ntotal = 0 if vectors is None else len(vectors)
+    index_type = resolve_index_type(ntotal, index_type)
+
+    if index_type == 'hnsw':
+        inner = faiss.IndexHNSWFlat(dim, FaissConfig.HnswM)
+        inner.hnsw.efConstruction = FaissConfig.HnswEfConstruction
+    elif index_type == 'ivfpq':
+        # faiss cần ~39 điểm cho mỗi centroid khi train
+        nlist = FaissConfig.IvfNlist or int(4 * np.sqrt(ntotal))
+        nlist = max(1, min(nlist, ntotal // 39))
+        inner = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist, _pq_subquantizers(dim), 8)
+        sample = vectors
+        if len(sample) > nlist * 256:
+            sample = vectors[np.random.default_rng(0).choice(len(vectors), nlist * 256, replace=False)]
+        inner.train(sample)
+        # Cho phép reconstruct vector (cần cho MMR)
+        inner.make_direct_map()
+        inner.nprobe = FaissConfig.IvfNprobe
+    else:
+        inner = faiss.IndexFlatL2(dim)
+
+    index = faiss.IndexIDMap2(inner)
+    if ntotal:
+        index.add_with_ids(vectors, ids)
+    return index
+
+
+def search_params(index, selector=None):
+    """SearchParameters đúng kiểu cho index bên trong (IVF/HNSW từ chối kiểu chung)"""
+    index_type = index_type_of(index)
+    if index_type == 'ivfpq':
+        params = faiss.SearchParametersIVF(nprobe=FaissConfig.IvfNprobe)
+    elif index_type == 'hnsw':
+        params = faiss.SearchParametersHNSW(efSearch=FaissConfig.HnswEfSearch)
+    elif selector is None:
+        return None
+    else:
+        params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+        # Giữ tham chiếu Python để selector không bị GC trong lúc search
+        params.referenced_selector = selector
+    return params
+
+
+def benchmark(vectors: np.ndarray, index_types: List[str] = None, k: int = 10, n_queries: int = 100) -> List[Dict]:
+    """Đo recall@k và độ trễ của từng loại index so với kết quả chính xác của Flat"""
+    index_types = index_types or list(INDEX_TYPES)
+    ids = np.arange(len(vectors), dtype=np.int64)
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)]
+    k = min(k, len(vectors))
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    results = []
+    for index_type in index_types:
+        started = time.perf_counter()
+        index = build_index(vectors.shape[1], vectors, ids, index_type=index_type)
+        build_seconds = time.perf_counter() - started
+        params = search_params(index)
+
+        started = time.perf_counter()
+        _, found = index.search(queries, k, params=params)
+        latency_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+        recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(len(queries))])
+        results.append({
+            'requested_type': index_type,
+            'actual_type': index_type_of(index),
+            f'recall@{k}': round(float(recall), 4),
+            'latency_ms': round(latency_ms, 4),
+            'build_seconds': round(build_seconds, 3)
+        })
+    return results
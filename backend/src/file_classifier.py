@@ -3,6 +3,7 @@ import re
 from typing import Dict, List, Optional
 from langchain_ollama import ChatOllama
 from src.config import OllamaConfig
+from src.llm_gateway import call_llm, Priority
 from src.file_utils.file_loader import load_document_from_file
 from src.database import get_db, File as DBFile
 
@@ -101,7 +102,7 @@ class FileClassifier:
             """
             
             # Gọi AI
-            response = self.llm.invoke(prompt)
+            response = call_llm(self.llm.invoke, prompt, priority=Priority.BACKGROUND)
             result = response.content.strip()
             
             # Parse kết quả
@@ -293,7 +293,8 @@ Chỉ trả lời nội dung tóm tắt, không cần giải thích thêm.
         except Exception:
             return 0.0
     
-    def find_files_for_comparison(self, query: str, user_id: str, user_role: str) -> List[Dict[str, Any]]:
+    def find_files_for_comparison(self, query: str, user_id: str, user_role: str,
+                                  department: str = None) -> List[Dict[str, Any]]:
         """
         Tìm file dành cho so sánh dựa trên query
         Ví dụ: "so sánh budget 2024 và 2025" -> tìm file có chứa "budget 2024" và "budget 2025"
@@ -305,27 +306,19 @@ Chỉ trả lời nội dung tóm tắt, không cần giải thích thêm.
         
         if len(keywords) < 2:
             # Nếu không tách được, tìm chung với query gốc
-            search_results = file_search_engine.search_all(query, user_id, user_role)
+            search_results = file_search_engine.search_all(query, user_id, user_role, department)
             return search_results.get('results', [])[:5]  # Lấy tối đa 5 file
         
-        # Tìm file cho từng keyword
-        all_files = []
-        for keyword in keywords:
-            search_results = file_search_engine.search_all(keyword, user_id, user_role)
-            all_files.extend(search_results.get('results', []))
-        
-        # Loại bỏ trùng lặp
-        seen_ids = set()
-        unique_files = []
-        for file in all_files:
-            if file['id'] not in seen_ids:
-                seen_ids.add(file['id'])
-                unique_files.append(file)
-        
-        # Sắp xếp theo độ phù hợp
-        unique_files.sort(key=lambda x: x.get('match_score', 0), reverse=True)
+        # Xếp hạng tất cả keyword trong một lần gọi, loại bỏ trùng lặp theo file id (giữ điểm cao nhất)
+        unique_files = {}
+        for ranked in file_search_engine.rank_queries(keywords, user_id, user_role, department):
+            for file_id, score, match_type in ranked[:10]:
+                if file_id not in unique_files or score > unique_files[file_id][1]:
+                    unique_files[file_id] = (file_id, score, match_type)
         
-        return unique_files[:5]  # Lấy tối đa 5 file
+        # Sắp xếp theo độ phù hợp, chỉ lấy thông tin của tối đa 5 file
+        best = sorted(unique_files.values(), key=lambda item: item[1], reverse=True)[:5]
+        return file_search_engine.materialize(best)
     
     def _extract_comparison_keywords(self, query: str) -> List[str]:
         """
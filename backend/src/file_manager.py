@@ -4,17 +4,33 @@ import json
 from typing import Dict, List, Optional
 from datetime import datetime
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from langchain.schema import Document
 from src.database import get_db, File as DBFile, FilePermission
 
 # Import new components
 from src.file_search import file_search_engine
 from src.file_classifier import file_classifier
 from src.cloud_integration import cloud_integration
+from src.file_utils.file_loader import load_document_from_file
+from src.file_utils.text_chunker import chunk_documents
+from src.index_fingerprints import record_fingerprint, remove_fingerprint
+from src.llm_gateway import use_priority, Priority
+from src.upload_jobs import UploadJobQueue
+from src.chunked_uploads import ChunkedUploadManager, UploadOffsetMismatch
+from src.file_utils.upload_writer import UploadWriter, needs_utf8
+from src.config import UploadJobConfig, UploadConfig
 import src.vectordb as vectordb
 
 # File để lưu trữ thông tin files
 FILES_DB_FILE = "files_db.json"
 UPLOAD_FOLDER = "uploads"
+# Nội dung file lưu một lần theo sha256: uploads/blobs/<2 ký tự đầu>/<sha256><ext>
+BLOB_FOLDER = "blobs"
+# File đang upload, chưa biết hash
+INCOMING_FOLDER = ".incoming"
 
 class FileManager:
     def __init__(self):
@@ -28,6 +44,21 @@ class FileManager:
         
         self.load_files_db()
 
+        self.incoming_folder = os.path.join(self.upload_folder, INCOMING_FOLDER)
+        os.makedirs(self.incoming_folder, exist_ok=True)
+        # Đặt blob vào store / đếm tham chiếu khi xóa không chạy xen nhau
+        self._blob_lock = threading.Lock()
+        # Ghi vector của file (job embed) và xóa vector (delete / vô hiệu hóa) không chạy xen nhau
+        self._index_lock = threading.Lock()
+
+        # Xử lý sau upload (search index, embedding, phân loại, cloud) chạy nền
+        self.upload_jobs = UploadJobQueue(UploadJobConfig.QueuePath, self.post_process_stages())
+        self.upload_jobs.start()
+
+        # Upload nhiều phần cho file vượt MAX_CONTENT_LENGTH
+        self.chunked_uploads = ChunkedUploadManager(UploadConfig.SessionDir, UploadConfig.ChunkSize,
+                                                    UploadConfig.MaxFileSize, UploadConfig.SessionTtlSeconds)
+
     def load_files_db(self):
         """Load database files từ file"""
         if os.path.exists(self.files_db_path):
@@ -46,59 +77,345 @@ class FileManager:
         except Exception as e:
             print(f"Error saving files database: {e}")
 
-    def add_file(self, file, uploaded_by: str, department: str = None) -> Dict:
-        """Thêm file mới với phân loại và index - FIX: Đảm bảo department được lưu"""
+    def index_files_content(self, file_infos: List[DBFile]) -> Dict[str, Dict]:
+        """Load, chia chunk và thêm nội dung nhiều file vào FAISS: embedding gom chung
+        cho cả batch và index chỉ ghi một lần. Trả về {file_id: {'chunks': n}}.
+        File load lỗi được raise (sau khi đã ghi các file còn lại) để job được retry."""
+        vectorstore = vectordb.get_vector_store()
+        results = {}
+        errors = {}
+        documents = []
+        copied = []
+        loaded = {}
+        for file_info in file_infos:
+            # Chạy lại sau lỗi: xóa các chunk đã ghi dở của lần trước
+            vectordb.remove_by_file_id(vectorstore, file_info.id)
+            metadata = self._chunk_metadata(file_info)
+
+            # File trùng nội dung đã được index: copy chunk và vector, không load/embed lại
+            donor = self._indexed_duplicate(vectorstore, file_info)
+            if donor is not None:
+                donor_id, donor_documents, donor_vectors = donor
+                copied.append(([
+                    Document(page_content=doc.page_content, metadata={**doc.metadata, **metadata})
+                    for doc in donor_documents
+                ], donor_vectors))
+                results[file_info.id] = {'chunks': len(donor_documents), 'reused_from': donor_id}
+                continue
+
+            try:
+                # Cùng blob trong batch thì chỉ load/chia chunk một lần
+                if file_info.file_path not in loaded:
+                    loaded[file_info.file_path] = chunk_documents(load_document_from_file(file_info.file_path, strict=True))
+            except Exception as e:
+                print(f"Error loading {file_info.original_name} for FAISS: {e}")
+                errors[file_info.original_name] = str(e)
+                continue
+            file_documents = [
+                Document(page_content=doc.page_content, metadata={**doc.metadata, **metadata})
+                for doc in loaded[file_info.file_path]
+                if doc.page_content and doc.page_content.strip()
+            ]
+            documents.extend(file_documents)
+            results[file_info.id] = {'chunks': len(file_documents)}
+
+        # Embedding (priority nền) chạy ngoài khóa, lỗi embed được raise để job retry
+        embeddings = []
+        if documents:
+            with use_priority(Priority.BACKGROUND):
+                embeddings = vectorstore.embedding_function.embed_documents([doc.page_content for doc in documents])
+
+        # Writer duy nhất: file bị xóa / vô hiệu hóa trong lúc embed thì không ghi lại vector
+        with self._index_lock:
+            live_ids = self._live_file_ids(list(results))
+            copied = [(docs, vectors) for docs, vectors in copied if docs[0].metadata['file_id'] in live_ids]
+            if copied:
+                vectordb.add_embedded_documents(vectorstore, [doc for docs, _ in copied for doc in docs],
+                                                np.vstack([vectors for _, vectors in copied]))
+            kept = [i for i, doc in enumerate(documents) if doc.metadata['file_id'] in live_ids]
+            if kept:
+                vectordb.add_embedded_documents(vectorstore, [documents[i] for i in kept],
+                                                [embeddings[i] for i in kept])
+            if copied or kept:
+                vectordb.flush(vectorstore)
+            for file_info in file_infos:
+                if file_info.id not in results:
+                    continue
+                if file_info.id not in live_ids:
+                    print(f"Skipped FAISS write for {file_info.original_name}: file was deleted or deactivated")
+                    results[file_info.id] = {'chunks': 0, 'skipped': 'deleted'}
+                    continue
+                # Để reindex_files.py incremental bỏ qua file vừa index
+                record_fingerprint(file_info.id, file_info.file_path)
+                print(f"Added file {file_info.original_name} to FAISS database ({results[file_info.id]['chunks']} chunks)")
+
+        if errors:
+            raise RuntimeError("Không load được file để index: " +
+                               "; ".join(f"{name}: {error}" for name, error in errors.items()))
+        return results
+
+    def _live_file_ids(self, file_ids: List[str]) -> set:
+        """Các file_id còn tồn tại và đang active trong database"""
+        if not file_ids:
+            return set()
+        db = next(get_db())
         try:
-            if not file or file.filename == '':
-                return {"success": False, "message": "Không có file được chọn"}
+            rows = db.query(DBFile.id).filter(DBFile.id.in_(file_ids), DBFile.is_active == True).all()
+            return {row[0] for row in rows}
+        finally:
+            db.close()
 
-            # Tạo tên file unique
-            filename = file.filename
-            base_name, ext = os.path.splitext(filename)
-            counter = 1
-            while os.path.exists(os.path.join(self.upload_folder, filename)):
-                filename = f"{base_name}_{counter}{ext}"
-                counter += 1
-
-            # Lưu file
-            file_path = os.path.join(self.upload_folder, filename)
-            file.save(file_path)
-
-            # Nếu là file text, convert sang UTF-8 để tránh lỗi đọc
-            if file_path.lower().endswith('.txt'):
-                try:
-                    with open(file_path, 'rb') as f:
-                        raw = f.read()
-                    # Thử decode với utf-8, nếu lỗi thì thử các encoding phổ biến
-                    encodings = ['utf-8', 'utf-16', 'utf-8-sig', 'latin-1', 'windows-1252', 'ascii']
-                    for enc in encodings:
-                        try:
-                            text = raw.decode(enc)
-                            break
-                        except Exception:
-                            text = None
-                    if text is not None:
-                        with open(file_path, 'w', encoding='utf-8') as f:
-                            f.write(text)
-                        print(f"[INFO] Converted {filename} to UTF-8 encoding.")
-                    else:
-                        print(f"[WARN] Could not decode {filename} with common encodings.")
-                except Exception as e:
-                    print(f"[ERROR] Failed to convert {filename} to UTF-8: {e}")
-
-            # Lưu thông tin file vào database
-            db = next(get_db())
+    def _chunk_metadata(self, file_info: DBFile) -> Dict:
+        return {
+            "source": "uploaded_file",
+            "file_id": file_info.id,
+            "file_name": file_info.original_name,
+            "file_type": file_info.file_type,
+            "uploaded_by": file_info.uploaded_by,
+            "department": file_info.department
+        }
+
+    def _same_content_ids(self, file_info: DBFile) -> List[str]:
+        """Các file khác dùng chung blob (cùng nội dung) với file_info"""
+        if not file_info.content_hash:
+            return []
+        db = next(get_db())
+        try:
+            rows = db.query(DBFile.id).filter(
+                DBFile.content_hash == file_info.content_hash,
+                DBFile.file_path == file_info.file_path,
+                DBFile.id != file_info.id
+            ).all()
+            return [row[0] for row in rows]
+        finally:
+            db.close()
+
+    def _indexed_duplicate(self, vectorstore, file_info: DBFile):
+        """(donor_id, documents, vectors) của file trùng nội dung đã có trong FAISS, hoặc None"""
+        duplicate_ids = self._same_content_ids(file_info)
+        if not duplicate_ids:
+            return None
+        indexed_ids = vectordb.get_indexed_file_ids(vectorstore)
+        for donor_id in duplicate_ids:
+            if donor_id in indexed_ids:
+                donor_documents, donor_vectors = vectordb.get_file_chunks(vectorstore, donor_id)
+                if donor_documents:
+                    return donor_id, donor_documents, donor_vectors
+        return None
+
+    # ==================== XỬ LÝ SAU UPLOAD (CHẠY NỀN) ====================
+
+    def post_process_stages(self):
+        return [
+            ('search_index', self._stage_search_index),
+            ('embed', self._stage_embed),
+            ('classify', self._stage_classify),
+            ('cloud_metadata', self._stage_cloud_metadata),
+        ]
+
+    def _load_file(self, file_id: str) -> Optional[DBFile]:
+        db = next(get_db())
+        try:
+            return db.query(DBFile).filter(DBFile.id == file_id, DBFile.is_active == True).first()
+        finally:
+            db.close()
+
+    def _load_files(self, file_ids: List[str]) -> List[DBFile]:
+        files = [self._load_file(file_id) for file_id in file_ids]
+        return [file_info for file_info in files if file_info is not None]
+
+    def _stage_search_index(self, file_ids: List[str], results: Dict) -> Dict:
+        for file_id in file_ids:
+            file_search_engine.update_index(file_id)
+        return {}
+
+    def _stage_embed(self, file_ids: List[str], results: Dict) -> Dict:
+        return self.index_files_content(self._load_files(file_ids))
+
+    def _duplicate_classification(self, file_info: DBFile):
+        """(donor_id, classification) của file trùng nội dung đã phân loại xong, hoặc None"""
+        for donor_id in self._same_content_ids(file_info):
+            donor_results = self.upload_jobs.get_results(donor_id) or {}
+            classification = (donor_results.get('classify') or {}).get('classification')
+            if classification:
+                return donor_id, classification
+        return None
+
+    def _classify_one(self, file_info: DBFile) -> Dict:
+        donor = self._duplicate_classification(file_info)
+        if donor is not None:
+            classification = dict(donor[1])
+        else:
+            # Phân loại file bằng AI
+            classification = file_classifier.classify_file(file_info.file_path, file_info.original_name)
+        # Cập nhật metadata
+        metadata_result = file_classifier.update_file_metadata(file_info.id, classification)
+        result = {'classification': classification, 'metadata_result': metadata_result}
+        if donor is not None:
+            result['reused_from'] = donor[0]
+        return result
+
+    def _stage_classify(self, file_ids: List[str], results: Dict) -> Dict:
+        # File trùng blob trong batch chỉ phân loại một lần
+        groups = {}
+        for file_info in self._load_files(file_ids):
+            groups.setdefault(file_info.file_path, []).append(file_info)
+        leaders = [group[0] for group in groups.values()]
+
+        # Các file được phân loại song song, LLM gateway giới hạn số lời gọi nền thực sự chạy cùng lúc
+        if len(leaders) <= 1:
+            classified = {file_info.id: self._classify_one(file_info) for file_info in leaders}
+        else:
+            with ThreadPoolExecutor(max_workers=min(UploadJobConfig.BatchWorkers, len(leaders))) as pool:
+                classified = dict(zip([file_info.id for file_info in leaders], pool.map(self._classify_one, leaders)))
+
+        for group in groups.values():
+            classification = classified[group[0].id]['classification']
+            for file_info in group[1:]:
+                classified[file_info.id] = {
+                    'classification': dict(classification),
+                    'metadata_result': file_classifier.update_file_metadata(file_info.id, classification),
+                    'reused_from': group[0].id
+                }
+        return classified
+
+    def _stage_cloud_metadata(self, file_ids: List[str], results: Dict) -> Dict:
+        cloud_results = {}
+        for file_info in self._load_files(file_ids):
+            classification = ((results.get('classify') or {}).get(file_info.id) or {}).get('classification')
+            if not classification:
+                continue
+            # Gửi metadata lên cloud
+            file_data = {
+                'id': file_info.id,
+                'original_name': file_info.original_name,
+                'stored_name': file_info.stored_name,
+                'file_path': file_info.file_path,
+                'file_size': file_info.file_size,
+                'file_type': file_info.file_type,
+                'uploaded_by': file_info.uploaded_by,
+                'department': file_info.department,
+                'uploaded_at': file_info.uploaded_at.isoformat() if file_info.uploaded_at else None
+            }
+            cloud_result = cloud_integration.send_metadata_to_cloud(file_data, classification)
+            if not cloud_result.get('success'):
+                raise Exception(cloud_result.get('error') or cloud_result.get('message') or 'Gửi metadata lên cloud thất bại')
+            cloud_results[file_info.id] = cloud_result
+        return cloud_results
+
+    def get_processing_status(self, file_id: str) -> Optional[Dict]:
+        """Tiến độ xử lý nền của file (từng stage), None nếu file không có job"""
+        status = self.upload_jobs.get_status(file_id)
+        if status is None:
+            return None
+        job_results = self.upload_jobs.get_results(file_id) or {}
+        status['classification'] = (job_results.get('classify') or {}).get('classification')
+        return status
+
+    def _processing_info(self, file_id: str) -> Dict:
+        return {
+            "status": "queued",
+            "status_url": f"/api/files/{file_id}/status"
+        }
+
+    def _place_blob(self, db, temp_path: str, filename: str, content_hash: str):
+        """Đưa file tạm vào blob store theo sha256; nội dung đã có thì bỏ file tạm và dùng lại.
+        Trả về (stored_name, file_path, file trùng nội dung hoặc None). Gọi khi giữ _blob_lock"""
+        ext = os.path.splitext(filename)[1].lower()
+        # Kể cả file upload trước khi có blob store (đã được migrate_content_hash.py tính hash)
+        for existing in db.query(DBFile).filter(DBFile.content_hash == content_hash).all():
+            if os.path.splitext(existing.file_path)[1].lower() == ext and os.path.exists(existing.file_path):
+                os.remove(temp_path)
+                return existing.stored_name, existing.file_path, existing
+
+        stored_name = os.path.join(BLOB_FOLDER, content_hash[:2], content_hash + ext)
+        file_path = os.path.join(self.upload_folder, stored_name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        if os.path.exists(file_path):
+            os.remove(temp_path)
+        else:
+            shutil.move(temp_path, file_path)
+        return stored_name, file_path, None
+
+    def _release_blob(self, db, file_path: str):
+        """Xóa file vật lý khi không còn dòng files nào tham chiếu. Gọi khi giữ _blob_lock"""
+        if db.query(DBFile).filter(DBFile.file_path == file_path).count() == 0 and os.path.exists(file_path):
+            os.remove(file_path)
+
+    def add_files_batch(self, files, uploaded_by: str, department: str = None,
+                        allowed_users: List[str] = None):
+        """Lưu song song các file của batch, yield kết quả từng file ngay khi xong.
+
+        Sau cùng tạo một job xử lý nền chung cho cả batch (embedding gom chung, index
+        ghi một lần) và yield {'batch': ...}. allowed_users khác None thì lưu kèm phân quyền."""
+        files = [file for file in files if file and file.filename]
+        file_ids = []
+
+        def store(file):
+            if allowed_users is None:
+                return self.add_file(file, uploaded_by, department, enqueue=False)
+            return self.add_file_with_permissions(file, uploaded_by, allowed_users, department, enqueue=False)
+
+        def collect(future, filename):
             try:
+                result = future.result()
+            except Exception as e:
+                result = {"success": False, "message": f"Lỗi khi upload file: {str(e)}"}
+            result['original_name'] = filename
+            if result['success']:
+                file_ids.append(result['file']['id'])
+            return result
+
+        pending = {}
+        try:
+            with ThreadPoolExecutor(max_workers=UploadJobConfig.BatchWorkers) as pool:
+                pending = {pool.submit(store, file): file.filename for file in files}
+                for future in as_completed(list(pending)):
+                    yield collect(future, pending.pop(future))
+        finally:
+            # Client ngắt kết nối giữa chừng: các file đã lưu vẫn phải được xử lý
+            for future, filename in pending.items():
+                collect(future, filename)
+            job_id = self.upload_jobs.enqueue(file_ids) if file_ids else None
+        yield {"batch": {
+            "job_id": job_id,
+            "file_ids": file_ids,
+            "status": "queued" if job_id else None
+        }}
+
+    def _store_upload(self, stream, filename: str):
+        """Ghi stream upload vào file tạm (chưa biết hash), trả về (đường dẫn tạm, kết quả ghi)"""
+        ext = os.path.splitext(filename)[1].lower()
+        temp_path = os.path.join(self.incoming_folder, f"{uuid.uuid4().hex}{ext}")
+        writer = UploadWriter(temp_path, detect_encoding=needs_utf8(filename))
+        try:
+            writer.write_stream(stream)
+            return temp_path, writer.finish()
+        except Exception:
+            writer.abort()
+            raise
+
+    def _register_file(self, original_name: str, temp_path: str, written: Dict, content_type: str,
+                       uploaded_by: str, department: str = None, allowed_users: List[str] = None,
+                       enqueue: bool = True) -> Dict:
+        """Đưa file đã ghi vào blob store và lưu thông tin vào database (kèm phân quyền nếu có)"""
+        db = next(get_db())
+        file_path = None
+        try:
+            with self._blob_lock:
+                stored_name, file_path, duplicate = self._place_blob(db, temp_path, original_name, written['sha256'])
+
                 # FIX: Đảm bảo department được truyền và lưu đúng
                 file_info = DBFile(
                     id=str(uuid.uuid4()),
-                    original_name=file.filename,
-                    stored_name=filename,
+                    original_name=original_name,
+                    stored_name=stored_name,
                     file_path=file_path,
-                    file_size=os.path.getsize(file_path),
-                    file_type=file.content_type or "unknown",
+                    file_size=written['stored_size'],
+                    file_type=content_type or "unknown",
                     uploaded_by=uploaded_by,
                     department=department,  # FIX: Đảm bảo department được lưu
+                    content_hash=written['sha256'],
                     uploaded_at=datetime.utcnow(),
                     is_active=True
                 )
@@ -107,203 +424,150 @@ class FileManager:
                 db.commit()
                 db.refresh(file_info)
 
-                print(f"[DEBUG] File saved with department: {department}")  # Debug log
-
-                # Cập nhật search index
-                file_search_engine.update_index(file_info.id)
-
-                # Thêm nội dung file vào FAISS database để semantic search
-                try:
-                    from src.file_utils.file_loader import load_document_from_file
-                    documents = load_document_from_file(file_path)
-                    if documents:
-                        for doc in documents:
-                            metadata = {
-                                "source": "uploaded_file",
-                                "file_id": file_info.id,
-                                "file_name": file_info.original_name,
-                                "file_type": file_info.file_type,
-                                "uploaded_by": file_info.uploaded_by
-                            }
-                            doc.metadata = metadata
-                            vectordb.add_document(vectordb.init_vector_store(), doc.page_content, metadata)
-                        print(f"Added file {file_info.original_name} to FAISS database")
-                except Exception as e:
-                    print(f"Error adding file to FAISS database: {e}")
-
-                # Phân loại file bằng AI
-                classification = file_classifier.classify_file(file_path, file.filename)
-                
-                # Cập nhật metadata
-                metadata_result = file_classifier.update_file_metadata(file_info.id, classification)
-
-                # Gửi metadata lên cloud
-                file_data = {
-                    'id': file_info.id,
-                    'original_name': file_info.original_name,
-                    'stored_name': file_info.stored_name,
-                    'file_path': file_info.file_path,
-                    'file_size': file_info.file_size,
-                    'file_type': file_info.file_type,
-                    'uploaded_by': file_info.uploaded_by,
-                    'uploaded_at': file_info.uploaded_at.isoformat() if file_info.uploaded_at else None
-                }
-                cloud_result = cloud_integration.send_metadata_to_cloud(file_data, classification)
+            print(f"[DEBUG] File saved with department: {department}")  # Debug log
+            if duplicate is not None:
+                print(f"[INFO] {original_name} has the same content as {duplicate.original_name}, reusing stored blob")
+
+            # Lưu thông tin phân quyền nếu có
+            if allowed_users:
+                for user_id in allowed_users:
+                    permission = FilePermission(
+                        id=str(uuid.uuid4()),
+                        file_id=file_info.id,
+                        user_id=user_id,
+                        can_read=True,
+                        can_write=False,
+                        created_at=datetime.utcnow()
+                    )
+                    db.add(permission)
+                db.commit()
+                file_search_engine.set_file_grants(file_info.id, allowed_users)
+
+            # Search index, embedding, phân loại và cloud chạy nền, xem /files/<id>/status
+            # (upload batch tự tạo một job chung cho cả batch; file trùng nội dung dùng lại
+            # embedding và phân loại của file trước)
+            if enqueue:
+                self.upload_jobs.enqueue([file_info.id])
+
+            result = {
+                "success": True,
+                "message": "Upload file thành công",
+                "file": {
+                    "id": file_info.id,
+                    "original_name": file_info.original_name,
+                    "stored_name": file_info.stored_name,
+                    "file_size": file_info.file_size,
+                    "file_type": file_info.file_type,
+                    "uploaded_by": file_info.uploaded_by,
+                    "department": file_info.department,  # FIX: Trả về department
+                    "uploaded_at": file_info.uploaded_at.isoformat() if file_info.uploaded_at else None,
+                    "sha256": written['sha256'],
+                    "deduplicated": duplicate is not None
+                },
+                "processing": self._processing_info(file_info.id) if enqueue else None
+            }
+            if allowed_users is not None:
+                result["allowed_users"] = allowed_users
+            return result
 
-                return {
-                    "success": True,
-                    "message": "Upload file thành công",
-                    "file": {
-                        "id": file_info.id,
-                        "original_name": file_info.original_name,
-                        "stored_name": file_info.stored_name,
-                        "file_size": file_info.file_size,
-                        "file_type": file_info.file_type,
-                        "uploaded_by": file_info.uploaded_by,
-                        "department": file_info.department,  # FIX: Trả về department
-                        "uploaded_at": file_info.uploaded_at.isoformat() if file_info.uploaded_at else None
-                    },
-                    "classification": classification,
-                    "metadata_result": metadata_result,
-                    "cloud_result": cloud_result
-                }
+        except Exception as e:
+            db.rollback()
+            # Xóa file vật lý nếu lưu database thất bại (blob dùng chung thì giữ lại)
+            with self._blob_lock:
+                if file_path is not None:
+                    self._release_blob(db, file_path)
+                elif os.path.exists(temp_path):
+                    os.remove(temp_path)
+            return {"success": False, "message": f"Lỗi khi lưu thông tin file: {str(e)}"}
+        finally:
+            db.close()
 
-            except Exception as e:
-                db.rollback()
-                # Xóa file vật lý nếu lưu database thất bại
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                return {"success": False, "message": f"Lỗi khi lưu thông tin file: {str(e)}"}
-            finally:
-                db.close()
+    def add_file(self, file, uploaded_by: str, department: str = None, enqueue: bool = True) -> Dict:
+        """Thêm file mới với phân loại và index - FIX: Đảm bảo department được lưu"""
+        try:
+            if not file or file.filename == '':
+                return {"success": False, "message": "Không có file được chọn"}
+
+            # Ghi file theo từng block, sha256/size/encoding tính cùng lúc
+            temp_path, written = self._store_upload(file.stream, file.filename)
+            return self._register_file(file.filename, temp_path, written, file.content_type,
+                                       uploaded_by, department, enqueue=enqueue)
 
         except Exception as e:
             return {"success": False, "message": f"Lỗi khi upload file: {str(e)}"}
 
-    def add_file_with_permissions(self, file, uploaded_by: str, allowed_users: List[str] = None, department: str = None) -> Dict:
+    def add_file_with_permissions(self, file, uploaded_by: str, allowed_users: List[str] = None, department: str = None,
+                                  enqueue: bool = True) -> Dict:
         """Thêm file mới với phân quyền cho admin"""
         try:
             if not file or file.filename == '':
                 return {"success": False, "message": "Không có file được chọn"}
 
-            # Tạo tên file unique
-            filename = file.filename
-            base_name, ext = os.path.splitext(filename)
-            counter = 1
-            while os.path.exists(os.path.join(self.upload_folder, filename)):
-                filename = f"{base_name}_{counter}{ext}"
-                counter += 1
+            temp_path, written = self._store_upload(file.stream, file.filename)
+            return self._register_file(file.filename, temp_path, written, file.content_type,
+                                       uploaded_by, department, allowed_users or [], enqueue=enqueue)
 
-            # Lưu file
-            file_path = os.path.join(self.upload_folder, filename)
-            file.save(file_path)
-
-            # Lưu thông tin file vào database với phân quyền
-            db = next(get_db())
-            try:
-                file_info = DBFile(
-                    id=str(uuid.uuid4()),
-                    original_name=file.filename,
-                    stored_name=filename,
-                    file_path=file_path,
-                    file_size=os.path.getsize(file_path),
-                    file_type=file.content_type or "unknown",
-                    uploaded_by=uploaded_by,
-                    department=department,
-                    uploaded_at=datetime.utcnow(),
-                    is_active=True
-                )
-
-                db.add(file_info)
-                db.commit()
-                db.refresh(file_info)
+        except Exception as e:
+            return {"success": False, "message": f"Lỗi khi upload file: {str(e)}"}
 
-                # Lưu thông tin phân quyền nếu có
-                if allowed_users:
-                    for user_id in allowed_users:
-                        permission = FilePermission(
-                            id=str(uuid.uuid4()),
-                            file_id=file_info.id,
-                            user_id=user_id,
-                            can_read=True,
-                            can_write=False,
-                            created_at=datetime.utcnow()
-                        )
-                        db.add(permission)
-                    db.commit()
-
-                # Cập nhật search index
-                file_search_engine.update_index(file_info.id)
-
-                # Thêm nội dung file vào FAISS database để semantic search
-                try:
-                    from src.file_utils.file_loader import load_document_from_file
-                    documents = load_document_from_file(file_path)
-                    if documents:
-                        for doc in documents:
-                            metadata = {
-                                "source": "uploaded_file",
-                                "file_id": file_info.id,
-                                "file_name": file_info.original_name,
-                                "file_type": file_info.file_type,
-                                "uploaded_by": file_info.uploaded_by
-                            }
-                            doc.metadata = metadata
-                            vectordb.add_document(vectordb.init_vector_store(), doc.page_content, metadata)
-                        print(f"Added file {file_info.original_name} to FAISS database")
-                except Exception as e:
-                    print(f"Error adding file to FAISS database: {e}")
-
-                # Phân loại file bằng AI
-                classification = file_classifier.classify_file(file_path, file.filename)
-                
-                # Cập nhật metadata
-                metadata_result = file_classifier.update_file_metadata(file_info.id, classification)
-
-                # Gửi metadata lên cloud
-                file_data = {
-                    'id': file_info.id,
-                    'original_name': file_info.original_name,
-                    'stored_name': file_info.stored_name,
-                    'file_path': file_info.file_path,
-                    'file_size': file_info.file_size,
-                    'file_type': file_info.file_type,
-                    'uploaded_by': file_info.uploaded_by,
-                    'department': file_info.department,
-                    'uploaded_at': file_info.uploaded_at.isoformat() if file_info.uploaded_at else None
-                }
-                cloud_result = cloud_integration.send_metadata_to_cloud(file_data, classification)
+    # ==================== UPLOAD NHIỀU PHẦN (FILE LỚN) ====================
 
-                return {
-                    "success": True,
-                    "message": "Upload file thành công",
-                    "file": {
-                        "id": file_info.id,
-                        "original_name": file_info.original_name,
-                        "stored_name": file_info.stored_name,
-                        "file_size": file_info.file_size,
-                        "file_type": file_info.file_type,
-                        "uploaded_by": file_info.uploaded_by,
-                        "department": file_info.department,
-                        "uploaded_at": file_info.uploaded_at.isoformat() if file_info.uploaded_at else None
-                    },
-                    "classification": classification,
-                    "metadata_result": metadata_result,
-                    "cloud_result": cloud_result,
-                    "allowed_users": allowed_users or []
-                }
+    def start_chunked_upload(self, filename: str, total_size: int, content_type: str, uploaded_by: str,
+                             department: str = None, allowed_users: List[str] = None) -> Dict:
+        """Mở session upload nhiều phần, client gửi từng chunk qua append_chunk"""
+        try:
+            if not filename:
+                return {"success": False, "message": "Không có file được chọn"}
+            session = self.chunked_uploads.create(filename, total_size, content_type, uploaded_by,
+                                                  department, allowed_users)
+            return {"success": True, "upload": self._upload_info(session)}
+        except ValueError as e:
+            return {"success": False, "message": str(e)}
+
+    def _upload_info(self, session: Dict) -> Dict:
+        return {
+            "upload_id": session['upload_id'],
+            "filename": session['filename'],
+            "total_size": session['total_size'],
+            "received": session['received'],
+            "chunk_size": self.chunked_uploads.chunk_size,
+            "upload_url": f"/api/user/files/uploads/{session['upload_id']}"
+        }
+
+    def get_chunked_upload(self, upload_id: str) -> Optional[Dict]:
+        session = self.chunked_uploads.get(upload_id)
+        if session is None:
+            return None
+        return {**self._upload_info(session), "uploaded_by": session['uploaded_by']}
 
-            except Exception as e:
-                db.rollback()
-                # Xóa file vật lý nếu lưu database thất bại
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                return {"success": False, "message": f"Lỗi khi lưu thông tin file: {str(e)}"}
-            finally:
-                db.close()
+    def append_chunk(self, upload_id: str, offset: int, stream) -> Dict:
+        """Ghi chunk tại offset; ném UploadOffsetMismatch nếu không nối tiếp phần đã nhận"""
+        return self._upload_info(self.chunked_uploads.append(upload_id, offset, stream))
 
+    def complete_chunked_upload(self, upload_id: str) -> Dict:
+        """Chuyển file đã nhận đủ vào thư mục upload, lưu database và xếp job xử lý nền"""
+        try:
+            session, part_path, written = self.chunked_uploads.finish(upload_id)
+        except UploadOffsetMismatch as e:
+            return {"success": False, "message": f"Upload chưa đủ dữ liệu, mới nhận {e.expected} byte"}
+        try:
+            return self._register_file(session['filename'], part_path, written,
+                                       session['content_type'], session['uploaded_by'],
+                                       session['department'], session['allowed_users'])
         except Exception as e:
             return {"success": False, "message": f"Lỗi khi upload file: {str(e)}"}
+        finally:
+            # File .part đã được convert/di chuyển, session không dùng lại được
+            self.chunked_uploads.discard(upload_id)
+
+    def _remove_file_vectors(self, file_id: str):
+        """Xóa chunk của file khỏi FAISS (kèm invalidate answer cache), chặn job embed đang chạy ghi lại"""
+        try:
+            with self._index_lock:
+                vectordb.remove_by_file_id(vectordb.get_vector_store(), file_id)
+                remove_fingerprint(file_id)
+        except Exception as e:
+            print(f"Error removing file from FAISS database: {e}")
 
     def delete_file(self, file_id: str) -> Dict:
         """Xóa file"""
@@ -313,17 +577,18 @@ class FileManager:
             if not file_info:
                 return {"success": False, "message": "File không tồn tại"}
 
-            # Xóa file vật lý
-            if os.path.exists(file_info.file_path):
-                os.remove(file_info.file_path)
-
-            # Xóa khỏi database
-            db.delete(file_info)
-            db.commit()
+            # Xóa khỏi database, file vật lý chỉ bị xóa khi không còn file nào dùng chung blob
+            with self._blob_lock:
+                db.delete(file_info)
+                db.commit()
+                self._release_blob(db, file_info.file_path)
 
             # Cập nhật search index
-            if file_id in file_search_engine.index_data:
-                del file_search_engine.index_data[file_id]
+            file_search_engine.remove_from_index(file_id)
+
+            # Xóa các chunk của file khỏi FAISS để không còn được retrieve
+            self._remove_file_vectors(file_id)
+            self.upload_jobs.remove(file_id)
 
             return {"success": True, "message": "Xóa file thành công"}
 
@@ -428,6 +693,15 @@ class FileManager:
             file_info.is_active = is_active
             db.commit()
 
+            if is_active:
+                # Index lại (search + embedding) chạy nền, không phân loại lại
+                self.upload_jobs.enqueue([file_id], only_stages=['search_index', 'embed'])
+            else:
+                # File bị vô hiệu hóa không còn xuất hiện trong kết quả tìm kiếm và retrieve của chat
+                # (xóa vector kèm invalidate answer cache như delete_file, job embed đang chạy sẽ bỏ qua file)
+                file_search_engine.remove_from_index(file_id)
+                self._remove_file_vectors(file_id)
+
             return {
                 "success": True, 
                 "message": f"File đã được {'kích hoạt' if is_active else 'vô hiệu hóa'}"
@@ -481,22 +755,24 @@ class FileManager:
         try:
             db = next(get_db())
             try:
-                # Lấy danh sách files trong database
-                db_files = db.query(DBFile.stored_name).all()
-                db_file_names = {f[0] for f in db_files}
-                
-                # Lấy danh sách files vật lý
-                physical_files = set(os.listdir(self.upload_folder))
-                orphaned_files = physical_files - db_file_names
-                
                 deleted_count = 0
-                for filename in orphaned_files:
-                    file_path = os.path.join(self.upload_folder, filename)
-                    try:
-                        os.remove(file_path)
-                        deleted_count += 1
-                    except Exception as e:
-                        print(f"Error deleting orphaned file {filename}: {e}")
+                with self._blob_lock:
+                    # Lấy danh sách files trong database
+                    db_file_paths = {os.path.normpath(f[0]) for f in db.query(DBFile.file_path).all()}
+
+                    # File vật lý: file cũ ở thư mục upload và các blob (bỏ qua thư mục khác, vd exports)
+                    physical_files = [os.path.join(self.upload_folder, name) for name in os.listdir(self.upload_folder)
+                                      if os.path.isfile(os.path.join(self.upload_folder, name))]
+                    for root, _, names in os.walk(os.path.join(self.upload_folder, BLOB_FOLDER)):
+                        physical_files.extend(os.path.join(root, name) for name in names)
+                    orphaned_files = [path for path in physical_files if os.path.normpath(path) not in db_file_paths]
+
+                    for file_path in orphaned_files:
+                        try:
+                            os.remove(file_path)
+                            deleted_count += 1
+                        except Exception as e:
+                            print(f"Error deleting orphaned file {file_path}: {e}")
                 
                 return {
                     "success": True,
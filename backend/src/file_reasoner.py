@@ -1,4 +1,5 @@
 from langchain_ollama import OllamaLLM
+from src.llm_gateway import call_llm, Priority
 
 llm = OllamaLLM(model="mistral")  # hoặc llama3 nếu bạn setup sẵn
 
@@ -15,5 +16,5 @@ Dưới đây là các file đã được tìm thấy:
 Hãy suy nghĩ từng bước và giải thích quá trình AI thực hiện để tìm và phân loại những file này.
     """
 
-    response = llm(reasoning_prompt)
+    response = call_llm(llm.invoke, reasoning_prompt, priority=Priority.INTERACTIVE)
     return response.strip()
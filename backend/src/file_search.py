@@ -1,82 +1,331 @@
 import os
 import re
-from typing import List, Dict, Optional
-from src.database import get_db, File as DBFile
-from src.file_utils.file_loader import load_document_from_file
 import json
+import sqlite3
+import threading
+from typing import List, Dict, Optional, Tuple
+from src.database import get_db, File as DBFile, FilePermission
+from src.file_utils.file_loader import load_document_from_file
+from src.config import FileSearchConfig
+from src.text_search import BM25Index, TrigramIndex, PrefixIndex, fold_diacritics, document_terms, query_terms
+from src.access_index import AccessIndex
+
+# Scope gợi ý từ khóa: '*' chứa mọi file (admin), còn lại theo user id và theo department
+ALL_SCOPE = '*'
+DEPARTMENT_SCOPE = 'department:'
+
+# Tăng khi đổi cách trích preview/keyword/term để các entry đã lưu được dựng lại
+INDEX_VERSION = 3
+
+
+class FileSearchIndexStore:
+    """Lưu entry của index tìm kiếm trong SQLite, mỗi file một dòng để cập nhật từng file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_search_index (
+                file_id TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                entry TEXT NOT NULL,
+                terms TEXT
+            )
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(file_search_index)")}
+        if 'terms' not in columns:
+            self._conn.execute("ALTER TABLE file_search_index ADD COLUMN terms TEXT")
+        self._conn.commit()
+
+    def load_all(self) -> Dict[str, tuple]:
+        """{file_id: (entry, fingerprint, terms)}, terms = {'tf': {term: tf}, 'length': n}"""
+        with self._lock:
+            rows = self._conn.execute("SELECT file_id, fingerprint, entry, terms FROM file_search_index").fetchall()
+        return {
+            file_id: (json.loads(entry), json.loads(fingerprint), json.loads(terms) if terms else None)
+            for file_id, fingerprint, entry, terms in rows
+        }
+
+    def put_many(self, items: Dict[str, tuple]):
+        if not items:
+            return
+        rows = [(file_id, json.dumps(fingerprint), json.dumps(entry, ensure_ascii=False),
+                 json.dumps(terms, ensure_ascii=False))
+                for file_id, (entry, fingerprint, terms) in items.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO file_search_index (file_id, fingerprint, entry, terms) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def delete_many(self, file_ids: List[str]):
+        if not file_ids:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM file_search_index WHERE file_id = ?", [(file_id,) for file_id in file_ids])
+            self._conn.commit()
+
 
 class FileSearchEngine:
-    def __init__(self):
+    """Tìm file theo tên / nội dung.
+
+    Index (preview, keyword, term frequency toàn văn) được lưu trên đĩa nên lúc khởi động chỉ
+    cần đọc lại; việc đối chiếu với database chạy nền và chỉ dựng lại file có dòng DB hoặc
+    mtime/size thay đổi. index_data được thay bằng dict mới mỗi lần cập nhật nên search không
+    cần khóa. Tìm theo nội dung dùng inverted index BM25 (content_index), theo tên dùng
+    trigram (name_index), gợi ý từ khóa dùng mảng tiền tố theo từng scope. User thường chỉ
+    được duyệt các file trong access_index (file mình upload, của department, được cấp quyền)."""
+
+    def __init__(self, index_path: str = None):
         self.index_data = {}
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        self.content_index = BM25Index(FileSearchConfig.Bm25K1, FileSearchConfig.Bm25B)
+        self.name_index = TrigramIndex()
+        self.suggestion_index: Dict[str, PrefixIndex] = {}
+        self._suggestion_scopes: Dict[str, set] = {}
+        self.access_index = AccessIndex()
+        self.store = None
         try:
-            self.load_index()
+            self.store = FileSearchIndexStore(index_path or FileSearchConfig.IndexPath)
+            persisted = self.store.load_all()
+            self.index_data = {file_id: entry for file_id, (entry, _, _) in persisted.items()}
+            self._fingerprints = {file_id: fingerprint for file_id, (_, fingerprint, _) in persisted.items()}
+            for file_id, (entry, _, terms) in persisted.items():
+                if terms:
+                    self.content_index.add(file_id, terms['tf'], terms['length'])
+                self._index_name(entry)
+            print(f"[FILE SEARCH] Loaded {len(self.index_data)} files from persisted index")
         except Exception as e:
             print(f"[FILE SEARCH] Error in __init__: {e}")
             import traceback
             traceback.print_exc()
-    
+        # Đối chiếu với database chạy nền, app phục vụ request ngay với index đã lưu
+        threading.Thread(target=self.load_index, name="file-search-refresh", daemon=True).start()
+
+    def _fingerprint(self, file: DBFile, stat: os.stat_result) -> Dict:
+        return {
+            'version': INDEX_VERSION,
+            'row': [file.original_name, file.stored_name, file.file_path, file.file_type, file.uploaded_by,
+                    file.department, file.uploaded_at.isoformat() if file.uploaded_at else None],
+            'mtime': stat.st_mtime,
+            'size': stat.st_size
+        }
+
+    def _build_entry(self, file: DBFile):
+        """(entry, terms) của file: đọc toàn văn một lần, preview/keyword/term đều lấy từ đó"""
+        text = self.extract_text(file.file_path)
+        content_preview = text[:1000]
+        term_freqs, length = document_terms(text)
+        entry = {
+            'id': file.id,
+            'original_name': file.original_name,
+            'stored_name': file.stored_name,
+            'file_path': file.file_path,
+            'file_type': file.file_type,
+            'uploaded_by': file.uploaded_by,
+            'department': file.department,
+            'uploaded_at': file.uploaded_at.isoformat() if file.uploaded_at else None,
+            'content_preview': content_preview,
+            'keywords': self.extract_keywords(file.original_name, content_preview)
+        }
+        return entry, {'tf': term_freqs, 'length': length}
+
+    def _suggestion_terms(self, entry: Dict) -> set:
+        terms = set(re.findall(r'\w+', entry['original_name'].lower())) | set(entry.get('keywords') or [])
+        return {term for term in terms if len(term) > 2}
+
+    def _scopes(self, entry: Dict) -> set:
+        scopes = {ALL_SCOPE, entry['uploaded_by']} | self.access_index.grantees(entry['id'])
+        if entry.get('department'):
+            scopes.add(DEPARTMENT_SCOPE + entry['department'])
+        return scopes
+
+    def _add_suggestions(self, entry: Dict):
+        terms = self._suggestion_terms(entry)
+        scopes = self._scopes(entry)
+        for scope in scopes:
+            self.suggestion_index.setdefault(scope, PrefixIndex()).add(terms)
+        self._suggestion_scopes[entry['id']] = scopes
+
+    def _remove_suggestions(self, entry: Dict):
+        terms = self._suggestion_terms(entry)
+        for scope in self._suggestion_scopes.pop(entry['id'], ()):
+            if scope in self.suggestion_index:
+                self.suggestion_index[scope].remove(terms)
+
+    def _index_name(self, entry: Dict):
+        self.name_index.add(entry['id'], entry['original_name'], entry.get('stored_name'))
+        self.access_index.set_file(entry['id'], entry['uploaded_by'], entry.get('department'))
+        self._add_suggestions(entry)
+
+    def _unindex_name(self, entry: Dict):
+        self.name_index.remove(entry['id'])
+        self._remove_suggestions(entry)
+
+    def _apply(self, updates: Dict[str, tuple], removed: List[str]):
+        """Cập nhật index (copy-on-write) và ghi các thay đổi xuống đĩa"""
+        with self._lock:
+            index_data = dict(self.index_data)
+            fingerprints = dict(self._fingerprints)
+            for file_id, (entry, fingerprint, terms) in updates.items():
+                if file_id in index_data:
+                    self._unindex_name(index_data[file_id])
+                index_data[file_id] = entry
+                fingerprints[file_id] = fingerprint
+                self.content_index.add(file_id, terms['tf'], terms['length'])
+                self._index_name(entry)
+            for file_id in removed:
+                old_entry = index_data.pop(file_id, None)
+                if old_entry is not None:
+                    self._unindex_name(old_entry)
+                fingerprints.pop(file_id, None)
+                self.content_index.remove(file_id)
+                self.access_index.remove_file(file_id)
+            self.index_data = index_data
+            self._fingerprints = fingerprints
+        if self.store is not None:
+            try:
+                self.store.put_many(updates)
+                self.store.delete_many(removed)
+            except Exception as e:
+                print(f"[FILE SEARCH] Error persisting index: {e}")
+
+    def _load_grants(self, grants: Dict[str, List[str]]):
+        """Nạp lại quyền đã cấp, chỉ cập nhật gợi ý của file có danh sách user thay đổi"""
+        with self._lock:
+            self.access_index.replace_all_grants(grants)
+            for file_id, entry in self.index_data.items():
+                if self._scopes(entry) != self._suggestion_scopes.get(file_id):
+                    self._remove_suggestions(entry)
+                    self._add_suggestions(entry)
+
+    def set_file_grants(self, file_id: str, user_ids: List[str]):
+        """Cập nhật danh sách user được cấp quyền đọc file (sau khi ghi bảng file_permissions)"""
+        with self._lock:
+            self.access_index.set_grants(file_id, user_ids)
+            entry = self.index_data.get(file_id)
+            if entry is not None:
+                self._remove_suggestions(entry)
+                self._add_suggestions(entry)
+
+    def visible_file_ids(self, user_id: str = None, user_role: str = None, department: str = None) -> Optional[set]:
+        """Tập file id user được xem; None = không giới hạn (admin hoặc không xác định user)"""
+        if not user_id or user_role == 'admin':
+            return None
+        return self.access_index.visible(user_id, department)
+
+    def visible_for_filter(self, metadata_filter: Optional[List[Dict]]) -> Optional[set]:
+        """Tập file id khớp filter metadata của vectordb (ChatManager.build_access_filter), None = không lọc"""
+        if metadata_filter is None:
+            return None
+        visible = set()
+        for clause in metadata_filter:
+            matched = None
+            for field, values in clause.items():
+                if field == 'source':
+                    continue
+                values = values if isinstance(values, (list, tuple, set)) else [values]
+                if field == 'uploaded_by':
+                    ids = self.access_index.owned_by(values)
+                elif field == 'department':
+                    ids = self.access_index.in_departments(values)
+                elif field == 'file_id':
+                    ids = set(values)
+                else:
+                    ids = set()
+                matched = ids if matched is None else matched & ids
+            if matched is None:
+                # Clause chỉ lọc theo source: mọi file upload
+                return None
+            visible |= matched
+        return visible
+
     def load_index(self):
-        """Load file index từ database"""
+        """Đồng bộ index với database: chỉ dựng lại file có dòng DB hoặc mtime/size thay đổi"""
+        db = None
         try:
-            print("[FILE SEARCH] Loading file index...")
+            print("[FILE SEARCH] Refreshing file index...")
+            known_ids = set(self.index_data)
             db = next(get_db())
+            try:
+                grants = {}
+                for permission in db.query(FilePermission.file_id, FilePermission.user_id).filter(
+                        FilePermission.can_read == True).all():
+                    grants.setdefault(permission.file_id, []).append(permission.user_id)
+                self._load_grants(grants)
+            except Exception as e:
+                db.rollback()
+                print(f"[FILE SEARCH] Error loading file permissions: {e}")
             files = db.query(DBFile).filter(DBFile.is_active == True).all()
             
             print(f"[FILE SEARCH] Found {len(files)} files in database")
             
+            present_ids = set()
+            updates = {}
             for file in files:
                 try:
-                    if os.path.exists(file.file_path):
-                        self.index_data[file.id] = {
-                            'id': file.id,
-                            'original_name': file.original_name,
-                            'stored_name': file.stored_name,
-                            'file_path': file.file_path,
-                            'file_type': file.file_type,
-                            'uploaded_by': file.uploaded_by,
-                            'uploaded_at': file.uploaded_at.isoformat() if file.uploaded_at else None,
-                            'content_preview': self.extract_content_preview(file.file_path),
-                            'keywords': self.extract_keywords(file.original_name, file.file_path)
-                        }
-                    else:
-                        print(f"[FILE SEARCH] File not found: {file.file_path}")
+                    stat = os.stat(file.file_path)
+                except OSError:
+                    print(f"[FILE SEARCH] File not found: {file.file_path}")
+                    continue
+                present_ids.add(file.id)
+                fingerprint = self._fingerprint(file, stat)
+                if file.id in self.index_data and self._fingerprints.get(file.id) == fingerprint:
+                    continue
+                try:
+                    entry, terms = self._build_entry(file)
+                    updates[file.id] = (entry, fingerprint, terms)
                 except Exception as e:
                     print(f"[FILE SEARCH] Error processing file {file.id}: {e}")
                     continue
-            
-            print(f"[FILE SEARCH] Index loaded successfully with {len(self.index_data)} files")
+
+            removed = sorted(known_ids - present_ids)
+            self._apply(updates, removed)
+            print(f"[FILE SEARCH] Index loaded successfully with {len(self.index_data)} files "
+                  f"({len(updates)} refreshed, {len(removed)} removed)")
         except Exception as e:
             print(f"[FILE SEARCH] Error loading file index: {e}")
             import traceback
             traceback.print_exc()
         finally:
-            try:
+            if db is not None:
                 db.close()
-            except:
-                pass
     
-    def extract_content_preview(self, file_path: str) -> str:
-        """Trích xuất preview nội dung file"""
+    def extract_text(self, file_path: str) -> str:
+        """Trích xuất toàn văn file (tối đa MaxIndexedChars ký tự) cho inverted index"""
+        max_chars = FileSearchConfig.MaxIndexedChars
         try:
             if file_path.lower().endswith(('.txt', '.md', '.py', '.js', '.html', '.css')):
                 with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read(1000)  # Đọc 1000 ký tự đầu
-                    return content
+                    return f.read(max_chars)
             elif file_path.lower().endswith('.pdf'):
-                # Sử dụng file_loader để đọc PDF
+                # Sử dụng file_loader để đọc PDF (tất cả các trang)
                 try:
                     documents = load_document_from_file(file_path)
-                    if documents:
-                        return documents[0].page_content[:1000]
+                    return "\n".join(doc.page_content for doc in documents)[:max_chars]
                 except Exception as pdf_error:
                     print(f"[FILE SEARCH] Error reading PDF {file_path}: {pdf_error}")
             return ""
         except Exception as e:
             print(f"[FILE SEARCH] Error extracting content from {file_path}: {e}")
             return ""
+
+    def extract_content_preview(self, file_path: str) -> str:
+        """Trích xuất preview nội dung file"""
+        try:
+            return self.extract_text(file_path)[:1000]
+        except Exception as e:
+            print(f"[FILE SEARCH] Error extracting content from {file_path}: {e}")
+            return ""
     
-    def extract_keywords(self, filename: str, file_path: str) -> List[str]:
-        """Trích xuất keywords từ tên file và nội dung"""
+    def extract_keywords(self, filename: str, content: str) -> List[str]:
+        """Trích xuất keywords từ tên file và preview nội dung"""
         try:
             keywords = []
             
@@ -85,7 +334,6 @@ class FileSearchEngine:
             keywords.extend(re.findall(r'\w+', filename_lower))
             
             # Keywords từ nội dung
-            content = self.extract_content_preview(file_path)
             if content:
                 content_lower = content.lower()
                 # Tìm các từ có ý nghĩa (loại bỏ stop words)
@@ -97,132 +345,125 @@ class FileSearchEngine:
             print(f"[FILE SEARCH] Error extracting keywords from {filename}: {e}")
             return []
     
-    def search_by_name(self, query: str, user_id: str = None, user_role: str = None) -> List[Dict]:
-        """Tìm kiếm file theo tên với lọc theo quyền truy cập"""
+    def _rank_name(self, query: str, visible: Optional[set]) -> List[Tuple[str, float]]:
+        """Top 10 (file_id, điểm) theo tên, chỉ chấm điểm các file user được xem"""
+        query_lower = query.lower()
+        index_data = self.index_data
+        ranked = []
+        for file_id, similarity in self.name_index.search(query, FileSearchConfig.NameMinSimilarity, visible):
+            file_data = index_data.get(file_id)
+            if file_data is None:
+                continue
+            name_score = max(self.calculate_name_match_score(query_lower, name.lower())
+                             for name in (file_data['original_name'], file_data.get('stored_name') or ''))
+            score = name_score + round(similarity * 10, 2)
+            ranked.append((file_id, score))
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return ranked[:10]
+
+    def _rank_content(self, query: str, visible: Optional[set]) -> List[Tuple[str, float]]:
+        """Top 10 (file_id, điểm BM25), chỉ duyệt postings của các term trong câu hỏi"""
+        index_data = self.index_data
+        ranked = [(file_id, round(score, 4))
+                  for file_id, score in self.content_index.search(query_terms(query), visible)
+                  if file_id in index_data]
+        return ranked[:10]
+
+    def _rank(self, query: str, visible: Optional[set]) -> Tuple[List[Tuple[str, float, str]], int, int]:
+        """Gộp điểm tên và nội dung theo file id: ([(file_id, điểm, match_type)], số kết quả tên, số kết quả nội dung)"""
+        name_hits = self._rank_name(query, visible)
+        content_hits = self._rank_content(query, visible)
+        merged = {file_id: [score, 'name'] for file_id, score in name_hits}
+        for file_id, score in content_hits:
+            if file_id in merged:
+                # File xuất hiện trong cả 2 kết quả thì cộng điểm
+                merged[file_id][0] += score
+                merged[file_id][1] = 'both'
+            else:
+                merged[file_id] = [score, 'content']
+        ranked = [(file_id, score, match_type) for file_id, (score, match_type) in merged.items()]
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return ranked, len(name_hits), len(content_hits)
+
+    def rank_queries(self, queries: List[str], user_id: str = None, user_role: str = None,
+                     department: str = None) -> List[List[Tuple[str, float, str]]]:
+        """Xếp hạng nhiều câu hỏi trong một lần gọi (tập file được xem chỉ tính một lần).
+        Chỉ trả về (file_id, điểm, match_type), dùng materialize() để lấy thông tin file"""
+        visible = self.visible_file_ids(user_id, user_role, department)
+        return [self._rank(query, visible)[0] for query in queries]
+
+    def rank_in(self, query: str, visible: Optional[set]) -> List[Tuple[str, float, str]]:
+        """Như rank_queries cho một câu hỏi, với tập file được xem đã tính sẵn (None = không lọc)"""
+        return self._rank(query, visible)[0]
+
+    def materialize(self, ranked: List[Tuple[str, float, str]]) -> List[Dict]:
+        """Tạo kết quả tìm kiếm cho các file đã xếp hạng (bỏ qua file vừa bị xóa khỏi index)"""
+        index_data = self.index_data
+        results = []
+        for file_id, score, match_type in ranked:
+            file_data = index_data.get(file_id)
+            if file_data is None:
+                continue
+            results.append({
+                'id': file_data['id'],
+                'name': file_data['original_name'],
+                'type': file_data['file_type'],
+                'uploaded_by': file_data['uploaded_by'],
+                'uploaded_at': file_data['uploaded_at'],
+                'match_type': match_type,
+                'match_score': score,
+                'content_preview': file_data['content_preview'][:500] + "..." if len(file_data['content_preview']) > 500 else file_data['content_preview']
+            })
+        return results
+
+    def search_by_name(self, query: str, user_id: str = None, user_role: str = None,
+                       department: str = None) -> List[Dict]:
+        """Tìm kiếm file theo tên (trigram, không phân biệt dấu) với lọc theo quyền truy cập"""
         try:
-            query_lower = query.lower()
-            results = []
-            
-            print(f"[FILE SEARCH] search_by_name: query='{query_lower}', user_id={user_id}, user_role={user_role}")
-            print(f"[FILE SEARCH] Total files in index: {len(self.index_data)}")
-            
-            for file_id, file_data in self.index_data.items():
-                try:
-                    # Lọc theo quyền truy cập
-                    if user_id and user_role != 'admin':
-                        if file_data['uploaded_by'] != user_id:
-                            continue
-                    
-                    original_name = file_data['original_name'].lower()
-                    stored_name = file_data['stored_name'].lower()
-                    
-                    # Tìm kiếm fuzzy match
-                    if (query_lower in original_name or 
-                        query_lower in stored_name or
-                        any(word in original_name for word in query_lower.split())):
-                        
-                        results.append({
-                            'id': file_data['id'],
-                            'name': file_data['original_name'],
-                            'type': file_data['file_type'],
-                            'uploaded_by': file_data['uploaded_by'],
-                            'uploaded_at': file_data['uploaded_at'],
-                            'match_type': 'name',
-                            'match_score': self.calculate_name_match_score(query_lower, original_name),
-                            'content_preview': file_data['content_preview'][:500] + "..." if len(file_data['content_preview']) > 500 else file_data['content_preview']
-                        })
-                except Exception as e:
-                    print(f"[FILE SEARCH] Error processing file {file_id} in search_by_name: {e}")
-                    continue
-            
-            # Sắp xếp theo độ phù hợp
-            results.sort(key=lambda x: x['match_score'], reverse=True)
+            print(f"[FILE SEARCH] search_by_name: query='{query.lower()}', user_id={user_id}, user_role={user_role}")
+            visible = self.visible_file_ids(user_id, user_role, department)
+            results = self.materialize([(file_id, score, 'name') for file_id, score in self._rank_name(query, visible)])
             print(f"[FILE SEARCH] search_by_name found {len(results)} results")
-            return results[:10]  # Trả về top 10
+            return results
         except Exception as e:
             print(f"[FILE SEARCH] Error in search_by_name: {e}")
             import traceback
             traceback.print_exc()
             return []
     
-    def search_by_content(self, query: str, user_id: str = None, user_role: str = None) -> List[Dict]:
-        """Tìm kiếm file theo nội dung với lọc theo quyền truy cập"""
+    def search_by_content(self, query: str, user_id: str = None, user_role: str = None,
+                          department: str = None) -> List[Dict]:
+        """Tìm kiếm file theo nội dung (toàn văn, BM25) với lọc theo quyền truy cập"""
         try:
-            query_lower = query.lower()
-            query_words = set(query_lower.split())
-            results = []
-            print(f"[FILE SEARCH] search_by_content: query='{query_lower}', user_id={user_id}, user_role={user_role}")
-            
-            for file_id, file_data in self.index_data.items():
-                try:
-                    # Lọc theo quyền truy cập
-                    if user_id and user_role != 'admin':
-                        if file_data['uploaded_by'] != user_id:
-                            continue
-                    
-                    content_preview = file_data['content_preview'].lower()
-                    keywords = set(file_data['keywords'])
-                    # Tính điểm match
-                    content_match = sum(1 for word in query_words if word in content_preview)
-                    keyword_match = len(query_words.intersection(keywords))
-                    
-                    if content_match > 0 or keyword_match > 0:
-                        results.append({
-                            'id': file_data['id'],
-                            'name': file_data['original_name'],
-                            'type': file_data['file_type'],
-                            'uploaded_by': file_data['uploaded_by'],
-                            'uploaded_at': file_data['uploaded_at'],
-                            'match_type': 'content',
-                            'match_score': content_match + keyword_match * 2,
-                            'content_preview': file_data['content_preview'][:500] + "..." if len(file_data['content_preview']) > 500 else file_data['content_preview']
-                        })
-                except Exception as e:
-                    print(f"[FILE SEARCH] Error processing file {file_id} in search_by_content: {e}")
-                    continue
-            
-            # Sắp xếp theo độ phù hợp
-            results.sort(key=lambda x: x['match_score'], reverse=True)
+            print(f"[FILE SEARCH] search_by_content: query='{query}', terms={query_terms(query)}, user_id={user_id}, user_role={user_role}")
+            visible = self.visible_file_ids(user_id, user_role, department)
+            results = self.materialize([(file_id, score, 'content') for file_id, score in self._rank_content(query, visible)])
             print(f"[FILE SEARCH] search_by_content found {len(results)} results")
-            return results[:10]
+            return results
         except Exception as e:
             print(f"[FILE SEARCH] Error in search_by_content: {e}")
             import traceback
             traceback.print_exc()
             return []
     
-    def search_all(self, query: str, user_id: str = None, user_role: str = None) -> Dict:
+    def search_all(self, query: str, user_id: str = None, user_role: str = None, department: str = None,
+                   limit: int = 10) -> Dict:
         """Tìm kiếm tổng hợp theo tên và nội dung với lọc theo quyền truy cập"""
         try:
             print(f"[FILE SEARCH] search_all called with query: '{query}'")
             
-            name_results = self.search_by_name(query, user_id, user_role)
-            content_results = self.search_by_content(query, user_id, user_role)
-            
-            print(f"[FILE SEARCH] Name results: {len(name_results)}, Content results: {len(content_results)}")
+            # Xếp hạng trên file id, chỉ tạo kết quả cho các file được trả về
+            visible = self.visible_file_ids(user_id, user_role, department)
+            ranked, name_count, content_count = self._rank(query, visible)
             
-            # Gộp kết quả và loại bỏ duplicate
-            all_results = {}
-            for result in name_results:
-                all_results[result['id']] = result
-            for result in content_results:
-                if result['id'] in all_results:
-                    # Nếu file xuất hiện trong cả 2 kết quả, tăng điểm
-                    all_results[result['id']]['match_score'] += result['match_score']
-                    all_results[result['id']]['match_type'] = 'both'
-                else:
-                    all_results[result['id']] = result
-            
-            # Sắp xếp theo điểm tổng hợp
-            final_results = list(all_results.values())
-            final_results.sort(key=lambda x: x['match_score'], reverse=True)
-            print(f"[FILE SEARCH] Final results count: {len(final_results)}")
+            print(f"[FILE SEARCH] Name results: {name_count}, Content results: {content_count}")
+            print(f"[FILE SEARCH] Final results count: {len(ranked)}")
             return {
                 'query': query,
-                'total_results': len(final_results),
-                'name_results': len(name_results),
-                'content_results': len(content_results),
-                'results': final_results[:10]
+                'total_results': len(ranked),
+                'name_results': name_count,
+                'content_results': content_count,
+                'results': self.materialize(ranked[:limit])
             }
         except Exception as e:
             print(f"[FILE SEARCH] Error in search_all: {e}")
@@ -236,19 +477,18 @@ class FileSearchEngine:
                 'results': []
             }
     
-    def search_files(self, query: str, user_id: str = None, user_role: str = None, search_type: str = 'both', limit: int = 20) -> List[Dict]:
+    def search_files(self, query: str, user_id: str = None, user_role: str = None, search_type: str = 'both',
+                     limit: int = 20, department: str = None) -> List[Dict]:
         """Tìm kiếm file với các tùy chọn linh hoạt"""
         try:
             print(f"[FILE SEARCH] Searching files with query: '{query}', type: {search_type}, user_id: {user_id}, user_role: {user_role}")
             
             if search_type == 'name':
-                results = self.search_by_name(query, user_id, user_role)
+                results = self.search_by_name(query, user_id, user_role, department)
             elif search_type == 'content':
-                results = self.search_by_content(query, user_id, user_role)
+                results = self.search_by_content(query, user_id, user_role, department)
             else:  # 'both'
-                # Sử dụng search_all nhưng chỉ lấy results
-                search_result = self.search_all(query, user_id, user_role)
-                results = search_result['results']
+                results = self.search_all(query, user_id, user_role, department, limit)['results']
             
             print(f"[FILE SEARCH] Search completed, found {len(results)} results")
             
@@ -260,39 +500,20 @@ class FileSearchEngine:
             traceback.print_exc()
             return []
     
-    def get_search_suggestions(self, user_id: str = None, user_role: str = None, query: str = '') -> List[str]:
-        """Lấy gợi ý từ khóa tìm kiếm dựa trên file của user"""
-        suggestions = []
-        
-        # Lấy tất cả file mà user có quyền truy cập
-        user_files = []
-        for file_id, file_data in self.index_data.items():
-            if user_id and user_role != 'admin':
-                if file_data['uploaded_by'] != user_id:
-                    continue
-            user_files.append(file_data)
-        
-        # Trích xuất keywords từ tên file và nội dung
-        all_keywords = set()
-        for file_data in user_files:
-            # Keywords từ tên file
-            filename_words = re.findall(r'\w+', file_data['original_name'].lower())
-            all_keywords.update(filename_words)
-            
-            # Keywords từ nội dung
-            if file_data['keywords']:
-                all_keywords.update(file_data['keywords'])
-        
-        # Lọc theo query nếu có
-        if query:
-            query_lower = query.lower()
-            suggestions = [kw for kw in all_keywords if query_lower in kw.lower() and len(kw) > 2]
+    def get_search_suggestions(self, user_id: str = None, user_role: str = None, query: str = '',
+                               department: str = None) -> List[str]:
+        """Gợi ý từ khóa theo tiền tố, lấy từ tên file và nội dung các file user được xem"""
+        if not user_id or user_role == 'admin':
+            scopes = [ALL_SCOPE]
         else:
-            suggestions = [kw for kw in all_keywords if len(kw) > 2]
-        
-        # Sắp xếp và giới hạn kết quả
-        suggestions.sort()
-        return suggestions[:10]
+            # Scope của user gồm file mình upload và file được cấp quyền
+            scopes = [user_id] + ([DEPARTMENT_SCOPE + department] if department else [])
+        suggestions = set()
+        for scope in scopes:
+            prefix_index = self.suggestion_index.get(scope)
+            if prefix_index is not None:
+                suggestions.update(prefix_index.complete(query, 10))
+        return sorted(suggestions, key=lambda term: (fold_diacritics(term), term))[:10]
     
     def calculate_name_match_score(self, query: str, filename: str) -> int:
         """Tính điểm match cho tên file"""
@@ -318,24 +539,16 @@ class FileSearchEngine:
             return 0
     
     def update_index(self, file_id: str):
-        """Cập nhật index cho file mới"""
+        """Cập nhật index cho file mới / vừa thay đổi"""
+        db = None
         try:
             print(f"[FILE SEARCH] Updating index for file {file_id}")
             db = next(get_db())
             file = db.query(DBFile).filter(DBFile.id == file_id).first()
             
             if file and os.path.exists(file.file_path):
-                self.index_data[file.id] = {
-                    'id': file.id,
-                    'original_name': file.original_name,
-                    'stored_name': file.stored_name,
-                    'file_path': file.file_path,
-                    'file_type': file.file_type,
-                    'uploaded_by': file.uploaded_by,
-                    'uploaded_at': file.uploaded_at.isoformat() if file.uploaded_at else None,
-                    'content_preview': self.extract_content_preview(file.file_path),
-                    'keywords': self.extract_keywords(file.original_name, file.file_path)
-                }
+                entry, terms = self._build_entry(file)
+                self._apply({file.id: (entry, self._fingerprint(file, os.stat(file.file_path)), terms)}, [])
                 print(f"[FILE SEARCH] Successfully updated index for file {file_id}")
             else:
                 print(f"[FILE SEARCH] File {file_id} not found or file path doesn't exist")
@@ -344,10 +557,16 @@ class FileSearchEngine:
             import traceback
             traceback.print_exc()
         finally:
-            try:
+            if db is not None:
                 db.close()
-            except:
-                pass
+
+    def remove_from_index(self, file_id: str):
+        """Bỏ file đã xóa khỏi index"""
+        if file_id in self.index_data:
+            self._apply({}, [file_id])
+        else:
+            # File chưa kịp index vẫn có thể đã được cấp quyền
+            self.access_index.remove_file(file_id)
 
 # Khởi tạo search engine
 try:
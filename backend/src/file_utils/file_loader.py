@@ -38,9 +38,10 @@ def load_document_from_url(url: str) -> List[Document]:
         print(f"Error loading document from {url}: {e}")
         return []
 
-def load_document_from_file(file_path: str) -> List[Document]:
+def load_document_from_file(file_path: str, strict: bool = False) -> List[Document]:
     """
     Load document from local file path
+    strict=True: lỗi đọc file được raise thay vì trả về [] (để job xử lý sau upload retry được)
     """
     try:
         if file_path.lower().endswith('.pdf'):
@@ -66,4 +67,6 @@ def load_document_from_file(file_path: str) -> List[Document]:
         
     except Exception as e:
         print(f"Error loading document from {file_path}: {e}")
+        if strict:
+            raise
         return [] 
\ No newline at end of file
@@ -0,0 +1,106 @@
+import re
+import unicodedata
+from typing import List, Tuple
+from langchain.schema import Document
+from src.config import ChunkConfig
+
+# Viết tắt tiếng Việt/tiếng Anh hay gặp, không coi dấu chấm sau chúng là hết câu
+_ABBREVIATIONS = {
+    'tp', 'q', 'p', 'ts', 'ths', 'pgs', 'gs', 'bs', 'th', 'ks', 'cn', 'đ', 'v.v',
+    'mr', 'mrs', 'ms', 'dr', 'no', 'vs', 'etc', 'e.g', 'i.e'
+}
+
+# Tăng khi đổi thuật toán chia chunk để reindex incremental chia lại các file đã index
+CHUNKER_VERSION = 3
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+_SENTENCE_END = re.compile(r'[.!?…;]+["”’\')\]]*\s+')
+
+
+def _sentence_spans(text: str, start: int, end: int) -> List[Tuple[int, int]]:
+    """Tách đoạn [start, end) thành các câu, trả về offset (start, end) trong text"""
+    spans = []
+    cursor = start
+    for match in _SENTENCE_END.finditer(text, start, end):
+        # Lấy từ ngay trước dấu câu để bỏ qua các viết tắt như "TP. HCM"
+        word = re.search(r'([\w.]+)$', text[cursor:match.start()])
+        if word and word.group(1).lower().rstrip('.') in _ABBREVIATIONS:
+            continue
+        # Chữ tiếp theo viết thường thì nhiều khả năng chưa hết câu
+        if match.end() < end and text[match.end()].islower():
+            continue
+        spans.append((cursor, match.end()))
+        cursor = match.end()
+    if cursor < end:
+        spans.append((cursor, end))
+    return spans
+
+
+def _split_units(text: str, chunk_size: int) -> List[Tuple[int, int]]:
+    """Chia text thành các đơn vị (câu) không dài hơn chunk_size, giữ nguyên ranh giới đoạn văn"""
+    units = []
+    paragraph_start = 0
+    boundaries = [(m.start(), m.end()) for m in _PARAGRAPH_BREAK.finditer(text)] + [(len(text), len(text))]
+    for paragraph_end, next_start in boundaries:
+        for start, end in _sentence_spans(text, paragraph_start, paragraph_end):
+            # Câu quá dài thì cắt tại khoảng trắng gần nhất, không cắt giữa một từ/âm tiết
+            while end - start > chunk_size:
+                cut = text.rfind(' ', start + chunk_size // 2, start + chunk_size)
+                if cut <= start:
+                    cut = start + chunk_size
+                units.append((start, cut))
+                start = cut
+            if text[start:end].strip():
+                units.append((start, end))
+        paragraph_start = next_start
+    return units
+
+
+def chunk_text(text: str, chunk_size: int = None, chunk_overlap: int = None) -> List[Tuple[int, int]]:
+    """Gom các câu liền nhau thành chunk <= chunk_size ký tự, chồng lấp khoảng chunk_overlap ký tự"""
+    chunk_size = chunk_size or ChunkConfig.ChunkSize
+    chunk_overlap = ChunkConfig.ChunkOverlap if chunk_overlap is None else chunk_overlap
+    if chunk_overlap >= chunk_size:
+        raise ValueError(f"chunk_overlap ({chunk_overlap}) phải nhỏ hơn chunk_size ({chunk_size})")
+    units = _split_units(text, chunk_size)
+    chunks = []
+    i = 0
+    while i < len(units):
+        start = units[i][0]
+        j = i
+        while j + 1 < len(units) and units[j + 1][1] - start <= chunk_size:
+            j += 1
+        chunks.append((start, units[j][1]))
+        if j + 1 >= len(units):
+            break
+        # Lùi lại vài câu cuối để chunk sau chồng lấp với chunk trước, nhưng chỉ khi chunk sau
+        # vẫn chứa được câu kế tiếp (nếu không nó sẽ nằm gọn trong chunk vừa tạo)
+        next_i = j + 1
+        while (next_i - 1 > i and units[j][1] - units[next_i - 1][0] <= chunk_overlap
+               and units[j + 1][1] - units[next_i - 1][0] <= chunk_size):
+            next_i -= 1
+        i = next_i
+    return chunks
+
+
+def chunk_documents(documents: List[Document], chunk_size: int = None, chunk_overlap: int = None) -> List[Document]:
+    """Chia các Document (trang PDF, file text) thành các chunk nhỏ để embed"""
+    chunked = []
+    for doc in documents:
+        # Chuẩn hóa NFC để chữ tiếng Việt có dấu dạng tổ hợp (thường gặp trong PDF) không bị tách sai
+        text = unicodedata.normalize('NFC', doc.page_content or '')
+        if not text.strip():
+            continue
+        for chunk_index, (start, end) in enumerate(chunk_text(text, chunk_size, chunk_overlap)):
+            # Offset tính sau khi bỏ khoảng trắng đầu/cuối để trích dẫn "chars a-b" khớp page_content
+            chunk = text[start:end]
+            start += len(chunk) - len(chunk.lstrip())
+            end -= len(chunk) - len(chunk.rstrip())
+            metadata = dict(doc.metadata or {})
+            metadata.update({
+                'chunk_index': chunk_index,
+                'start_offset': start,
+                'end_offset': end
+            })
+            chunked.append(Document(page_content=text[start:end], metadata=metadata))
+    return chunked
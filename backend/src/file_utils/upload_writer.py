@@ -0,0 +1,149 @@
+import os
+import codecs
+import hashlib
+from typing import Dict
+
+from src.config import UploadConfig
+
+# Các byte không có trong windows-1252, gặp thì decode bằng latin-1
+_CP1252_UNDEFINED = b'\x81\x8d\x8f\x90\x9d'
+_UTF16_BOMS = (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)
+
+
+def needs_utf8(filename: str) -> bool:
+    """File text được lưu dưới dạng UTF-8 để loader đọc không lỗi"""
+    return (filename or '').lower().endswith('.txt')
+
+
+class UploadWriter:
+    """Ghi upload xuống đĩa theo từng block, đồng thời tính sha256, kích thước và nhận diện
+    encoding ngay khi byte tới, không phải đọc lại cả file sau khi lưu.
+
+    File text hợp lệ UTF-8 (trường hợp phổ biến) được giữ nguyên; chỉ file text encoding
+    khác mới được chuyển sang UTF-8 ở finish(), cũng theo từng block."""
+
+    def __init__(self, path: str, detect_encoding: bool, append: bool = False):
+        self.path = path
+        self.detect_encoding = detect_encoding
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._head = b''
+        self._utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._utf8 = True
+        self._cp1252 = True
+        self._file = None
+        if not append:
+            open(path, 'wb').close()
+
+    @classmethod
+    def resume(cls, path: str, detect_encoding: bool, size: int) -> 'UploadWriter':
+        """Dựng lại trạng thái (hash, encoding) từ phần đã ghi, vd sau khi server restart.
+        Byte sau `size` (chunk chưa ghi xong) bị bỏ."""
+        writer = cls(path, detect_encoding, append=True)
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+            while True:
+                block = f.read(UploadConfig.WriteBlockSize)
+                if not block:
+                    break
+                writer._track(block)
+        return writer
+
+    def _track(self, data: bytes):
+        self.size += len(data)
+        self._sha256.update(data)
+        if not self.detect_encoding:
+            return
+        if len(self._head) < 4:
+            self._head += data[:4 - len(self._head)]
+        if self._utf8:
+            try:
+                self._utf8_decoder.decode(data)
+            except UnicodeDecodeError:
+                self._utf8 = False
+        if self._cp1252 and len(data.translate(None, _CP1252_UNDEFINED)) != len(data):
+            self._cp1252 = False
+
+    def write(self, data: bytes):
+        if not data:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        self._file.write(data)
+        self._track(data)
+
+    def write_stream(self, stream, limit: int = None) -> int:
+        """Chép từ stream (file upload / request body) theo block, tối đa `limit` byte"""
+        written = 0
+        while limit is None or written < limit:
+            block_size = UploadConfig.WriteBlockSize
+            if limit is not None:
+                block_size = min(block_size, limit - written)
+            block = stream.read(block_size)
+            if not block:
+                break
+            self.write(block)
+            written += len(block)
+        return written
+
+    def close(self):
+        """Đóng file giữa các chunk, write() sẽ mở lại"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def abort(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+
+    def source_encoding(self) -> str:
+        if self._utf8:
+            try:
+                self._utf8_decoder.decode(b'', final=True)
+            except UnicodeDecodeError:
+                self._utf8 = False
+        if self._utf8:
+            return 'utf-8'
+        if self._head.startswith(_UTF16_BOMS):
+            return 'utf-16'
+        return 'windows-1252' if self._cp1252 else 'latin-1'
+
+    def _transcode(self, encoding: str) -> int:
+        tmp_path = self.path + '.utf8'
+        decoder = codecs.getincrementaldecoder(encoding)()
+        stored_size = 0
+        with open(self.path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            while True:
+                block = src.read(UploadConfig.WriteBlockSize)
+                text = decoder.decode(block, final=not block)
+                data = text.encode('utf-8')
+                dst.write(data)
+                stored_size += len(data)
+                if not block:
+                    break
+        os.replace(tmp_path, self.path)
+        return stored_size
+
+    def finish(self) -> Dict:
+        """Đóng file, convert sang UTF-8 nếu cần. sha256/size là của nội dung gốc client gửi"""
+        self.close()
+        result = {'sha256': self.sha256, 'size': self.size, 'stored_size': self.size,
+                  'encoding': None, 'converted': False}
+        if self.detect_encoding:
+            encoding = self.source_encoding()
+            result['encoding'] = encoding
+            if encoding != 'utf-8':
+                try:
+                    result['stored_size'] = self._transcode(encoding)
+                except UnicodeDecodeError:
+                    # vd UTF-16 bị cắt cụt: latin-1 luôn decode được
+                    encoding = result['encoding'] = 'latin-1'
+                    result['stored_size'] = self._transcode(encoding)
+                result['converted'] = True
+                print(f"[INFO] Converted {os.path.basename(self.path)} from {encoding} to UTF-8 encoding.")
+        return result
@@ -0,0 +1,161 @@
+import time
+from typing import Dict, List, Optional, Tuple
+
+from langchain.schema import Document
+
+import src.vectordb as vectordb
+from src.config import HybridSearchConfig
+from src.file_search import file_search_engine
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], weights: List[float] = None,
+                           k: int = 60) -> List[Tuple[str, float]]:
+    """RRF: điểm = tổng weight / (k + hạng) trên các danh sách (hạng tính từ 1), giảm dần"""
+    scores: Dict[str, float] = {}
+    for position, ranking in enumerate(rankings):
+        weight = weights[position] if weights else 1.0
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def _restrict_to_files(metadata_filter: Optional[List[Dict]], file_ids: List[str]) -> List[Dict]:
+    """Filter vectordb chỉ còn các file cho trước, vẫn giữ điều kiện quyền truy cập của từng clause"""
+    if metadata_filter is None:
+        return [{"source": "uploaded_file", "file_id": file_ids}]
+    clauses = []
+    for clause in metadata_filter:
+        allowed = clause.get("file_id")
+        if allowed is None:
+            ids = file_ids
+        else:
+            allowed = set(allowed) if isinstance(allowed, (list, tuple, set)) else {allowed}
+            ids = [file_id for file_id in file_ids if file_id in allowed]
+        if ids:
+            clauses.append({**clause, "file_id": ids})
+    return clauses
+
+
+class HybridRetriever:
+    """Kết hợp tìm kiếm từ khóa (FileSearchEngine: BM25 + trigram tên file) với tìm kiếm vector (FAISS).
+
+    Hai danh sách hạng được trộn bằng reciprocal rank fusion nên không cần chuẩn hóa điểm BM25 và
+    khoảng cách vector về cùng thang đo. Mỗi lần gọi trả về kèm thời gian từng bước (ms) để tinh
+    chỉnh trọng số / fetch_k mà không cần đo lại."""
+
+    def __init__(self, vectorstore=None):
+        self._vectorstore = vectorstore
+
+    @property
+    def vectorstore(self):
+        return self._vectorstore or vectordb.get_vector_store()
+
+    def search_files(self, query: str, user_id: str = None, user_role: str = None,
+                     department: str = None, limit: int = 20) -> Tuple[List[Dict], Dict[str, float]]:
+        """Tìm file (mỗi file một kết quả), trả về (kết quả như search_files, timings)"""
+        timings = {}
+        started = time.perf_counter()
+
+        step = time.perf_counter()
+        visible = file_search_engine.visible_file_ids(user_id, user_role, department)
+        lexical = file_search_engine.rank_in(query, visible)
+        timings['lexical_ms'] = _elapsed_ms(step)
+
+        vector_files = []
+        if visible is None or visible:
+            step = time.perf_counter()
+            embedding = self.vectorstore.embedding_function.embed_query(query)
+            timings['embed_ms'] = _elapsed_ms(step)
+
+            step = time.perf_counter()
+            metadata_filter = [{"source": "uploaded_file"}] if visible is None else _restrict_to_files(None, sorted(visible))
+            for _, doc in vectordb.search_by_vector(self.vectorstore, embedding, HybridSearchConfig.FetchK, metadata_filter):
+                file_id = doc.metadata.get('file_id')
+                # Hạng của file là hạng của chunk gần nhất
+                if file_id and file_id not in vector_files:
+                    vector_files.append(file_id)
+            timings['vector_ms'] = _elapsed_ms(step)
+
+        step = time.perf_counter()
+        fused = reciprocal_rank_fusion(
+            [[file_id for file_id, _, _ in lexical], vector_files],
+            [HybridSearchConfig.LexicalWeight, HybridSearchConfig.VectorWeight],
+            HybridSearchConfig.RrfK
+        )
+        lexical_types = {file_id: match_type for file_id, _, match_type in lexical}
+        vector_set = set(vector_files)
+        ranked = []
+        for file_id, score in fused:
+            if file_id in lexical_types:
+                match_type = 'hybrid' if file_id in vector_set else lexical_types[file_id]
+            else:
+                match_type = 'semantic'
+            ranked.append((file_id, round(score, 6), match_type))
+        results = file_search_engine.materialize(ranked[:limit])
+        timings['fusion_ms'] = _elapsed_ms(step)
+        timings['total_ms'] = _elapsed_ms(started)
+
+        print(f"[HYBRID SEARCH] search_files: query='{query}', lexical={len(lexical)}, "
+              f"vector={len(vector_files)}, results={len(results)}, timings={timings}")
+        return results, timings
+
+    def retrieve(self, question: str, embedding: List[float], metadata_filter: Optional[List[Dict]] = None,
+                 k: int = 4) -> Tuple[List[Document], Dict[str, float]]:
+        """Chunk cho RAG: trộn hạng MMR của vector (như khi tắt hybrid) với chunk của các file khớp
+        từ khóa. Mỗi file tối đa MaxChunksPerFile chunk khi còn chunk của file khác để chọn; nếu
+        chỉ một file liên quan thì các chunk còn lại của file đó được dùng. Trả về (documents, timings)"""
+        timings = {}
+        vectorstore = self.vectorstore
+
+        step = time.perf_counter()
+        vector_hits = vectordb.mmr_rank_by_vector(vectorstore, embedding, k=HybridSearchConfig.FetchK,
+                                                  fetch_k=HybridSearchConfig.FetchK, metadata_filter=metadata_filter)
+        timings['vector_ms'] = _elapsed_ms(step)
+
+        step = time.perf_counter()
+        visible = file_search_engine.visible_for_filter(metadata_filter)
+        lexical_files = [file_id for file_id, _, _ in file_search_engine.rank_in(question, visible)]
+        lexical_files = lexical_files[:HybridSearchConfig.LexicalFiles]
+        timings['lexical_ms'] = _elapsed_ms(step)
+
+        lexical_hits = []
+        restricted = _restrict_to_files(metadata_filter, lexical_files) if lexical_files else []
+        if restricted:
+            step = time.perf_counter()
+            lexical_hits = vectordb.search_by_vector(vectorstore, embedding, HybridSearchConfig.FetchK, restricted)
+            # Xếp theo hạng từ khóa của file, trong cùng file giữ thứ tự theo khoảng cách vector
+            file_rank = {file_id: rank for rank, file_id in enumerate(lexical_files)}
+            lexical_hits.sort(key=lambda hit: file_rank.get(hit[1].metadata.get('file_id'), len(file_rank)))
+            timings['lexical_chunks_ms'] = _elapsed_ms(step)
+
+        step = time.perf_counter()
+        documents = dict(vector_hits + lexical_hits)
+        fused = reciprocal_rank_fusion(
+            [[doc_id for doc_id, _ in vector_hits], [doc_id for doc_id, _ in lexical_hits]],
+            [HybridSearchConfig.VectorWeight, HybridSearchConfig.LexicalWeight],
+            HybridSearchConfig.RrfK
+        )
+        selected, capped = [], []
+        per_file: Dict[str, int] = {}
+        for position, (doc_id, _) in enumerate(fused):
+            file_id = documents[doc_id].metadata.get('file_id')
+            if file_id:
+                if per_file.get(file_id, 0) >= HybridSearchConfig.MaxChunksPerFile:
+                    capped.append(position)
+                    continue
+                per_file[file_id] = per_file.get(file_id, 0) + 1
+            selected.append(position)
+            if len(selected) >= k:
+                break
+        # Không đủ chunk của file khác để cạnh tranh: lấp chỗ trống bằng chunk vượt giới hạn, giữ thứ tự hạng
+        selected = sorted(selected + capped[:k - len(selected)])
+        timings['fusion_ms'] = _elapsed_ms(step)
+        return [documents[fused[position][0]] for position in selected], timings
+
+
+# Khởi tạo hybrid retriever
+hybrid_retriever = HybridRetriever()
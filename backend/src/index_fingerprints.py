@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, Optional
+
+from src.config import OllamaConfig, FaissConfig, ChunkConfig
+from src.file_utils.text_chunker import CHUNKER_VERSION
+
+_lock = threading.Lock()
+
+# Tăng khi thêm/đổi field metadata của chunk (vd. department cho filter) để reindex
+# incremental ghi lại metadata cho các file đã index
+METADATA_VERSION = 2
+
+
+def _chunking() -> str:
+    return f"{ChunkConfig.ChunkSize}/{ChunkConfig.ChunkOverlap}/v{CHUNKER_VERSION}"
+
+
+def compute_fingerprint(file_path: str) -> Dict:
+    """Fingerprint của file: kích thước, mtime, sha256 nội dung, cấu hình embedding và phiên bản metadata"""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(block)
+    stat = os.stat(file_path)
+    return {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'content_hash': sha256.hexdigest(),
+        'embedding_model': OllamaConfig.EmbeddingModel,
+        'chunking': _chunking(),
+        'metadata_version': METADATA_VERSION
+    }
+
+
+def is_unchanged(file_path: str, previous: Optional[Dict]) -> bool:
+    """So sánh nhanh bằng size/mtime, chỉ hash lại nội dung khi mtime thay đổi"""
+    if not previous:
+        return False
+    if previous.get('embedding_model') != OllamaConfig.EmbeddingModel:
+        return False
+    if previous.get('chunking') != _chunking():
+        return False
+    if previous.get('metadata_version') != METADATA_VERSION:
+        return False
+    stat = os.stat(file_path)
+    if stat.st_size != previous.get('size'):
+        return False
+    if stat.st_mtime == previous.get('mtime'):
+        return True
+    return compute_fingerprint(file_path)['content_hash'] == previous.get('content_hash')
+
+
+def load_fingerprints() -> Dict[str, Dict]:
+    if not os.path.exists(FaissConfig.FingerprintPath):
+        return {}
+    try:
+        with open(FaissConfig.FingerprintPath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[FINGERPRINT] Error loading fingerprints: {e}")
+        return {}
+
+
+def save_fingerprints(fingerprints: Dict[str, Dict]):
+    tmp_path = f"{FaissConfig.FingerprintPath}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(fingerprints, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, FaissConfig.FingerprintPath)
+
+
+def record_fingerprint(file_id: str, file_path: str):
+    """Lưu fingerprint sau khi file đã được index (dùng cho upload)"""
+    with _lock:
+        fingerprints = load_fingerprints()
+        fingerprints[file_id] = compute_fingerprint(file_path)
+        save_fingerprints(fingerprints)
+
+
+def remove_fingerprint(file_id: str):
+    with _lock:
+        fingerprints = load_fingerprints()
+        if fingerprints.pop(file_id, None) is not None:
+            save_fingerprints(fingerprints)
@@ -1,5 +1,6 @@
+import time
 import uuid
-from typing import TypedDict, List
+from typing import TypedDict, List, Dict, Optional, Iterator
 from datetime import datetime
 
 from langchain.schema import Document
@@ -8,7 +9,11 @@ from langgraph.graph import END, StateGraph
 from langchain_core.messages import HumanMessage, SystemMessage
 
 import src.vectordb as vectordb
-from src.config import OllamaConfig
+from src.answer_cache import answer_cache
+from src.chat_memory import conversation_memory, PUBLIC_SCOPE
+from src.config import OllamaConfig, HybridSearchConfig
+from src.hybrid_search import hybrid_retriever
+from src.llm_gateway import llm_slot, call_llm, Priority
 from src.file_utils.file_loader import load_document_from_url
 
 
@@ -20,6 +25,19 @@ class RagDataContext(TypedDict):
     file_urls: List[str]
     file_documents: List[Document]
     chat_context: str
+    # Filter metadata theo quyền của user (None = không lọc), xem vectordb.semantic_search
+    metadata_filter: Optional[List[Dict]]
+    # Scope của bộ nhớ hội thoại (user_id), mặc định dùng chung "public"
+    memory_scope: Optional[str]
+    # Embedding câu hỏi (tính ở bước retrieve, dùng lại cho answer cache)
+    question_embedding: Optional[List[float]]
+    # True nếu câu trả lời lấy từ answer cache
+    cached: Optional[bool]
+    # Thời gian từng bước retrieve (ms): embed, vector, lexical, fusion, memory, total
+    timings: Optional[Dict[str, float]]
+
+# Filter không khớp file upload nào: người dùng không xác định (public chat) không được retrieve tài liệu
+ANONYMOUS_FILTER = [{"source": "uploaded_file", "file_id": []}]
 
 class LLMManager:
     """Manager class for LLM operations"""
@@ -31,7 +49,7 @@ class LLMManager:
         """Generate a response using the LLM"""
         try:
             messages = [HumanMessage(content=prompt)]
-            response = self.llm.invoke(messages)
+            response = call_llm(self.llm.invoke, messages)
             return response.content
         except Exception as e:
             return f"Lỗi tạo phản hồi: {str(e)}"
@@ -44,7 +62,10 @@ def create_llm(model="mistral", temperature=0, format=''):
         base_url=OllamaConfig.Host,
     )
 
-vectorstore = vectordb.init_vector_store()
+vectorstore = vectordb.get_vector_store()
+# Q&A cũ từng được lưu chung trong index tài liệu, nay đã chuyển sang conversation_memory
+if vectordb.remove_where(vectorstore, 'source', 'chat-history'):
+    vectordb.flush(vectorstore)
 llm = create_llm(model=OllamaConfig.RagModel)
 llm_manager = LLMManager()
 
@@ -63,13 +84,72 @@ def load_file_document(ctx: RagDataContext) -> RagDataContext:
 
 def retrieve(ctx: RagDataContext) -> RagDataContext:
     question = ctx["question"]
-    base_documents = vectordb.semantic_search(vectorstore, question)
-    ctx["documents"] = base_documents
+    timings = {}
+    started = time.perf_counter()
+    # Embed câu hỏi một lần, dùng cho cả index tài liệu và bộ nhớ hội thoại
+    embedding = vectorstore.embedding_function.embed_query(question)
+    timings["embed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    if HybridSearchConfig.Enabled:
+        # Trộn hạng vector với tìm kiếm từ khóa (tên file, BM25), xem HybridRetriever.retrieve
+        base_documents, stage_timings = hybrid_retriever.retrieve(question, embedding, ctx.get("metadata_filter"))
+        timings.update(stage_timings)
+    else:
+        step = time.perf_counter()
+        base_documents = vectordb.mmr_search_by_vector(vectorstore, embedding, metadata_filter=ctx.get("metadata_filter"))
+        timings["vector_ms"] = round((time.perf_counter() - step) * 1000, 1)
+    step = time.perf_counter()
+    memory_documents = conversation_memory.search(ctx.get("memory_scope") or PUBLIC_SCOPE, embedding)
+    timings["memory_ms"] = round((time.perf_counter() - step) * 1000, 1)
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"[RETRIEVE] timings: {timings}")
+    ctx["documents"] = base_documents + memory_documents
+    ctx["question_embedding"] = embedding
+    ctx["timings"] = timings
     ctx["steps"].append("retrieve_documents")
     return ctx
 
-def generate(ctx: RagDataContext) -> RagDataContext:
-    docs_content = "\n".join(doc.page_content for doc in ctx["documents"])
+def is_cacheable(ctx: RagDataContext) -> bool:
+    # Câu trả lời phụ thuộc file đính kèm hoặc lịch sử hội thoại thì không dùng chung được
+    return not ctx.get("file_documents") and not ctx.get("chat_context")
+
+def cache_caller(ctx: RagDataContext) -> str:
+    """Loại người gọi cho answer cache: admin (không lọc file), public hoặc user"""
+    if ctx.get("metadata_filter") is None:
+        return "admin"
+    return "public" if (ctx.get("memory_scope") or PUBLIC_SCOPE) == PUBLIC_SCOPE else "user"
+
+def lookup_answer(ctx: RagDataContext) -> RagDataContext:
+    ctx["cached"] = False
+    if is_cacheable(ctx):
+        answer = answer_cache.get(ctx["question"], ctx["documents"], OllamaConfig.RagModel,
+                                  embedding=ctx.get("question_embedding"),
+                                  memory_scope=ctx.get("memory_scope") or PUBLIC_SCOPE,
+                                  caller=cache_caller(ctx))
+        if answer is not None:
+            ctx["generation"] = answer
+            ctx["cached"] = True
+    ctx["steps"].append("lookup_answer_cache")
+    return ctx
+
+def route_after_lookup(ctx: RagDataContext) -> str:
+    return "cached" if ctx.get("cached") else "generate"
+
+def format_citation(doc: Document) -> str:
+    """Tạo nhãn trích dẫn cho chunk, vd: "report.pdf, page 2, chars 1000-1850" """
+    metadata = getattr(doc, 'metadata', None) or {}
+    label = metadata.get('file_name') or metadata.get('source', '')
+    if 'page' in metadata:
+        label += f", page {metadata['page'] + 1}"
+    if 'start_offset' in metadata and 'end_offset' in metadata:
+        label += f", chars {metadata['start_offset']}-{metadata['end_offset']}"
+    return label
+
+def build_generation_messages(ctx: RagDataContext) -> list:
+    """Prompt cho bước generate (dùng chung cho workflow thường và streaming)"""
+    docs_content = "\n".join(
+        f"[{format_citation(doc)}] {doc.page_content}" if doc.metadata.get('file_id') else doc.page_content
+        for doc in ctx["documents"]
+    )
     file_documents = ctx.get("file_documents", [])
     file_content = "\n".join(doc.page_content for doc in file_documents) if file_documents else ""
     
@@ -103,11 +183,14 @@ def generate(ctx: RagDataContext) -> RagDataContext:
                 RelatedDocuments: {docs_content}{file_info}
                 
                 If the question asks about finding files and you find relevant information, mention the specific files that contain that information.
+                When citing a RelatedDocument, use the label in square brackets before it.
             """
         )
     ]
+    return messages
 
-    response = llm.invoke(messages)
+def generate(ctx: RagDataContext) -> RagDataContext:
+    response = call_llm(llm.invoke, build_generation_messages(ctx), priority=Priority.INTERACTIVE)
     ctx["generation"] = response.content
     ctx["steps"].append("generate_answer")
     return ctx
@@ -115,23 +198,74 @@ def generate(ctx: RagDataContext) -> RagDataContext:
 def store_answer(ctx: RagDataContext) -> RagDataContext:
     question = ctx["question"]
     answer = ctx["generation"]
-    content = f"Q: {question}\nA: {answer}"
-    metadata = {"source": "chat-history", "type": "Q&A"}
-    vectordb.add_document(vectorstore, content, metadata)
+    conversation_memory.add(ctx.get("memory_scope") or PUBLIC_SCOPE, question, answer)
+    if is_cacheable(ctx):
+        answer_cache.put(question, ctx["documents"], OllamaConfig.RagModel, answer,
+                         embedding=ctx.get("question_embedding"),
+                         memory_scope=ctx.get("memory_scope") or PUBLIC_SCOPE,
+                         caller=cache_caller(ctx))
     ctx["steps"].append("store_answer")
     return ctx
 
+def stream_workflow(ctx: RagDataContext, include_sources: bool = True) -> Iterator[Dict]:
+    """Chạy các bước như workflow nhưng stream token của bước generate.
+
+    Yield các event {"event": ..., "data": ...}: step, retrieval (bỏ qua khi include_sources=False,
+    vd. public chat không được thấy danh sách file), token và cuối cùng complete (data = ctx).
+    Khi consumer đóng generator (client ngắt kết nối) thì stream tới Ollama cũng bị đóng,
+    request generate bị hủy."""
+    ctx = load_file_document(ctx)
+    yield {"event": "step", "data": {"step": "load_file_documents"}}
+    ctx = retrieve(ctx)
+    yield {"event": "step", "data": {"step": "retrieve_documents"}}
+    if include_sources:
+        yield {"event": "retrieval", "data": {"documents": [
+            {
+                "file_id": doc.metadata.get("file_id"),
+                "file_name": doc.metadata.get("file_name"),
+                "citation": format_citation(doc)
+            }
+            for doc in ctx["documents"] + ctx.get("file_documents", [])
+            if doc.metadata.get("file_id")
+        ]}}
+
+    ctx = lookup_answer(ctx)
+    if ctx["cached"]:
+        yield {"event": "step", "data": {"step": "lookup_answer_cache", "cached": True}}
+        yield {"event": "token", "data": {"text": ctx["generation"]}}
+        yield {"event": "complete", "data": ctx}
+        return
+
+    tokens = []
+    with llm_slot(Priority.INTERACTIVE):
+        token_stream = llm.stream(build_generation_messages(ctx))
+        try:
+            for chunk in token_stream:
+                if chunk.content:
+                    tokens.append(chunk.content)
+                    yield {"event": "token", "data": {"text": chunk.content}}
+        finally:
+            token_stream.close()
+    ctx["generation"] = "".join(tokens)
+    ctx["steps"].append("generate_answer")
+    yield {"event": "step", "data": {"step": "generate_answer"}}
+
+    ctx = store_answer(ctx)
+    yield {"event": "complete", "data": ctx}
+
 # LangGraph setup
 def add_nodes(workflow: StateGraph):
     workflow.add_node("file", load_file_document)
     workflow.add_node("retrieve", retrieve)
+    workflow.add_node("cache", lookup_answer)
     workflow.add_node("generate", generate)
     workflow.add_node("store", store_answer)
 
 def build_graph(workflow: StateGraph):
     workflow.set_entry_point("file")
     workflow.add_edge("file", "retrieve")
-    workflow.add_edge("retrieve", "generate")
+    workflow.add_edge("retrieve", "cache")
+    workflow.add_conditional_edges("cache", route_after_lookup, {"cached": END, "generate": "generate"})
     workflow.add_edge("generate", "store")
     workflow.add_edge("store", END)
 
@@ -158,7 +292,8 @@ def process_message(message: str) -> str:
             "steps": [],
             "file_urls": [],
             "file_documents": [],
-            "chat_context": ""
+            "chat_context": "",
+            "metadata_filter": ANONYMOUS_FILTER
         }
         result = workflow.invoke(initial_state, config)
         return result.get("generation", "Xin lỗi, tôi không thể trả lời câu hỏi này.")
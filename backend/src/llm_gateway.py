@@ -0,0 +1,206 @@
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Dict
+
+from flask import jsonify
+
+from src.config import OllamaConfig, LLMGatewayConfig
+
+
+class Priority(IntEnum):
+    """Số nhỏ hơn = ưu tiên cao hơn"""
+    INTERACTIVE = 0   # chat của người dùng
+    AGENTIC = 1       # agentic AI lập kế hoạch / thực thi
+    BACKGROUND = 2    # phân loại, index file khi upload
+
+
+class GatewaySaturated(Exception):
+    """Hàng đợi của priority đã đầy hoặc chờ quá lâu, client nên thử lại sau retry_after giây"""
+
+    def __init__(self, priority: Priority, retry_after: int):
+        super().__init__(f"LLM đang quá tải ({priority.name.lower()}), vui lòng thử lại sau {retry_after} giây")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+# Priority mặc định cho các lời gọi không chỉ định (vd embedding trong lúc index file)
+_current_priority = contextvars.ContextVar('llm_priority', default=Priority.INTERACTIVE)
+
+
+class LLMGateway:
+    """Điểm duy nhất gọi Ollama trong process.
+
+    Tối đa MaxInFlight lời gọi cùng lúc, mỗi priority có giới hạn in-flight và độ dài
+    hàng đợi riêng. Khi có slot trống, request đứng đầu hàng đợi của priority cao nhất
+    (còn được phép chạy) được chạy trước, nên phân loại nền không chiếm hết model khi
+    có chat. Hàng đợi đầy hoặc chờ quá QueueTimeoutSeconds thì ném GatewaySaturated (429).
+    """
+
+    def __init__(self, max_in_flight: int, class_limits: Dict[Priority, int],
+                 queue_limits: Dict[Priority, int], queue_timeouts: Dict[Priority, float]):
+        self.max_in_flight = max_in_flight
+        self.class_limits = class_limits
+        self.queue_limits = queue_limits
+        self.queue_timeouts = queue_timeouts
+        self._cond = threading.Condition()
+        self._waiting = {priority: deque() for priority in Priority}
+        self._in_flight = {priority: 0 for priority in Priority}
+        self._stats = {priority: {'completed': 0, 'rejected': 0, 'max_queued': 0,
+                                  'wait_seconds': 0.0, 'service_seconds': 0.0}
+                       for priority in Priority}
+
+    def _runnable(self, priority: Priority) -> bool:
+        return (sum(self._in_flight.values()) < self.max_in_flight
+                and self._in_flight[priority] < self.class_limits[priority])
+
+    def _can_start(self, priority: Priority, ticket) -> bool:
+        if self._waiting[priority][0] is not ticket or not self._runnable(priority):
+            return False
+        # Nhường cho priority cao hơn đang chờ và còn được phép chạy
+        return not any(self._waiting[higher] and self._runnable(higher)
+                       for higher in Priority if higher < priority)
+
+    def _retry_after(self, priority: Priority) -> int:
+        stats = self._stats[priority]
+        average = stats['service_seconds'] / stats['completed'] if stats['completed'] else 5.0
+        ahead = sum(len(self._waiting[p]) for p in Priority if p <= priority) + 1
+        return max(1, int(average * ahead / max(self.class_limits[priority], 1)))
+
+    def check_capacity(self, priority: Priority = None):
+        """Từ chối sớm (trước khi bắt đầu stream response) nếu hàng đợi đã đầy"""
+        priority = _current_priority.get() if priority is None else priority
+        with self._cond:
+            limit = self.queue_limits[priority]
+            if limit and len(self._waiting[priority]) >= limit:
+                self._stats[priority]['rejected'] += 1
+                raise GatewaySaturated(priority, self._retry_after(priority))
+
+    def _acquire(self, priority: Priority):
+        ticket = object()
+        started = time.monotonic()
+        timeout = self.queue_timeouts[priority]
+        with self._cond:
+            limit = self.queue_limits[priority]
+            waiting = self._waiting[priority]
+            if limit and len(waiting) >= limit:
+                self._stats[priority]['rejected'] += 1
+                raise GatewaySaturated(priority, self._retry_after(priority))
+            waiting.append(ticket)
+            self._stats[priority]['max_queued'] = max(self._stats[priority]['max_queued'], len(waiting))
+            try:
+                while not self._can_start(priority, ticket):
+                    remaining = timeout - (time.monotonic() - started) if timeout else None
+                    if remaining is not None and remaining <= 0:
+                        self._stats[priority]['rejected'] += 1
+                        raise GatewaySaturated(priority, self._retry_after(priority))
+                    self._cond.wait(remaining)
+            finally:
+                waiting.remove(ticket)
+                self._cond.notify_all()
+            self._in_flight[priority] += 1
+            self._stats[priority]['wait_seconds'] += time.monotonic() - started
+
+    def _release(self, priority: Priority, service_seconds: float):
+        with self._cond:
+            self._in_flight[priority] -= 1
+            self._stats[priority]['completed'] += 1
+            self._stats[priority]['service_seconds'] += service_seconds
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: Priority = None):
+        """Giữ một slot gọi Ollama trong suốt khối lệnh (kể cả khi stream token)"""
+        priority = _current_priority.get() if priority is None else priority
+        self._acquire(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(priority, time.monotonic() - started)
+
+    def call(self, func, *args, priority: Priority = None, **kwargs):
+        with self.slot(priority):
+            return func(*args, **kwargs)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            classes = {}
+            for priority in Priority:
+                stats = self._stats[priority]
+                started = stats['completed'] + self._in_flight[priority]
+                classes[priority.name.lower()] = {
+                    'in_flight': self._in_flight[priority],
+                    'queued': len(self._waiting[priority]),
+                    'max_queued': stats['max_queued'],
+                    'completed': stats['completed'],
+                    'rejected': stats['rejected'],
+                    'avg_wait_ms': round(stats['wait_seconds'] * 1000 / started, 1) if started else 0.0,
+                    'avg_service_ms': round(stats['service_seconds'] * 1000 / stats['completed'], 1) if stats['completed'] else 0.0,
+                    'max_in_flight': self.class_limits[priority],
+                    'max_queue': self.queue_limits[priority]
+                }
+            return {
+                'max_in_flight': self.max_in_flight,
+                'in_flight': sum(self._in_flight.values()),
+                'queued': sum(len(waiting) for waiting in self._waiting.values()),
+                'classes': classes
+            }
+
+
+llm_gateway = LLMGateway(
+    max_in_flight=OllamaConfig.MaxConcurrency,
+    class_limits={
+        Priority.INTERACTIVE: OllamaConfig.MaxConcurrency,
+        Priority.AGENTIC: LLMGatewayConfig.MaxInFlightAgentic or OllamaConfig.MaxConcurrency,
+        Priority.BACKGROUND: LLMGatewayConfig.MaxInFlightBackground or OllamaConfig.MaxConcurrency
+    },
+    queue_limits={
+        Priority.INTERACTIVE: LLMGatewayConfig.MaxQueueInteractive,
+        Priority.AGENTIC: LLMGatewayConfig.MaxQueueAgentic,
+        Priority.BACKGROUND: LLMGatewayConfig.MaxQueueBackground
+    },
+    queue_timeouts={
+        Priority.INTERACTIVE: LLMGatewayConfig.QueueTimeoutSeconds,
+        Priority.AGENTIC: LLMGatewayConfig.QueueTimeoutSeconds,
+        # Việc nền không bị từ chối vì chờ lâu, chỉ chạy chậm hơn
+        Priority.BACKGROUND: 0
+    }
+)
+
+
+@contextmanager
+def use_priority(priority: Priority):
+    """Đặt priority mặc định cho mọi lời gọi LLM/embedding trong khối lệnh"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def llm_slot(priority: Priority = None):
+    return llm_gateway.slot(priority)
+
+
+def call_llm(func, *args, priority: Priority = None, **kwargs):
+    return llm_gateway.call(func, *args, priority=priority, **kwargs)
+
+
+def get_gateway_stats() -> Dict:
+    return llm_gateway.stats()
+
+
+def saturated_response(error: GatewaySaturated):
+    """Response 429 kèm header Retry-After"""
+    response = jsonify({
+        'success': False,
+        'error': str(error),
+        'retry_after': error.retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
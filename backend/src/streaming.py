@@ -0,0 +1,21 @@
+import json
+from typing import Dict, Iterator
+
+from flask import Response, stream_with_context
+
+
+def format_sse(event: str, data: Dict) -> str:
+    """Một event Server-Sent Events: `event: <tên>` + `data: <json>`"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def sse_response(events: Iterator[str]) -> Response:
+    """Response text/event-stream, tắt cache và buffering của proxy (nginx) để token tới client ngay"""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
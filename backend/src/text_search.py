@@ -0,0 +1,230 @@
+import re
+import math
+import bisect
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# Từ dừng tiếng Việt và tiếng Anh thường gặp. Chỉ so khớp đúng dạng có dấu: bỏ dấu thì
+# nhiều từ dừng trùng với từ có nghĩa ("bạn"/"bản", "có"/"cơ"), idf của BM25 lo phần còn lại
+_STOP_WORDS = {
+    'và', 'của', 'là', 'các', 'những', 'có', 'được', 'cho', 'trong', 'với', 'một', 'này', 'đó',
+    'không', 'thì', 'mà', 'để', 'từ', 'khi', 'đã', 'sẽ', 'đang', 'ra', 'vào', 'lên', 'theo', 'về',
+    'nhưng', 'hay', 'hoặc', 'cũng', 'như', 'nên', 'rằng', 'bị', 'do', 'tại', 'nếu', 'vì', 'ở',
+    'đến', 'lại', 'còn', 'rất', 'nhiều', 'tôi', 'bạn', 'chúng', 'họ', 'nó', 'gì', 'nào', 'đây',
+    'the', 'a', 'an', 'of', 'and', 'or', 'to', 'in', 'on', 'for', 'is', 'are', 'was', 'were',
+    'with', 'by', 'at', 'from', 'this', 'that', 'be', 'as', 'it', 'its', 'not', 'but',
+}
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt: "lương" -> "luong", "đơn" -> "don" """
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    decomposed = unicodedata.normalize('NFD', text)
+    return ''.join(ch for ch in decomposed if unicodedata.category(ch) != 'Mn')
+
+
+def tokenize(text: str) -> List[str]:
+    """Tách từ (âm tiết) đã chuẩn hóa NFC, chữ thường, bỏ từ dừng và từ 1 ký tự"""
+    if not text:
+        return []
+    text = unicodedata.normalize('NFC', text).lower()
+    return [
+        token for token in _TOKEN_RE.findall(text)
+        if (len(token) > 1 or token.isdigit()) and token not in _STOP_WORDS
+    ]
+
+
+def document_terms(text: str) -> Tuple[Dict[str, int], int]:
+    """Term frequency để index: mỗi từ có dấu được tính cả dạng có dấu và dạng bỏ dấu, để
+    câu hỏi gõ không dấu vẫn khớp. Trả về ({term: tf}, độ dài tài liệu)"""
+    tokens = tokenize(text)
+    term_freqs = Counter(tokens)
+    for token, count in list(term_freqs.items()):
+        folded = fold_diacritics(token)
+        if folded != token:
+            term_freqs[folded] += count
+    return dict(term_freqs), len(tokens)
+
+
+def query_terms(text: str) -> List[str]:
+    """Từ có dấu chỉ khớp đúng từ đó; từ không dấu khớp mọi biến thể dấu (qua dạng bỏ dấu)"""
+    return list(dict.fromkeys(tokenize(text)))
+
+
+class BM25Index:
+    """Inverted index term -> {doc_id: tf} với điểm BM25; query chỉ duyệt postings của các term trong câu hỏi"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, List[str]] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def _remove(self, doc_id: str):
+        for term in self._doc_terms.pop(doc_id, []):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id, 0)
+
+    def add(self, doc_id: str, term_freqs: Dict[str, int], length: int):
+        with self._lock:
+            self._remove(doc_id)
+            for term, tf in term_freqs.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+            self._doc_terms[doc_id] = list(term_freqs)
+            self._doc_lengths[doc_id] = length
+            self._total_length += length
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            self._remove(doc_id)
+
+    def search(self, terms: Iterable[str], candidates: Optional[set] = None,
+               limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """[(doc_id, score)] giảm dần; candidates khác None thì chỉ chấm điểm các doc trong đó"""
+        scores: Dict[str, float] = {}
+        with self._lock:
+            total_docs = len(self._doc_lengths)
+            if not total_docs:
+                return []
+            avg_length = (self._total_length / total_docs) or 1.0
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                if candidates is not None and len(candidates) < len(postings):
+                    matches = ((doc_id, postings[doc_id]) for doc_id in candidates if doc_id in postings)
+                else:
+                    matches = postings.items()
+                for doc_id, tf in matches:
+                    if candidates is not None and doc_id not in candidates:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit] if limit else ranked
+
+
+def trigrams(text: str) -> set:
+    """Trigram theo từng từ (kiểu pg_trgm) trên chuỗi chữ thường đã bỏ dấu"""
+    grams = set()
+    for word in _TOKEN_RE.findall(fold_diacritics(unicodedata.normalize('NFC', text).lower())):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """Trigram -> doc_id để tìm tên file gần đúng (không phân biệt dấu, chịu được lỗi gõ).
+
+    Độ giống = số trigram chung / min(số trigram của câu hỏi, của tên file), nên cả từ khóa
+    ngắn lẫn câu hỏi dài có chứa tên file đều khớp. Một doc có thể có nhiều tên (vd. tên gốc và
+    tên lưu trữ), độ giống là giá trị lớn nhất trên các tên."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: Dict[str, set] = {}
+        self._doc_grams: Dict[str, List[set]] = {}
+
+    def _remove(self, doc_id: str):
+        for gram in set().union(*self._doc_grams.pop(doc_id, [])):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(doc_id)
+                if not postings:
+                    del self._postings[gram]
+
+    def add(self, doc_id: str, *texts: str):
+        gram_sets = [grams for grams in (trigrams(text) for text in texts if text) if grams]
+        with self._lock:
+            self._remove(doc_id)
+            for grams in gram_sets:
+                for gram in grams:
+                    self._postings.setdefault(gram, set()).add(doc_id)
+            self._doc_grams[doc_id] = gram_sets
+
+    def remove(self, doc_id: str):
+        with self._lock:
+            self._remove(doc_id)
+
+    def search(self, query: str, min_similarity: float, candidates: Optional[set] = None) -> List[Tuple[str, float]]:
+        """[(doc_id, độ giống)] giảm dần"""
+        grams = trigrams(query)
+        if not grams:
+            return []
+        shared = set()
+        with self._lock:
+            for gram in grams:
+                shared.update(self._postings.get(gram, ()))
+            results = []
+            for doc_id in shared:
+                if candidates is not None and doc_id not in candidates:
+                    continue
+                similarity = max(len(grams & doc_grams) / min(len(grams), len(doc_grams))
+                                 for doc_grams in self._doc_grams[doc_id])
+                if similarity >= min_similarity:
+                    results.append((doc_id, similarity))
+        results.sort(key=lambda item: item[1], reverse=True)
+        return results
+
+
+class PrefixIndex:
+    """Mảng từ đã sắp xếp theo dạng bỏ dấu (kèm số file chứa từ) để gợi ý theo tiền tố bằng bisect"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys: List[str] = []
+        self._counts: Dict[str, int] = {}
+
+    @staticmethod
+    def _key(term: str) -> str:
+        return f"{fold_diacritics(term)}\x00{term}"
+
+    def add(self, terms: Iterable[str]):
+        with self._lock:
+            for term in terms:
+                key = self._key(term)
+                if key not in self._counts:
+                    self._counts[key] = 0
+                    bisect.insort(self._keys, key)
+                self._counts[key] += 1
+
+    def remove(self, terms: Iterable[str]):
+        with self._lock:
+            for term in terms:
+                key = self._key(term)
+                if key not in self._counts:
+                    continue
+                self._counts[key] -= 1
+                if self._counts[key] <= 0:
+                    del self._counts[key]
+                    del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def complete(self, prefix: str, limit: int) -> List[str]:
+        """Các từ bắt đầu bằng prefix (so sánh không dấu), theo thứ tự chữ cái"""
+        folded = fold_diacritics(unicodedata.normalize('NFC', prefix or '').lower())
+        terms = []
+        with self._lock:
+            start = bisect.bisect_left(self._keys, folded)
+            for key in self._keys[start:]:
+                if not key.startswith(folded) or len(terms) >= limit:
+                    break
+                terms.append(key.split('\x00', 1)[1])
+        return terms
@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.config import UploadJobConfig
+
+# (tên stage, hàm xử lý(danh sách file_id, kết quả các stage trước) -> kết quả JSON được)
+Stage = Tuple[str, Callable[[List[str], Dict], Optional[Dict]]]
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+class UploadJobQueue:
+    """Hàng đợi xử lý sau upload (lưu trên SQLite, chịu được restart).
+
+    Mỗi job gồm một hoặc nhiều file (upload batch là một job để embedding dùng chung
+    và index FAISS chỉ ghi một lần) và các stage chạy tuần tự trong worker thread.
+    Stage lỗi thì job được xếp lại hàng đợi (backoff tăng dần) và chạy tiếp từ stage
+    lỗi, các stage đã xong không chạy lại; quá MaxAttempts lần thì job chuyển sang failed.
+    Một file có thể thuộc nhiều job (vd. index lại khi kích hoạt lại), lịch sử được giữ nguyên:
+    trạng thái lấy theo job mới nhất, stage bị bỏ qua và kết quả lấy từ job gần nhất đã chạy stage đó.
+    """
+
+    def __init__(self, path: str, stages: List[Stage], workers: int = None):
+        self.path = path
+        self.stages = stages
+        self.workers = workers or UploadJobConfig.Workers
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS upload_jobs (
+                job_id TEXT PRIMARY KEY,
+                file_ids TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stages TEXT NOT NULL,
+                results TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                next_attempt_at REAL NOT NULL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS upload_job_files (
+                file_id TEXT NOT NULL,
+                job_id TEXT NOT NULL,
+                PRIMARY KEY (file_id, job_id)
+            )
+            """
+        )
+        # Job đang chạy dở khi process dừng thì chạy lại
+        self._conn.execute("UPDATE upload_jobs SET status = ? WHERE status = ?", (STATUS_QUEUED, STATUS_RUNNING))
+        self._conn.commit()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f"upload-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, file_ids: List[str], only_stages: List[str] = None) -> str:
+        """Tạo job cho một hoặc nhiều file, trả về job_id. only_stages: chỉ chạy các stage này
+        (vd. index lại khi file được kích hoạt lại), các stage khác được đánh dấu bỏ qua"""
+        job_id = str(uuid.uuid4())
+        now = datetime.utcnow().isoformat()
+        stages = {
+            name: {'status': 'pending'} if only_stages is None or name in only_stages
+            else {'status': STATUS_DONE, 'skipped': True}
+            for name, _ in self.stages
+        }
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO upload_jobs "
+                "(job_id, file_ids, status, stages, results, attempts, last_error, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 0, NULL, ?, ?, ?)",
+                (job_id, json.dumps(file_ids), STATUS_QUEUED, json.dumps(stages), json.dumps({}), time.time(), now, now)
+            )
+            self._conn.executemany(
+                "INSERT INTO upload_job_files (file_id, job_id) VALUES (?, ?)",
+                [(file_id, job_id) for file_id in file_ids]
+            )
+            self._conn.commit()
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def _jobs_of(self, file_id: str, columns: str = "j.job_id") -> List[tuple]:
+        """Các job chứa file, mới nhất trước"""
+        return self._conn.execute(
+            f"SELECT {columns} FROM upload_job_files f JOIN upload_jobs j ON j.job_id = f.job_id "
+            "WHERE f.file_id = ? ORDER BY f.rowid DESC",
+            (file_id,)
+        ).fetchall()
+
+    def _job_of(self, file_id: str) -> Optional[str]:
+        rows = self._jobs_of(file_id)
+        return rows[0][0] if rows else None
+
+    def retry(self, file_id: str) -> bool:
+        """Chạy lại job failed (chứa file) từ stage bị lỗi"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE upload_jobs SET status = ?, attempts = 0, next_attempt_at = ?, updated_at = ? "
+                "WHERE job_id = ? AND status = ?",
+                (STATUS_QUEUED, time.time(), datetime.utcnow().isoformat(), self._job_of(file_id), STATUS_FAILED)
+            )
+            self._conn.commit()
+        if cursor.rowcount:
+            self.start()
+            self._wakeup.set()
+        return bool(cursor.rowcount)
+
+    def get_status(self, file_id: str) -> Optional[Dict]:
+        with self._lock:
+            rows = self._jobs_of(
+                file_id, "j.job_id, j.file_ids, j.status, j.stages, j.attempts, j.last_error, j.created_at, j.updated_at"
+            )
+        if not rows:
+            return None
+        job_id, file_ids, status, stages, attempts, last_error, created_at, updated_at = rows[0]
+        # Bỏ qua stage không còn trong pipeline (job tạo từ phiên bản cũ)
+        stages = {name: stage for name, stage in json.loads(stages).items()
+                  if any(name == known for known, _ in self.stages)}
+        # Stage job mới nhất bỏ qua thì hiện trạng thái của job gần nhất đã chạy stage đó
+        for name, stage in stages.items():
+            if not stage.get('skipped'):
+                continue
+            for older in rows[1:]:
+                older_stage = json.loads(older[3]).get(name)
+                if older_stage and not older_stage.get('skipped'):
+                    stages[name] = {**older_stage, 'job_id': older[0]}
+                    break
+        done = sum(1 for stage in stages.values() if stage['status'] == STATUS_DONE)
+        return {
+            'file_id': file_id,
+            'job_id': job_id,
+            'batch_size': len(json.loads(file_ids)),
+            'status': status,
+            'progress': round(done / len(stages), 2) if stages else 1.0,
+            'stages': [{'name': name, **stages[name]} for name, _ in self.stages if name in stages],
+            'attempts': attempts,
+            'last_error': last_error,
+            'jobs': [row[0] for row in rows],
+            'created_at': created_at,
+            'updated_at': updated_at
+        }
+
+    def get_results(self, file_id: str) -> Optional[Dict]:
+        """Kết quả các stage của riêng file trên mọi job của file: {stage: kết quả của job mới nhất có kết quả}"""
+        with self._lock:
+            rows = self._jobs_of(file_id, "j.results")
+        if not rows:
+            return None
+        merged = {}
+        for (results,) in reversed(rows):
+            for stage, stage_results in json.loads(results).items():
+                result = (stage_results or {}).get(file_id)
+                if result is not None or stage not in merged:
+                    merged[stage] = result
+        return merged
+
+    def remove(self, file_id: str):
+        """Bỏ file khỏi các job của nó (file bị xóa), job không còn file nào thì xóa luôn"""
+        with self._lock:
+            rows = self._jobs_of(file_id, "j.job_id, j.file_ids")
+            self._conn.execute("DELETE FROM upload_job_files WHERE file_id = ?", (file_id,))
+            for job_id, file_ids in rows:
+                file_ids = [other for other in json.loads(file_ids) if other != file_id]
+                if file_ids:
+                    self._conn.execute("UPDATE upload_jobs SET file_ids = ? WHERE job_id = ?", (json.dumps(file_ids), job_id))
+                else:
+                    self._conn.execute("DELETE FROM upload_jobs WHERE job_id = ?", (job_id,))
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM upload_jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def _claim(self) -> Optional[Tuple[str, List[str], Dict, Dict, int]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, file_ids, stages, results, attempts FROM upload_jobs "
+                "WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT 1",
+                (STATUS_QUEUED, time.time())
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE upload_jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                (STATUS_RUNNING, datetime.utcnow().isoformat(), row[0])
+            )
+            self._conn.commit()
+        return row[0], json.loads(row[1]), json.loads(row[2]), json.loads(row[3]), row[4]
+
+    def _save(self, job_id: str, status: str, stages: Dict, results: Dict,
+              attempts: int = None, last_error: str = None, next_attempt_at: float = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE upload_jobs SET status = ?, stages = ?, results = ?, attempts = COALESCE(?, attempts), "
+                "last_error = ?, next_attempt_at = COALESCE(?, next_attempt_at), updated_at = ? WHERE job_id = ?",
+                (status, json.dumps(stages), json.dumps(results, default=str), attempts, last_error,
+                 next_attempt_at, datetime.utcnow().isoformat(), job_id)
+            )
+            self._conn.commit()
+
+    def _current_file_ids(self, job_id: str) -> List[str]:
+        # File có thể bị xóa trong lúc job đang chạy
+        with self._lock:
+            row = self._conn.execute("SELECT file_ids FROM upload_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def _run(self, job_id: str, file_ids: List[str], stages: Dict, results: Dict, attempts: int):
+        for name, handler in self.stages:
+            stage = stages.setdefault(name, {'status': 'pending'})
+            if stage['status'] == STATUS_DONE:
+                continue
+            file_ids = self._current_file_ids(job_id)
+            if not file_ids:
+                return
+            stage.update({'status': STATUS_RUNNING, 'started_at': datetime.utcnow().isoformat()})
+            stage.pop('error', None)
+            self._save(job_id, STATUS_RUNNING, stages, results)
+            try:
+                results[name] = handler(file_ids, results)
+            except Exception as e:
+                attempts += 1
+                stage.update({'status': STATUS_FAILED, 'error': str(e)})
+                if attempts >= UploadJobConfig.MaxAttempts:
+                    print(f"[UPLOAD JOB] {job_id} failed at {name} after {attempts} attempts: {e}")
+                    self._save(job_id, STATUS_FAILED, stages, results, attempts, str(e))
+                else:
+                    delay = UploadJobConfig.RetryBackoffSeconds * (2 ** (attempts - 1))
+                    print(f"[UPLOAD JOB] {job_id} stage {name} failed, retrying in {delay}s: {e}")
+                    self._save(job_id, STATUS_QUEUED, stages, results, attempts, str(e), time.time() + delay)
+                return
+            stage.update({'status': STATUS_DONE, 'finished_at': datetime.utcnow().isoformat()})
+        self._save(job_id, STATUS_DONE, stages, results, attempts)
+
+    def _worker_loop(self):
+        while True:
+            job = None
+            try:
+                job = self._claim()
+                if job is not None:
+                    self._run(*job)
+            except Exception as e:
+                print(f"[UPLOAD JOB] Worker error: {e}")
+            if job is None:
+                self._wakeup.wait(UploadJobConfig.PollIntervalSeconds)
+                self._wakeup.clear()
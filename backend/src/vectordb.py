@@ -1,32 +1,497 @@
 from langchain_community.vectorstores import FAISS
-from langchain_ollama import OllamaEmbeddings
 from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
 from langchain.schema import Document
-from src.config import OllamaConfig, FaissConfig
+from src.config import FaissConfig
+from src.answer_cache import answer_cache
+from src.embedding_cache import get_embeddings
+from src.faiss_index import build_index, index_type_of, resolve_index_type, search_params
+from typing import Dict, List, Tuple
 import numpy as np
+import threading
+import atexit
 import faiss
+import uuid
+import time
+import glob
 import os
+try:
+    import fcntl
+except ImportError:  # Windows: không có flock
+    fcntl = None
+
+# Trạng thái ghi đĩa của các vectorstore: id(vectorstore) -> {store, dirty, since}
+_pending: Dict[int, dict] = {}
+# Khóa chung cho mọi thao tác đọc/ghi index FAISS (faiss index không thread-safe khi vừa add vừa search)
+_store_lock = threading.RLock()
+# Chỉ một luồng ghi file index tại một thời điểm
+_flush_lock = threading.Lock()
+_flusher_thread = None
+
+# Khóa ghi index giữa các process (app và reindex_files.py đều giữ vectorstore riêng trong bộ nhớ,
+# ghi đè lên nhau sẽ làm mất vector của bên kia): file {IndexPath}.lock, giữ đến hết process
+_writer_lock_file = None
+_writer_lock_guard = threading.Lock()
+# Bản lưu (generation) mà process này đọc hoặc ghi gần nhất, _NOT_LOADED khi chưa đọc index
+_NOT_LOADED = object()
+_loaded_generation = _NOT_LOADED
+
+
+class IndexLockedError(RuntimeError):
+    """Process khác đang ghi index, hoặc đã ghi bản mới hơn bản process này đang giữ"""
+
+# Vectorstore dùng chung cho cả process (llm, file_manager, chat_manager, reindex)
+_shared_store = None
+
+# Trạng thái id của index: id(vectorstore) -> {tombstones, next_id, postings}
+# Vector bị xóa chỉ được đánh dấu tombstone, compact() mới xóa hẳn khỏi index
+_id_states: Dict[int, dict] = {}
+
+# Các trường metadata có thể lọc khi search: field -> value -> tập id vector
+FILTER_FIELDS = ('uploaded_by', 'department', 'file_id', 'source')
 
 def init_vector_store() -> FAISS:
-    model = OllamaEmbeddings(model = OllamaConfig.EmbeddingModel)
+    model = get_embeddings()
     FaissConfig.print_paths()  # Log the resolved paths for debugging
-    if os.path.exists(FaissConfig.IndexPath):
-        return FAISS(
+    global _loaded_generation
+    _loaded_generation = _read_generation()
+    stored = _stored_paths()
+    if stored is not None:
+        index_path, docstore_path, map_id_path = stored
+        vectorstore = FAISS(
             embedding_function=model,
-            index=faiss.read_index(FaissConfig.IndexPath),
-            docstore=InMemoryDocstore(np.load(FaissConfig.DocumentStorePath, allow_pickle=True).item()),
-            index_to_docstore_id=np.load(FaissConfig.MapIdPath, allow_pickle=True).item()
+            index=faiss.read_index(index_path),
+            docstore=InMemoryDocstore(np.load(docstore_path, allow_pickle=True).item()),
+            index_to_docstore_id=np.load(map_id_path, allow_pickle=True).item()
         )
-    return FAISS.from_texts([""], model)
+    else:
+        vectorstore = FAISS.from_texts([""], model)
+    if _ensure_id_map(vectorstore):
+        _mark_dirty(vectorstore, vectorstore.index.ntotal, defer=True)
+    if needs_rebuild(vectorstore):
+        print(f"[FAISS] Index type is {index_type_of(vectorstore.index)}, configured "
+              f"{resolve_index_type(len(vectorstore.index_to_docstore_id))}; "
+              f"run `python reindex_files.py --rebuild-index` to migrate")
+    return vectorstore
 
-def add_document(vectorstore, content: str, metadata: dict):
+def _ensure_id_map(vectorstore: FAISS) -> bool:
+    """Chuyển index phẳng cũ (id = vị trí) sang IndexIDMap2 để id vector ổn định khi xóa"""
+    index = vectorstore.index
+    if isinstance(index, faiss.IndexIDMap2):
+        return False
+    id_index = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+    if index.ntotal:
+        ids = np.array(sorted(vectorstore.index_to_docstore_id.keys()), dtype=np.int64)
+        id_index.add_with_ids(index.reconstruct_n(0, index.ntotal), ids)
+    vectorstore.index = id_index
+    print(f"[FAISS] Migrated index to IndexIDMap2 ({index.ntotal} vectors)")
+    return True
+
+def _id_state(vectorstore: FAISS) -> dict:
+    """Tombstone = id có trong index nhưng không còn trong index_to_docstore_id"""
+    state = _id_states.get(id(vectorstore))
+    if state is None:
+        index_ids = faiss.vector_to_array(vectorstore.index.id_map)
+        live_ids = set(vectorstore.index_to_docstore_id.keys())
+        state = {
+            'tombstones': {int(i) for i in index_ids if int(i) not in live_ids},
+            'next_id': int(index_ids.max()) + 1 if len(index_ids) else 0,
+            'postings': {field: {} for field in FILTER_FIELDS}
+        }
+        for int_id, doc_id in vectorstore.index_to_docstore_id.items():
+            doc = vectorstore.docstore._dict.get(doc_id)
+            if doc is not None:
+                _add_postings(state, int_id, doc.metadata)
+        _id_states[id(vectorstore)] = state
+    return state
+
+def _add_postings(state: dict, int_id: int, metadata: dict):
+    for field in FILTER_FIELDS:
+        value = (metadata or {}).get(field)
+        if value is not None:
+            state['postings'][field].setdefault(value, set()).add(int_id)
+
+def _remove_postings(state: dict, int_id: int, metadata: dict):
+    for field in FILTER_FIELDS:
+        value = (metadata or {}).get(field)
+        ids = state['postings'][field].get(value)
+        if ids is not None:
+            ids.discard(int_id)
+            if not ids:
+                del state['postings'][field][value]
+
+def _allowed_ids(vectorstore: FAISS, metadata_filter: List[Dict]) -> set:
+    """Tập id vector khớp filter: OR giữa các clause, AND giữa các field trong một clause.
+    Giá trị của field có thể là một giá trị hoặc list giá trị, vd:
+    [{"source": "uploaded_file", "uploaded_by": "u1"}, {"department": "HR"}]"""
+    postings = _id_state(vectorstore)['postings']
+    allowed = set()
+    for clause in metadata_filter:
+        matched = None
+        for field, values in clause.items():
+            if field not in postings:
+                raise ValueError(f"Unsupported filter field: {field}")
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            field_ids = set().union(*(postings[field].get(value, set()) for value in values))
+            matched = field_ids if matched is None else matched & field_ids
+        if matched:
+            allowed |= matched
+    return allowed
+
+def get_vector_store() -> FAISS:
+    """Lấy vectorstore dùng chung, chỉ đọc index từ đĩa một lần cho cả process"""
+    global _shared_store
+    if _shared_store is None:
+        with _store_lock:
+            if _shared_store is None:
+                _shared_store = init_vector_store()
+    return _shared_store
+
+def _atomic_save_npy(path: str, data):
+    """Ghi file .npy qua file tạm rồi rename để không bao giờ để lại file ghi dở"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _atomic_write_bytes(data: bytes, path: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _pointer_path() -> str:
+    return f"{FaissConfig.IndexPath}.current"
+
+def _generation_paths(generation: int) -> Tuple[str, str, str]:
+    """(index, docstore, map id) của một bản lưu, vd. index.bin.7, docstore.npy.7, map_id.npy.7"""
+    return tuple(f"{path}.{generation}" for path in
+                 (FaissConfig.IndexPath, FaissConfig.DocumentStorePath, FaissConfig.MapIdPath))
+
+def _read_generation():
+    """Bản lưu hiện tại (số trong file con trỏ index.bin.current), None nếu chưa có"""
+    try:
+        with open(_pointer_path(), 'r') as f:
+            return int(f.read().strip())
+    except FileNotFoundError:
+        return None
+
+def _stored_paths():
+    """(index, docstore, map id) của bản lưu hiện tại, None nếu chưa lưu lần nào"""
+    generation = _read_generation()
+    if generation is not None:
+        return _generation_paths(generation)
+    # Bản lưu cũ (ghi thẳng vào các đường dẫn cấu hình, trước khi có generation)
+    if os.path.exists(FaissConfig.IndexPath):
+        return FaissConfig.IndexPath, FaissConfig.DocumentStorePath, FaissConfig.MapIdPath
+    return None
+
+def _remove_old_generations(current: int):
+    for path in (FaissConfig.IndexPath, FaissConfig.DocumentStorePath, FaissConfig.MapIdPath):
+        stale = [path] + [other for other in glob.glob(f"{glob.escape(path)}.*")
+                          if other.rsplit('.', 1)[1].isdigit() and int(other.rsplit('.', 1)[1]) != current]
+        for other in stale:
+            try:
+                os.remove(other)
+            except FileNotFoundError:
+                pass
+
+def acquire_writer_lock():
+    """Lấy khóa ghi index cho process này (không chờ). Raise IndexLockedError nếu process khác
+    đang giữ khóa, hoặc bản lưu trên đĩa đã được process khác ghi sau khi process này đọc index
+    (phải khởi động lại để đọc bản mới, tránh ghi đè mất vector)"""
+    global _writer_lock_file
+    with _writer_lock_guard:
+        if _writer_lock_file is not None:
+            return
+        if fcntl is None:
+            print("[FAISS] File locking is not available, concurrent writers are not detected")
+            _writer_lock_file = False
+            return
+        lock_file = open(f"{FaissConfig.IndexPath}.lock", 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise IndexLockedError(f"Index FAISS đang được process khác ghi ({FaissConfig.IndexPath}.lock)")
+        if _loaded_generation is not _NOT_LOADED and _read_generation() != _loaded_generation:
+            lock_file.close()
+            raise IndexLockedError("Index FAISS trên đĩa đã được process khác ghi sau khi process này đọc, "
+                                   "khởi động lại để đọc bản mới")
+        _writer_lock_file = lock_file
+
+def _persist(snapshot: dict):
+    global _loaded_generation
     FaissConfig.print_paths()  # Log the resolved paths for debugging
+    # Ba file của một lần flush được ghi thành bản lưu mới (generation + 1), sau đó mới đổi
+    # con trỏ: process bị dừng giữa chừng thì bản lưu cũ vẫn nguyên vẹn và khớp nhau
+    generation = (_read_generation() or 0) + 1
+    index_path, docstore_path, map_id_path = _generation_paths(generation)
+    _atomic_save_npy(docstore_path, snapshot['docstore'])
+    _atomic_save_npy(map_id_path, snapshot['index_to_docstore_id'])
+    _atomic_write_bytes(snapshot['index'].tobytes(), index_path)
+    _atomic_write_bytes(str(generation).encode('ascii'), _pointer_path())
+    _loaded_generation = generation
+    _remove_old_generations(generation)
+
+def _snapshot(vectorstore: FAISS) -> dict:
+    """Chụp trạng thái index trong khóa để phần ghi đĩa chậm không chặn search"""
+    return {
+        'index': faiss.serialize_index(vectorstore.index),
+        'docstore': dict(vectorstore.docstore._dict),
+        'index_to_docstore_id': dict(vectorstore.index_to_docstore_id)
+    }
+
+def flush(vectorstore: FAISS = None) -> int:
+    """Ghi các vectorstore còn thay đổi chưa lưu xuống đĩa, trả về số document đã flush"""
+    flushed = 0
+    with _flush_lock:
+        with _store_lock:
+            keys = [id(vectorstore)] if vectorstore is not None else list(_pending.keys())
+            entries = [(key, _pending.pop(key)) for key in keys if key in _pending]
+            snapshots = [(key, entry, _snapshot(entry['store'])) for key, entry in entries]
+        for key, entry, snapshot in snapshots:
+            try:
+                acquire_writer_lock()
+                _persist(snapshot)
+                flushed += entry['dirty']
+            except Exception as e:
+                # Giữ lại trạng thái dirty để lần flush sau thử lại
+                with _store_lock:
+                    current = _pending.setdefault(key, {'store': entry['store'], 'dirty': 0, 'since': entry['since']})
+                    current['dirty'] += entry['dirty']
+                print(f"[FAISS] Error flushing vector store: {e}")
+    return flushed
+
+def _flush_loop():
+    while True:
+        time.sleep(max(FaissConfig.FlushIntervalSeconds / 2, 0.5))
+        now = time.time()
+        with _store_lock:
+            expired = [
+                entry['store'] for entry in _pending.values()
+                if now - entry['since'] >= FaissConfig.FlushIntervalSeconds
+            ]
+        for store in expired:
+            flush(store)
+
+def _ensure_flusher():
+    global _flusher_thread
+    if _flusher_thread is None or not _flusher_thread.is_alive():
+        _flusher_thread = threading.Thread(target=_flush_loop, name="faiss-flusher", daemon=True)
+        _flusher_thread.start()
+
+def _mark_dirty(vectorstore: FAISS, count: int, defer: bool = False):
+    with _store_lock:
+        entry = _pending.setdefault(id(vectorstore), {'store': vectorstore, 'dirty': 0, 'since': time.time()})
+        entry['dirty'] += count
+        should_flush = not defer and entry['dirty'] >= FaissConfig.FlushDirtyThreshold
+    if should_flush:
+        flush(vectorstore)
+    else:
+        _ensure_flusher()
+
+def add_documents_bulk(vectorstore: FAISS, documents: List[Document], flush_now: bool = False) -> int:
+    """Thêm nhiều document trong một lần gọi; việc ghi index được gom lại (write-behind)"""
+    documents = [doc for doc in documents if doc.page_content and doc.page_content.strip()]
+    if not documents:
+        return 0
+    # Gọi embedding ngoài khóa để không chặn các request đang search
+    embeddings = vectorstore.embedding_function.embed_documents([doc.page_content for doc in documents])
+    return add_embedded_documents(vectorstore, documents, embeddings, flush_now=flush_now)
+
+def add_embedded_documents(vectorstore: FAISS, documents: List[Document], embeddings: List[List[float]],
+                           flush_now: bool = False) -> int:
+    """Thêm các document đã có sẵn vector (vd: embed song song ở nơi khác)"""
+    if not documents:
+        return 0
+    vectors = np.array(embeddings, dtype=np.float32)
+    with _store_lock:
+        state = _id_state(vectorstore)
+        int_ids = np.arange(state['next_id'], state['next_id'] + len(documents), dtype=np.int64)
+        vectorstore.index.add_with_ids(vectors, int_ids)
+        state['next_id'] += len(documents)
+        doc_ids = [str(uuid.uuid4()) for _ in documents]
+        vectorstore.docstore.add({
+            doc_id: Document(page_content=doc.page_content, metadata=doc.metadata)
+            for doc_id, doc in zip(doc_ids, documents)
+        })
+        vectorstore.index_to_docstore_id.update(
+            {int(int_id): doc_id for int_id, doc_id in zip(int_ids, doc_ids)}
+        )
+        for int_id, doc in zip(int_ids, documents):
+            _add_postings(state, int(int_id), doc.metadata)
+    _mark_dirty(vectorstore, len(documents))
+    if flush_now:
+        flush(vectorstore)
+    return len(documents)
+
+def add_document(vectorstore, content: str, metadata: dict):
     doc = Document(page_content=content, metadata=metadata)
-    vectorstore.add_documents([doc])
-    faiss.write_index(vectorstore.index, FaissConfig.IndexPath)
-    np.save(FaissConfig.DocumentStorePath, vectorstore.docstore._dict)
-    np.save(FaissConfig.MapIdPath, vectorstore.index_to_docstore_id)
-
-def semantic_search(vectorstore: FAISS, query: str):
-    retriever = vectorstore.as_retriever(k=3, search_type="mmr")
-    return retriever.invoke(query)
\ No newline at end of file
+    add_documents_bulk(vectorstore, [doc])
+
+def get_indexed_file_ids(vectorstore: FAISS) -> set:
+    """Tập file_id đang có vector trong store"""
+    with _store_lock:
+        return set(_id_state(vectorstore)['postings']['file_id'].keys())
+
+def get_file_chunks(vectorstore: FAISS, file_id: str):
+    """Các chunk (documents, vectors) của một file, vd để copy sang file trùng nội dung
+    mà không phải embed lại. Index nén (IVF-PQ) thì embed lại từ text (trúng cache embedding)"""
+    with _store_lock:
+        int_ids = sorted(_id_state(vectorstore)['postings']['file_id'].get(file_id, set()))
+        documents = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]) for i in int_ids]
+        vectors = None
+        if int_ids and index_type_of(vectorstore.index) != 'ivfpq':
+            vectors = np.vstack([vectorstore.index.reconstruct(i) for i in int_ids])
+    if documents and vectors is None:
+        vectors = np.array(vectorstore.embedding_function.embed_documents(
+            [doc.page_content for doc in documents]), dtype=np.float32)
+    return documents, vectors
+
+def remove_by_file_id(vectorstore: FAISS, file_id: str) -> int:
+    """Xóa mọi chunk của một file khỏi kết quả search (tombstone), trả về số vector đã xóa"""
+    # File bị xóa hoặc index lại: câu trả lời đã cache trích dẫn file này không còn đúng
+    answer_cache.invalidate_file(file_id)
+    return remove_where(vectorstore, 'file_id', file_id)
+
+def remove_where(vectorstore: FAISS, field: str, value) -> int:
+    """Tombstone mọi vector có metadata[field] == value (field thuộc FILTER_FIELDS)"""
+    with _store_lock:
+        state = _id_state(vectorstore)
+        removed = sorted(state['postings'][field].get(value, set()))
+        if not removed:
+            return 0
+        doc_ids = []
+        for int_id in removed:
+            doc_id = vectorstore.index_to_docstore_id.pop(int_id)
+            doc = vectorstore.docstore._dict.get(doc_id)
+            _remove_postings(state, int_id, doc.metadata if doc is not None else {field: value})
+            state['tombstones'].add(int_id)
+            doc_ids.append(doc_id)
+        vectorstore.docstore.delete(doc_ids)
+        needs_compaction = dead_ratio(vectorstore) >= FaissConfig.CompactDeadRatio
+    _mark_dirty(vectorstore, len(removed))
+    if needs_compaction:
+        compact(vectorstore)
+    return len(removed)
+
+def dead_ratio(vectorstore: FAISS) -> float:
+    with _store_lock:
+        total = vectorstore.index.ntotal
+        return len(_id_state(vectorstore)['tombstones']) / total if total else 0.0
+
+def get_live_vectors(vectorstore: FAISS):
+    """Lấy (ids, vectors) còn sống; index nén (IVF-PQ) thì embed lại từ text (trúng cache embedding)"""
+    live_ids = np.array(sorted(vectorstore.index_to_docstore_id.keys()), dtype=np.int64)
+    if not len(live_ids):
+        return live_ids, None
+    if index_type_of(vectorstore.index) == 'ivfpq':
+        texts = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(i)]).page_content for i in live_ids]
+        vectors = np.array(vectorstore.embedding_function.embed_documents(texts), dtype=np.float32)
+    else:
+        vectors = np.vstack([vectorstore.index.reconstruct(int(i)) for i in live_ids])
+    return live_ids, vectors
+
+def rebuild_index(vectorstore: FAISS, index_type: str = None) -> str:
+    """Dựng lại index với loại cấu hình (train IVF-PQ nếu cần), bỏ luôn các tombstone"""
+    with _store_lock:
+        state = _id_state(vectorstore)
+        live_ids, vectors = get_live_vectors(vectorstore)
+        dropped = len(state['tombstones'])
+        vectorstore.index = build_index(vectorstore.index.d, vectors, live_ids, index_type=index_type)
+        state['tombstones'] = set()
+        built_type = index_type_of(vectorstore.index)
+    print(f"[FAISS] Rebuilt index as {built_type} ({len(live_ids)} vectors, dropped {dropped} dead)")
+    _mark_dirty(vectorstore, max(len(live_ids), 1))
+    return built_type
+
+def compact(vectorstore: FAISS) -> int:
+    """Dựng lại index chỉ với các vector còn sống, trả về số tombstone đã loại bỏ"""
+    with _store_lock:
+        dropped = len(_id_state(vectorstore)['tombstones'])
+        if not dropped:
+            return 0
+        rebuild_index(vectorstore)
+    return dropped
+
+def needs_rebuild(vectorstore: FAISS) -> bool:
+    """Index hiện tại khác loại nên dùng theo cấu hình + kích thước (vd: Flat đã đủ lớn để chuyển HNSW)"""
+    with _store_lock:
+        live = len(vectorstore.index_to_docstore_id)
+        return index_type_of(vectorstore.index) != resolve_index_type(live)
+
+def _search_params(vectorstore: FAISS):
+    """Tham số search loại bỏ các tombstone ngay trong FAISS thay vì lọc sau"""
+    tombstones = _id_state(vectorstore)['tombstones']
+    selector = None
+    if tombstones:
+        selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(np.array(sorted(tombstones), dtype=np.int64)))
+    return search_params(vectorstore.index, selector)
+
+def _candidates_in(vectorstore: FAISS, query: np.ndarray, allowed: set, fetch_k: int) -> List[int]:
+    """Search chính xác trên tập id nhỏ (tránh recall thấp của HNSW/IVF khi filter rất chặt)"""
+    ids = np.array(sorted(allowed), dtype=np.int64)
+    vectors = np.vstack([vectorstore.index.reconstruct(int(i)) for i in ids])
+    distances = ((vectors - query[0]) ** 2).sum(axis=1)
+    return [int(ids[i]) for i in np.argsort(distances)[:fetch_k]]
+
+def _candidates(vectorstore: FAISS, query: np.ndarray, fetch_k: int, metadata_filter: List[Dict] = None) -> List[int]:
+    """Id vector gần nhất (theo thứ tự) trong số document được phép, gọi khi đang giữ _store_lock"""
+    index = vectorstore.index
+    if metadata_filter is None:
+        _, ids = index.search(query, fetch_k, params=_search_params(vectorstore))
+        candidates = [int(i) for i in ids[0] if i != -1]
+    else:
+        # Filter được áp dụng trong lúc search nên luôn lấy đủ top-k trong số document được phép
+        allowed = _allowed_ids(vectorstore, metadata_filter)
+        if not allowed:
+            return []
+        if index_type_of(index) != 'flat' and len(allowed) <= FaissConfig.FilterExactSearchMax:
+            candidates = _candidates_in(vectorstore, query, allowed, fetch_k)
+        else:
+            selector = faiss.IDSelectorBatch(np.array(sorted(allowed), dtype=np.int64))
+            _, ids = index.search(query, fetch_k, params=search_params(index, selector))
+            candidates = [int(i) for i in ids[0] if i != -1]
+    return [i for i in candidates if i in vectorstore.index_to_docstore_id]
+
+def mmr_rank_by_vector(vectorstore: FAISS, embedding: List[float], k: int = 4, fetch_k: int = 20,
+                       lambda_mult: float = 0.5, metadata_filter: List[Dict] = None) -> List[Tuple[str, Document]]:
+    """[(docstore id, document)] theo thứ tự MMR (dùng để trộn hạng với tìm kiếm từ khóa)"""
+    query = np.array([embedding], dtype=np.float32)
+    with _store_lock:
+        candidates = _candidates(vectorstore, query, fetch_k, metadata_filter)
+        if not candidates:
+            return []
+        vectors = np.vstack([vectorstore.index.reconstruct(i) for i in candidates])
+        selected = maximal_marginal_relevance(query[0], vectors, k=min(k, len(candidates)), lambda_mult=lambda_mult)
+        return [
+            (vectorstore.index_to_docstore_id[candidates[i]],
+             vectorstore.docstore.search(vectorstore.index_to_docstore_id[candidates[i]]))
+            for i in selected
+        ]
+
+def mmr_search_by_vector(vectorstore: FAISS, embedding: List[float], k: int = 4, fetch_k: int = 20,
+                         lambda_mult: float = 0.5, metadata_filter: List[Dict] = None) -> List[Document]:
+    return [doc for _, doc in mmr_rank_by_vector(vectorstore, embedding, k, fetch_k, lambda_mult, metadata_filter)]
+
+def search_by_vector(vectorstore: FAISS, embedding: List[float], k: int = 20,
+                     metadata_filter: List[Dict] = None) -> List[Tuple[str, Document]]:
+    """[(docstore id, document)] gần nhất trước, không MMR (dùng để trộn hạng với tìm kiếm từ khóa)"""
+    query = np.array([embedding], dtype=np.float32)
+    with _store_lock:
+        return [
+            (vectorstore.index_to_docstore_id[i], vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]))
+            for i in _candidates(vectorstore, query, k, metadata_filter)
+        ]
+
+def semantic_search(vectorstore: FAISS, query: str, metadata_filter: List[Dict] = None):
+    embedding = vectorstore.embedding_function.embed_query(query)
+    return mmr_search_by_vector(vectorstore, embedding, metadata_filter=metadata_filter)
+
+# Không mất các document còn trong buffer khi process dừng bình thường
+atexit.register(flush)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Script test để kiểm tra FlaskAsgiApp chạy các request song song trên thread pool
+(request chậm như SSE / LLM stream không được chặn các request khác)
+"""
+
+import sys
+import os
+import time
+import asyncio
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src.asgi_server import FlaskAsgiApp
+
+SLEEP_SECONDS = 1.0
+CONCURRENT_REQUESTS = 4
+
+
+def slow_wsgi_app(environ, start_response):
+    time.sleep(SLEEP_SECONDS)
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'ok']
+
+
+async def call(app, path: str) -> list:
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'',
+        'http_version': '1.1', 'headers': [], 'server': ('localhost', 80)
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages
+
+
+async def run_concurrently(app) -> tuple:
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(call(app, f'/slow/{i}') for i in range(CONCURRENT_REQUESTS)))
+    return time.perf_counter() - started, responses
+
+
+def test_asgi_requests_run_concurrently():
+    """4 request cùng ngủ 1s phải xong trong ~1s, không phải ~4s"""
+    print("=== TEST ASGI CONCURRENCY ===")
+    app = FlaskAsgiApp(slow_wsgi_app, threads=CONCURRENT_REQUESTS)
+    elapsed, responses = asyncio.run(run_concurrently(app))
+    print(f"{CONCURRENT_REQUESTS} requests took {elapsed:.2f}s")
+
+    for messages in responses:
+        assert messages[0]['type'] == 'http.response.start' and messages[0]['status'] == 200
+        assert b''.join(m.get('body', b'') for m in messages[1:]) == b'ok'
+    assert elapsed < SLEEP_SECONDS * 2, f"Requests ran sequentially ({elapsed:.2f}s)"
+    print("✓ Requests chạy song song")
+
+
+if __name__ == "__main__":
+    test_asgi_requests_run_concurrently()
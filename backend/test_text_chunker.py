@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Script test để kiểm tra chia chunk theo câu (src/file_utils/text_chunker.py)
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from langchain.schema import Document
+from src.file_utils.text_chunker import chunk_text, chunk_documents
+
+
+def _long_sentence_text() -> str:
+    # Nhiều câu ngắn rồi một câu dài gần bằng chunk_size: câu dài không vừa chunk sau khi lùi chồng lấp
+    short = "".join(f"Câu ngắn số {i:02d} ở đây. " for i in range(40))
+    long_sentence = "Câu dài " + "từ " * 300 + "kết thúc."
+    return short + long_sentence + " Câu cuối cùng."
+
+
+def _assert_no_redundant_spans(chunks):
+    for (prev_start, prev_end), (start, end) in zip(chunks, chunks[1:]):
+        assert not (prev_start <= start and end <= prev_end), \
+            f"Chunk ({start}, {end}) nằm trong chunk trước ({prev_start}, {prev_end})"
+        assert end > prev_end, f"Chunk ({start}, {end}) không đi tiếp sau ({prev_start}, {prev_end})"
+
+
+def test_no_chunk_contained_in_predecessor():
+    """Không chunk nào nằm gọn trong chunk ngay trước nó"""
+    print("=== TEST CHUNK OVERLAP ===")
+    text = _long_sentence_text()
+    for chunk_size, chunk_overlap in [(1000, 150), (950, 150), (500, 200), (300, 299)]:
+        chunks = chunk_text(text, chunk_size, chunk_overlap)
+        print(f"chunk_size={chunk_size}, overlap={chunk_overlap}: {len(chunks)} chunks")
+        _assert_no_redundant_spans(chunks)
+        assert all(end - start <= chunk_size for start, end in chunks)
+        assert chunks[0][0] == 0 and chunks[-1][1] == len(text)
+    print("✓ Không có chunk thừa")
+
+
+def test_overlap_kept_when_next_sentence_fits():
+    """Các câu ngắn vẫn được chồng lấp giữa hai chunk liên tiếp"""
+    text = "".join(f"Câu ngắn số {i:02d} ở đây. " for i in range(100))
+    chunks = chunk_text(text, 200, 50)
+    _assert_no_redundant_spans(chunks)
+    assert all(start < prev_end for (_, prev_end), (start, _) in zip(chunks, chunks[1:]))
+    print("✓ Chunk liên tiếp vẫn chồng lấp")
+
+
+def test_offsets_match_page_content():
+    """start_offset/end_offset (dùng cho trích dẫn) trỏ đúng vào nội dung chunk đã bỏ khoảng trắng"""
+    text = "  \n  Đoạn đầu tiên có vài câu. Câu thứ hai ở đây.  \n\n   Đoạn hai. " + "Câu tiếp. " * 30 + "  "
+    for doc in chunk_documents([Document(page_content=text)], 120, 30):
+        start, end = doc.metadata['start_offset'], doc.metadata['end_offset']
+        assert text[start:end] == doc.page_content, f"Offset ({start}, {end}) lệch khỏi nội dung chunk"
+        assert doc.page_content == doc.page_content.strip()
+    print("✓ Offset khớp nội dung chunk")
+
+
+def test_degenerate_sizes():
+    """chunk_size rất nhỏ vẫn kết thúc, overlap >= chunk_size bị từ chối"""
+    chunks = chunk_text("ab cd  ef", 1, 0)
+    assert all(end - start <= 1 for start, end in chunks)
+    assert chunks[-1][1] == len("ab cd  ef")
+    for chunk_size, chunk_overlap in [(1, 1), (100, 150)]:
+        try:
+            chunk_text("Một câu.", chunk_size, chunk_overlap)
+        except ValueError:
+            continue
+        raise AssertionError(f"chunk_size={chunk_size}, overlap={chunk_overlap} phải bị từ chối")
+    print("✓ Kích thước chunk bất thường được xử lý")
+
+
+if __name__ == "__main__":
+    test_no_chunk_contained_in_predecessor()
+    test_overlap_kept_when_next_sentence_fits()
+    test_offsets_match_page_content()
+    test_degenerate_sizes()